@@ -0,0 +1,245 @@
+"""
+Throughput benchmarks of the simulation core and of the runtime.
+
+Run from the root of the repository:
+
+    python benchmarks/run_benchmarks.py [-q] [-k pattern] [--compare results.json]
+
+Every benchmark is run `--repeat` times and the best throughput is reported
+(ticks/s for the core, messages/s for the delivery path).
+The results are saved to `benchmarks/results/<date>_<commit>.json`.
+With `--compare`, every result is compared with the same benchmark in
+a previous results file, and the benchmarks that became slower by more than
+`--threshold` are listed as regressions (and the exit code is 1).
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from fnmatch import fnmatch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import iotsim.core as core
+import iotsim.behaviors as behaviors
+import iotsim.triggers as triggers
+import iotsim.controls as controls
+import iotsim.readers as readers
+import iotsim.networks as networks
+from iotsim.constructors import Flatline, Seesaw, Pulser, SimpleActuator
+
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+CONSTRUCTORS = {
+    'Flatline': Flatline,
+    'Seesaw': Seesaw,
+    'Pulser': Pulser,
+    'SimpleActuator': SimpleActuator,
+}
+
+
+def seesaws(n_signals):
+    """Assembly of `n_signals` independent seesaw signals."""
+    signals = []
+    for i in range(n_signals):
+        f, forward, back = 'f{}'.format(i), 'b{}.forward'.format(i), 'b{}.return'.format(i)
+        to_return = controls.UpdateParametersControl(
+            '', forward, 'on_yield', triggers.HistoryOutOfRangeTrigger('', f, 0, 0, 10),
+            update_choices=[[(f, 'running_behavior', back)]])
+        to_forward = controls.UpdateParametersControl(
+            '', back, 'on_yield', triggers.HistoryOutOfRangeTrigger('', f, 0, 10, 0),
+            update_choices=[[(f, 'running_behavior', forward)]])
+        feature = core.Feature(f, [behaviors.LinearBehavior(forward, bias=0, increment=1),
+                                   behaviors.LinearBehavior(back, bias=10, increment=-2)],
+                               controls=[to_return, to_forward])
+        signals.append(core.Signal(name='s{}'.format(i), feature=feature,
+                                   reader=readers.PassthroughReader(''),
+                                   network=networks.IdealNetwork('')))
+    return core.Assembly(signals, name='seesaws')
+
+
+def controlled_flatline(n_controls):
+    """Assembly of one flat signal with `n_controls` controls firing every tick."""
+    control_list = [controls.ResetCounterControl('', 'b', 'on_yield', triggers.Always(),
+                                                 component='f', counter='n{}'.format(i))
+                    for i in range(n_controls)]
+    feature = core.Feature('f', [behaviors.FlatlineBehavior('b', level=1)],
+                           controls=control_list)
+    signal = core.Signal(name='flat', feature=feature,
+                         reader=readers.PassthroughReader(''),
+                         network=networks.IdealNetwork(''))
+    return core.Assembly([signal], name='controlled')
+
+
+def noisy_actuator(history_depth):
+    constructor = SimpleActuator(history_depth=history_depth, seed=1)
+    constructor.attach_reader(readers.EveryNthReader(step=2, noise=0.1))
+    constructor.attach_network(networks.NormalNetwork(delay=2, jitter=0.5, drop_rate=0.1))
+    return constructor()
+
+
+def per_tick(make_assembly, ticks):
+    def run():
+        runner = make_assembly().launch()
+        started_at = time.perf_counter()
+        for _, _ in zip(range(ticks), runner):
+            pass
+        return ticks / (time.perf_counter() - started_at)
+    return run
+
+
+def batched(make_assembly, ticks, batch=10000, signals=1, next_event=False):
+    def run():
+        runner = make_assembly().launch(batch=min(batch, ticks), next_event=next_event)
+        started_at = time.perf_counter()
+        done = 0
+        next(runner)
+        done += min(batch, ticks)
+        while done < ticks:
+            runner.send(min(batch, ticks - done))
+            done += min(batch, ticks - done)
+        return signals * ticks / (time.perf_counter() - started_at)
+    return run
+
+
+def delivery(ticks, message_format='json'):
+    """Messages/s through run_assembly.py's fast mode into the null destination."""
+    def run():
+        with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+            json.dump({'routing': {'reading': ['null'], 'truth': ['null']},
+                       'message_format': message_format}, f)
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.join(ROOT, 'run_assembly.py'), '-a',
+                 '-t', str(ticks), '-c', f.name, os.path.join(ROOT, 'assembly.yml')],
+                capture_output=True, text=True, check=True, cwd=ROOT)
+        finally:
+            os.remove(f.name)
+        return float(re.search(r'\(([\d.]+) messages/s\)', completed.stderr).group(1))
+    return run
+
+
+def benchmarks(scale):
+    """Return dict {benchmark name: (unit, function returning throughput)}.
+
+       Throughput of the scaling with the number of signals is in ticks/s
+       of one signal, i.e. ticks of the assembly times the number of signals.
+    """
+    ticks = int(20000 * scale)
+    result = dict()
+    for name, constructor in CONSTRUCTORS.items():
+        result['core.{}.per_tick'.format(name)] = ('ticks/s', per_tick(constructor(), ticks))
+        result['core.{}.batch'.format(name)] = ('ticks/s', batched(constructor(), 5 * ticks))
+    for duration in [10, 100, 1000]:
+        make_assembly = SimpleActuator(control_off_duration=duration,
+                                       control_on_duration=duration,
+                                       sensor_rise_rate=1 / duration,
+                                       sensor_fall_rate=1 / duration)
+        result['next_event.actuator.{}'.format(duration)] = (
+            'ticks/s', batched(make_assembly, 5 * ticks, next_event=True))
+    for n in [1, 10, 100]:
+        result['scaling.signals.{}'.format(n)] = (
+            'ticks/s', batched(lambda n=n: seesaws(n), ticks // n, signals=n))
+    for depth in [1, 100, 10000]:
+        result['scaling.history_depth.{}'.format(depth)] = (
+            'ticks/s', batched(lambda depth=depth: noisy_actuator(depth), ticks))
+    for n in [0, 10, 100]:
+        result['scaling.controls.{}'.format(n)] = (
+            'ticks/s', per_tick(lambda n=n: controlled_flatline(n), ticks // 4))
+    for message_format in ['json', 'struct']:
+        result['runtime.delivery.{}'.format(message_format)] = (
+            'messages/s', delivery(ticks, message_format))
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, previous, threshold):
+    """Print the change of every benchmark; return the names of regressions."""
+    regressions = []
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        ratio = result['value'] / previous[name]['value']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  <-- regression'
+            regressions.append(name)
+        print("{:40s} {:>14,.0f} vs {:>14,.0f} {:>+7.1%}{}".format(
+              name, result['value'], previous[name]['value'], ratio - 1, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput benchmarks of iotsim')
+    parser.add_argument('-k', '--select', metavar='pattern', default='*',
+                        help="Run the benchmarks with names matching this pattern.")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="Number of runs of every benchmark; the best is kept.")
+    parser.add_argument('-s', '--scale', type=float, default=1,
+                        help="Factor of the number of ticks of every benchmark.")
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help="Same as --repeat 1 --scale 0.1.")
+    parser.add_argument('-c', '--compare', metavar='results_filename',
+                        help="Previous results to compare with.")
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help="Slowdown reported as a regression, 0.1 means 10%%.")
+    parser.add_argument('-o', '--output', metavar='results_filename',
+                        help="Where to save the results.")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.repeat, args.scale = 1, 0.1
+
+    results = dict()
+    for name, (unit, run) in benchmarks(args.scale).items():
+        if not fnmatch(name, args.select):
+            continue
+        value = max(run() for _ in range(args.repeat))
+        results[name] = dict(value=value, unit=unit)
+        print("{:40s} {:>14,.0f} {}".format(name, value, unit))
+
+    commit = git_commit()
+    report = dict(
+        commit=commit,
+        date=datetime.datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        repeat=args.repeat,
+        scale=args.scale,
+        results=results,
+    )
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, '{}_{}.json'.format(
+            datetime.date.today().isoformat(), commit))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results saved to {}".format(output))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)['results']
+        print()
+        if compare(results, previous, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Time-sliced simulation of one assembly over a long run, e.g. to backfill
+a year of history.
+
+The run is split into consecutive slices of ticks that are simulated
+concurrently by a pool of worker processes; the output of the slices is
+put together in the order of ticks. Every slice starts from a state handed
+off by the coordinator:
+
+- with `continuous=True` (the default), the coordinator fast-forwards one
+  assembly through the whole run with `Assembly.advance` and hands
+  a checkpoint (see `Assembly.checkpoint`) to every slice at its first tick,
+  so the features go on across the slices as in one run;
+- otherwise every slice fast-forwards its own new assembly by `warmup` ticks,
+  and the slices are independent runs.
+
+Every slice gets its own random seed derived from the backfill's `seed`,
+so that the output depends on the seed and the number of slices, not on
+the number of processes. Features of a continuous run go on with the random
+streams of the checkpoints; readers and networks draw from slice's streams.
+"""
+
+import copy
+import multiprocessing
+import os
+
+import numpy as np
+
+from .assembler import from_config
+from .core import AssemblyBatch
+from .fleet import _load_config
+
+
+def _slice_assembly(config, seed, start):
+    """Return the assembly of a slice in the state at its first tick.
+
+       `start` is a checkpoint, or the number of ticks to fast-forward.
+    """
+    config = copy.deepcopy(config)
+    config['assembly'].setdefault('parameters', dict())['seed'] = seed
+    assembly = from_config(config)
+    if isinstance(start, bytes):
+        assembly.restore(start)
+        context = assembly.assembly_context
+        for signal in assembly.signals:
+            context.reseed_random_stream('reader:' + signal.name)
+            context.reseed_random_stream('network:' + signal.name)
+    else:
+        assembly.advance(start)
+    return assembly
+
+
+def _run_slice(config, seed, start, first_tick, n_ticks, batch):
+    assembly = _slice_assembly(config, seed, start)
+    runner = assembly.launch(batch=min(batch, n_ticks))
+    batches = [next(runner)]
+    done = batches[0].n_ticks
+    while done < n_ticks:
+        batches.append(runner.send(min(batch, n_ticks - done)))
+        done += batches[-1].n_ticks
+    runner.close()
+    return _concatenate(batches, first_tick)
+
+
+def _export_slice(config, seed, start, first_tick, n_ticks, exporter, part):
+    assembly = _slice_assembly(config, seed, start)
+    return exporter.export(assembly, n_ticks, first_tick=first_tick, part=part)
+
+
+def _concatenate(batches, first_tick):
+    return AssemblyBatch(batches[0].signals, first_tick,
+                         *[np.concatenate([getattr(batch, field) for batch in batches])
+                           for field in ('truths', 'readings', 'arrived',
+                                         'arrival_delays')])
+
+
+class _LocalPool:
+    """Stands in for `multiprocessing.Pool` with `processes=0`."""
+
+    class _Result:
+
+        def __init__(self, value):
+            self._value = value
+
+        def get(self):
+            return self._value
+
+    def apply_async(self, function, args):
+        return self._Result(function(*args))
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class Backfill:
+    """Simulation of one assembly in time slices run concurrently.
+
+       `config` is an assembly config as accepted by `from_config`.
+       `start` is an optional checkpoint of the assembly to start from,
+       e.g. one saved by `run_assembly.py --checkpoint`.
+       The run is fast-forwarded by `warmup` ticks before its first tick.
+       With `processes=0` all slices run in this process; the number of
+       slices is the number of processes by default. The default `seed` is
+       the seed of the assembly in its config.
+
+       The coordinator of a continuous run goes through the whole run alone,
+       so the run scales with the number of processes only if advancing
+       the features is much cheaper than running the assembly, i.e. if
+       behaviors switch rarely (see `Assembly.advance`).
+    """
+
+    def __init__(self, config, slices=None, processes=None, seed=None,
+                 warmup=0, continuous=True, start=None):
+        self._config = _load_config(config)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = int(processes)
+        if processes < 0:
+            raise ValueError("Number of processes must be non-negative. Got {}".
+                             format(processes))
+        if slices is None:
+            slices = max(processes, 1)
+        slices = int(slices)
+        if slices <= 0:
+            raise ValueError("Number of slices must be positive. Got {}".format(slices))
+        warmup = int(warmup)
+        if warmup < 0:
+            raise ValueError("Warm-up must be non-negative. Got {}".format(warmup))
+        if start is not None and not continuous:
+            raise ValueError("A run that starts from a checkpoint must be continuous")
+        self._processes = processes
+        self._slices = slices
+        self._warmup = warmup
+        self._continuous = continuous
+        self._start = start
+        if seed is None:
+            seed = self._config['assembly'].get('parameters', dict()).get('seed')
+        seed_sequence = np.random.SeedSequence(seed)
+        self._seed = int(seed_sequence.generate_state(1)[0])
+        self._slice_seeds = [int(child.generate_state(1)[0])
+                             for child in seed_sequence.spawn(slices)]
+
+    @property
+    def slices(self):
+        return self._slices
+
+    def slice_ranges(self, n_ticks):
+        """Return a list of tuples (first tick, number of ticks) of the slices
+           of a run of `n_ticks` ticks; a slice may be empty."""
+        n_ticks = int(n_ticks)
+        if n_ticks < 0:
+            raise ValueError("Number of ticks must be non-negative. Got {}".
+                             format(n_ticks))
+        bounds = np.linspace(0, n_ticks, self._slices + 1).round().astype(int)
+        return [(int(first), int(last - first))
+                for first, last in zip(bounds[:-1], bounds[1:])]
+
+    def _starts(self, ranges):
+        """Yield the start of every slice in turn: a checkpoint at its first tick
+           or the number of ticks to warm up."""
+        if not self._continuous:
+            for _ in ranges:
+                yield self._warmup
+            return
+        config = copy.deepcopy(self._config)
+        config['assembly'].setdefault('parameters', dict())['seed'] = self._seed
+        assembly = from_config(config)
+        if self._start is not None:
+            assembly.restore(self._start)
+        assembly.advance(self._warmup)
+        for _, n_ticks in ranges:
+            yield assembly.checkpoint()
+            assembly.advance(n_ticks)
+
+    def _pool(self):
+        if self._processes == 0:
+            return _LocalPool()
+        return multiprocessing.Pool(min(self._processes, self._slices))
+
+    def _submit(self, function, n_ticks, arguments, first_tick=0):
+        """Run `function` for every non-empty slice and yield the results
+           in the order of the slices.
+
+           `arguments(part)` returns the arguments of the function that
+           follow the slice's number of ticks; the slices' first ticks
+           are numbered from `first_tick`.
+        """
+        ranges = self.slice_ranges(n_ticks)
+        pool = self._pool()
+        try:
+            # a slice is submitted as soon as its start is known,
+            # so the slices run while the coordinator goes on fast-forwarding
+            results = [pool.apply_async(function, (self._config, seed, start,
+                                                   first_tick + slice_first, slice_ticks)
+                                        + arguments(part))
+                       for part, (seed, start, (slice_first, slice_ticks)) in enumerate(
+                           zip(self._slice_seeds, self._starts(ranges), ranges))
+                       if slice_ticks > 0]
+            for result in results:
+                yield result.get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def launch(self, n_ticks, batch=100000):
+        """Return an iterator over the `AssemblyBatch` of every slice of a run
+           of `n_ticks` ticks, in the order of ticks.
+
+           `first_tick` of a batch is the number of its first tick in the run.
+           Every slice is kept in memory in whole until it is returned.
+        """
+        batch = int(batch)
+        if batch <= 0:
+            raise ValueError("Batch size must be positive. Got {}".format(batch))
+        return self._submit(_run_slice, n_ticks, lambda part: (batch,))
+
+    def run(self, n_ticks, batch=100000):
+        """Run the assembly for `n_ticks` ticks and return one `AssemblyBatch`."""
+        batches = list(self.launch(n_ticks, batch=batch))
+        if len(batches) == 0:
+            assembly = from_config(copy.deepcopy(self._config))
+            n_signals = len(assembly.signals)
+            return AssemblyBatch(tuple(signal.name for signal in assembly.signals), 0,
+                                 np.empty((0, n_signals)), np.empty((0, n_signals)),
+                                 np.empty((0, n_signals), dtype=bool),
+                                 np.empty((0, n_signals)))
+        return _concatenate(batches, 0)
+
+    def export(self, exporter, n_ticks, first_tick=0):
+        """Write a run of `n_ticks` ticks with a `ColumnarExporter`,
+           every slice to its own part files written by its worker.
+
+           The ticks are numbered from `first_tick`.
+           Returns dict {table_name: number of rows written}.
+        """
+        rows = dict()
+        for slice_rows in self._submit(_export_slice, n_ticks,
+                                       lambda part: (exporter, part),
+                                       first_tick=first_tick):
+            for table_name, n_rows in slice_rows.items():
+                rows[table_name] = rows.get(table_name, 0) + n_rows
+        return rows
@@ -1,5 +1,54 @@
-from .core import Behavior
-from itertools import repeat, count
+from .core import Behavior, BehaviorRunner
+import numpy as np
+
+
+class _FlatlineRunner(BehaviorRunner):
+
+    def __init__(self, level):
+        super().__init__()
+        self._level = level
+
+    def __next__(self):
+        self._position += 1
+        return self._level
+
+    def next_chunk(self, k):
+        self._position += k
+        return np.full(k, self._level)
+
+    def preview(self, k):
+        return np.full(k, self._level)
+
+    def skip(self, k, keep=1):
+        self._position += k
+        return np.full(min(k, keep), self._level)
+
+
+class _LinearRunner(BehaviorRunner):
+
+    def __init__(self, bias, increment):
+        super().__init__()
+        self._bias = bias
+        self._increment = increment
+
+    def __next__(self):
+        self._position += 1
+        return self._bias + self._increment * self._position
+
+    def next_chunk(self, k):
+        steps = np.arange(self._position + 1, self._position + k + 1)
+        self._position += k
+        return self._bias + self._increment * steps
+
+    def preview(self, k):
+        return self._bias + self._increment * np.arange(self._position + 1,
+                                                        self._position + k + 1)
+
+    def skip(self, k, keep=1):
+        keep = min(k, keep)
+        self._position += k - keep
+        return self.next_chunk(keep)
+
 
 class FlatlineBehavior(Behavior):
 
@@ -9,7 +58,7 @@ class FlatlineBehavior(Behavior):
     def activate(self, assembly_context=None):
         self.update_parameters(assembly_context=assembly_context)
 
-        return repeat(self._parameters['level'])
+        return _FlatlineRunner(self._parameters['level'])
 
 
 class LinearBehavior(Behavior):
@@ -20,5 +69,4 @@ class LinearBehavior(Behavior):
     def activate(self, assembly_context=None):
         self.update_parameters(assembly_context=assembly_context)
 
-        return (self._parameters['bias'] + self._parameters['increment'] * (i + 1)
-                for i in count())
\ No newline at end of file
+        return _LinearRunner(self._parameters['bias'], self._parameters['increment'])
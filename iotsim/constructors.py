@@ -10,10 +10,11 @@ import iotsim.networks as networks
 
 class AssemblyConstructor:
 
-    def __init__(self, name='Assembly', tick=1, history_depth=1):
+    def __init__(self, name='Assembly', tick=1, history_depth=1, seed=None):
         self._name=name
         self._tick=tick
         self._history_depth=history_depth
+        self._seed=seed
         self._default_reader = readers.PassthroughReader('')
         self._default_network = networks.IdealNetwork('')
         self._readers = dict()
@@ -57,7 +58,8 @@ class AssemblyConstructor:
         return core.Assembly(signals=signals,
                              name=self._name,
                              tick=self._tick,
-                             history_depth=self._history_depth
+                             history_depth=self._history_depth,
+                             seed=self._seed,
         )
 
 
@@ -1,7 +1,8 @@
-from .core import Control, AssemblyContext, Trigger
+from .core import Control, AssemblyContext, Trigger, SteadyControl, Dependency
+from .triggers import Always
 from .utils import to_name
 
-import numpy as np
+from functools import partial
 from typing import List, Callable
 
 class ContextRetriever:
@@ -9,6 +10,24 @@ class ContextRetriever:
     def __call__(self, assembly_context: AssemblyContext):
         return None
 
+    @property
+    def dependencies(self):
+        """Return a list of `Dependency` tuples for the data read by the retriever.
+
+           None means that the dependencies are unknown.
+        """
+        return None
+
+    def bind(self, assembly_context: AssemblyContext):
+        """Return a function without arguments equivalent to calling the retriever."""
+        return lambda: self(assembly_context)
+
+    def _applied(self, retrieve):
+        if self._apply is None:
+            return retrieve
+        apply = self._apply
+        return lambda: apply(retrieve())
+
 class CopyFromParameter(ContextRetriever):
     def __init__(self, src_component, src_parameter, apply: Callable = None):
         self._src_component = to_name(src_component)
@@ -23,6 +42,15 @@ class CopyFromParameter(ContextRetriever):
             x = self._apply(x)
         return x
 
+    @property
+    def dependencies(self):
+        return [Dependency('parameter', self._src_component, self._src_parameter)]
+
+    def bind(self, assembly_context: AssemblyContext):
+        parameters = assembly_context.handle(self._src_component).parameters
+        parameter = self._src_parameter
+        return self._applied(lambda: parameters.get(parameter))
+
 
 class CopyFromHistory(ContextRetriever):
     def __init__(self, src_component, lag, apply: Callable = None):
@@ -38,6 +66,15 @@ class CopyFromHistory(ContextRetriever):
             x = self._apply(x)
         return x
 
+    @property
+    def dependencies(self):
+        return [Dependency('history', self._src_component, self._lag)]
+
+    def bind(self, assembly_context: AssemblyContext):
+        query = assembly_context.handle(self._src_component).history.query
+        lag = self._lag
+        return self._applied(lambda: query(lag))
+
 class CopyFromCounter(ContextRetriever):
     def __init__(self, src_component, src_counter, apply: Callable = None):
         self._src_component = to_name(src_component)
@@ -52,6 +89,15 @@ class CopyFromCounter(ContextRetriever):
             x = self._apply(x)
         return x
 
+    @property
+    def dependencies(self):
+        return [Dependency('counter', self._src_component, self._src_counter)]
+
+    def bind(self, assembly_context: AssemblyContext):
+        counters = assembly_context.handle(self._src_component).counters
+        counter = self._src_counter
+        return self._applied(lambda: counters.get(counter, None))
+
 
 class UpdateParametersControl(Control):
 
@@ -62,7 +108,11 @@ class UpdateParametersControl(Control):
 
         def choose_and_update(assembly_context: AssemblyContext,
                               update_choices: List, p=None):
-            choice_idx = np.random.choice(np.arange(len(update_choices)), p=p)
+            if len(update_choices) == 1:
+                choice_idx = 0
+            else:
+                choice_idx = assembly_context.random_stream(
+                    'control:' + to_name(behavior)).choice(len(update_choices), p=p)
             choice = update_choices[choice_idx]
             if choice is not None:
                 for param_tuple in choice:
@@ -76,6 +126,52 @@ class UpdateParametersControl(Control):
                          action_parameters=dict(update_choices=update_choices, p=p),
                          priority=priority)
 
+    def _action_dependencies(self, update_choices: List, p=None):
+        dependencies = []
+        for choice in update_choices:
+            for _, _, value in choice or []:
+                if isinstance(value, ContextRetriever):
+                    if value.dependencies is None:
+                        return None
+                    dependencies.extend(value.dependencies)
+        return dependencies
+
+    def _action_effects(self, update_choices: List, p=None):
+        return [Dependency('parameter', component, parameter)
+                for choice in update_choices
+                for component, parameter, _ in choice or []]
+
+    def _bind_action(self, assembly_context: AssemblyContext,
+                     update_choices: List, p=None):
+        # resolve components to handles and retrievers to bound retrievers
+        bound_choices = []
+        for choice in update_choices:
+            if choice is None:
+                bound_choices.append(None)
+                continue
+            bound_choice = []
+            for component, parameter, value in choice:
+                retrieve = (value.bind(assembly_context)
+                            if isinstance(value, ContextRetriever) else None)
+                bound_choice.append(
+                    (assembly_context.handle(component), parameter, value, retrieve))
+            bound_choices.append(bound_choice)
+        random_stream = assembly_context.random_stream('control:' + self.behavior)
+        n_choices = len(bound_choices)
+
+        def choose_and_update():
+            if n_choices == 1:
+                choice = bound_choices[0]
+            else:
+                choice = bound_choices[random_stream.choice(n_choices, p=p)]
+            if choice is not None:
+                for handle, parameter, value, retrieve in choice:
+                    if retrieve is not None:
+                        value = retrieve()
+                    handle.set_parameter(parameter, value)
+
+        return choose_and_update
+
 
 class ResetCounterControl(Control):
 
@@ -93,6 +189,15 @@ class ResetCounterControl(Control):
                                                 counter=counter),
                          priority=priority)
 
+    def _action_dependencies(self, component, counter):
+        return []
+
+    def _action_effects(self, component, counter):
+        return [Dependency('counter', component, counter)]
+
+    def _bind_action(self, assembly_context: AssemblyContext, component, counter):
+        return partial(assembly_context.handle(component).reset_counter, counter)
+
 
 class IncrementCounterControl(Control):
 
@@ -112,5 +217,27 @@ class IncrementCounterControl(Control):
                                                 increment=increment),
                          priority=priority)
 
+    def _action_dependencies(self, component, counter, increment):
+        return []
+
+    def _action_effects(self, component, counter, increment):
+        return [Dependency('counter', component, counter)]
+
+    def _bind_action(self, assembly_context: AssemblyContext,
+                     component, counter, increment):
+        return partial(assembly_context.handle(component).increment_counter,
+                       counter, increment)
+
+    def _bind_steady(self, assembly_context: AssemblyContext,
+                     component, counter, increment):
+        if not isinstance(self._trigger, Always):
+            return None
+        handle = assembly_context.handle(component)
+        return SteadyControl(
+            condition=lambda: True,
+            action=partial(handle.increment_counter, counter, increment),
+            advance=lambda k: handle.increment_counter(counter, increment * k),
+            rates={(handle, counter): increment})
+
 
 
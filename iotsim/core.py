@@ -1,7 +1,12 @@
 from abc import ABC, abstractmethod
-from collections import namedtuple, deque
+from collections import namedtuple
+from functools import partial
+import heapq
 from typing import List, Dict, Callable
-from .utils import to_name
+import numpy as np
+import pickle
+import zlib
+from .utils import to_name, RandomStream
 
 def _build_namespace(myname, components, title='object', add_myname=True):
     subspaces = [obj.namespace for obj in components]
@@ -16,7 +21,7 @@ def _build_namespace(myname, components, title='object', add_myname=True):
 
 class Assembly:
 
-    def __init__(self, signals, name='assembly', tick=1, history_depth=1):
+    def __init__(self, signals, name='assembly', tick=1, history_depth=1, seed=None):
         self._name = str(name)
         if tick <= 0:
             raise ValueError("Tick must be positive. Got {}".format(tick))
@@ -27,7 +32,20 @@ class Assembly:
                                            add_myname=False
                                            )
         self._signals = signals
-        self.assembly_context = AssemblyContext(self._namespace, history_depth)
+        # signal name -> position of the signal's data in snapshots
+        self._signal_names = tuple(signal.name for signal in signals)
+        self._signal_index = {name: i for i, name in enumerate(self._signal_names)}
+        self.dependency_graph = DependencyGraph(signals)
+        # positions of the signals in the order of evaluation
+        self._order = tuple(self._signal_index[name]
+                            for name in self.dependency_graph.order)
+        self.assembly_context = AssemblyContext(self._namespace, history_depth, seed=seed)
+        # feature runners left by `advance` for the next launch
+        self._feature_runners = None
+        # runners (feature, reader, network) of every signal of the latest launch
+        self._runners = None
+        # states of the runners set by `restore` for the next launch
+        self._restored = None
 
     @property
     def name(self):
@@ -41,155 +59,985 @@ class Assembly:
     def signals(self):
         return self._signals
 
-    def launch(self):
-        signal_runners = []
-        for signal in self._signals:
-            signal_runners.append(signal.activate(assembly_context=self.assembly_context))
+    @property
+    def namespace(self):
+        return self._namespace
+
+    def subassembly(self, signal_names):
+        """Return an assembly of the signals `signal_names` with the same name,
+           tick, history depth and seed, e.g. a group of `dependency_graph.groups`.
+
+           Random streams of the components are keyed by their names, so
+           the signals produce the same data as in this assembly. The signals
+           are shared with this assembly: run the subassemblies in separate
+           worker processes, not along with this assembly.
+        """
+        names = set(signal_names)
+        unknown = names - set(self._signal_names)
+        if unknown:
+            raise ValueError("Unknown signals {}".format(sorted(unknown)))
+        graph = self.dependency_graph
+        outside = {source for name in names for source in graph.sources(name)} - names
+        if outside or graph.unknown and names != set(self._signal_names):
+            raise ValueError("Signals {} depend on signals that are not in the "
+                             "subassembly".format(sorted(names)))
+        context = self.assembly_context
+        return Assembly([signal for signal in self._signals if signal.name in names],
+                        name=self._name, tick=self._tick,
+                        history_depth=context.history_depth,
+                        seed=context._seed_sequence.entropy)
+
+    def launch(self, batch=None, profiler=None, next_event=False):
+        """Return a runner of the assembly.
+
+           By default, every call on the runner advances the time by one tick
+           and returns an `AssemblySnapshot`.
+           If `batch` is a positive integer, every call on the runner advances
+           the time by `batch` ticks and returns an `AssemblyBatch`.
+           A different size of the next batch (including zero) can be sent
+           to the batch runner with `runner.send(size)`.
+           In a batch, readers and networks process the true values of
+           the whole batch at once with the parameters they have at its end.
+           If `profiler` (an `iotsim.profiling.Profiler`) is given,
+           the components of the assembly report their statistics to it.
+           With `next_event`, the batch runner jumps from one possible switch
+           of behaviors to the next instead of going tick by tick
+           (see `_next_segment`).
+        """
+        self.assembly_context.profiler = profiler
+        if batch is not None:
+            return self._launch_batches(batch, next_event=next_event)
+        if next_event:
+            raise ValueError("The next-event engine runs in batches only")
+
+        components_runners = self._activate_signals()
+        n_signals = len(components_runners)
+        ordered_runners = [(i, components_runners[i]) for i in self._order]
 
         def assembly_runner():
+            synced_version = None
             while True:
-                truths = []
-                readings = []
-                for signal in self._signals:
-                    signal.update_parameters(assembly_context=self.assembly_context)
-                for signal_runner in signal_runners:
-                    truth, reading = next(signal_runner)
-                    truths.append(truth)
-                    readings.append(reading)
-                yield AssemblySnapshot(self, truths, readings)
+                if self.assembly_context.version != synced_version:
+                    synced_version = self._update_parameters()
+                true_values = [None] * n_signals
+                readings = [None] * n_signals
+                for i, (feature_runner, reader_runner, network_runner) in ordered_runners:
+                    true_value = next(feature_runner)
+                    true_values[i] = true_value
+                    reading_value = reader_runner(true_value)
+                    arrived, arrival_delay = next(network_runner)
+                    readings[i] = (reading_value, arrived, arrival_delay)
+                yield AssemblySnapshot(self, true_values, readings)
 
         return assembly_runner()
 
+    def advance(self, n_ticks):
+        """Run the features of the assembly for `n_ticks` ticks without
+           producing readings, transmissions or snapshots.
+
+           The next runner returned by `launch` goes on from the reached state.
+           The features are run by the next-event engine, so the ticks between
+           possible switches of behaviors are skipped in one step and only
+           the values kept in the history are computed.
+        """
+        n_ticks = int(n_ticks)
+        if n_ticks < 0:
+            raise ValueError("Number of ticks must be non-negative. Got {}".
+                             format(n_ticks))
+        if self._feature_runners is None:
+            self.assembly_context.profiler = None
+            self._feature_runners = [
+                signal.feature.activate(assembly_context=self.assembly_context,
+                                        next_event=True)
+                for signal in self._signals]
+            if self._restored is not None:
+                for feature_runner, states in zip(self._feature_runners, self._restored):
+                    feature_runner.set_state(states[0])
+                    states[0] = None
+        self._run_features(self._feature_runners, n_ticks, next_event=True)
+
+    def checkpoint(self, info=None):
+        """Return the state of the assembly as bytes for `restore`.
+
+           The state is the context (parameters, counters, history and
+           random streams) and the state of the runners of the latest launch
+           (or of `advance`): the running behavior of every feature and
+           the state of its runner, of the reader and of the network.
+           The runners must not be in the middle of producing a tick, i.e.
+           the checkpoint is taken between the calls on the assembly's runner.
+           `info` is any picklable data to keep with the state,
+           it is returned by `restore`.
+        """
+        runners = self._feature_runners
+        if runners is not None:
+            runners = [(feature_runner, None, None) for feature_runner in runners]
+        elif self._runners is not None:
+            runners = self._runners
+        if runners is None:
+            states = self._restored
+        else:
+            states = [[_runner_state(runner, kind) if runner is not None else None
+                       for runner, kind in zip(signal_runners, _RUNNER_KINDS)]
+                      for signal_runners in runners]
+            if self._restored is not None:
+                # readers and networks restored but not launched yet
+                for signal_states, restored in zip(states, self._restored):
+                    for i in (1, 2):
+                        if signal_states[i] is None:
+                            signal_states[i] = restored[i]
+        state = dict(names=self.assembly_context.names,
+                     context=self.assembly_context.get_state(),
+                     runners=states,
+                     info=info)
+        return _CHECKPOINT_HEADER + zlib.compress(
+            pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def restore(self, blob):
+        """Set the state saved by `checkpoint` and return its `info`.
+
+           The next runner returned by `launch` (or `advance`) goes on
+           from the restored state. Only restore checkpoints from trusted
+           sources: they are unpickled.
+        """
+        if not blob.startswith(_CHECKPOINT_HEADER):
+            raise ValueError("Not a checkpoint of an assembly")
+        state = pickle.loads(zlib.decompress(blob[len(_CHECKPOINT_HEADER):]))
+        if tuple(state['names']) != self.assembly_context.names:
+            raise ValueError("Checkpoint of a different assembly: namespace {}".
+                             format(list(state['names'])))
+        self.assembly_context.set_state(state['context'])
+        self._feature_runners = None
+        self._runners = None
+        self._restored = state['runners']
+        return state['info']
+
+    def _activate_signals(self, next_event=False):
+        """Return runners (feature, reader, network) of every signal;
+           the feature runners left by `advance` are used again and
+           the states set by `restore` are applied."""
+        feature_runners = self._feature_runners
+        self._feature_runners = None
+        if feature_runners is not None and self.assembly_context.profiler is not None:
+            # the runners left by `advance` run without the profiler:
+            # the new ones report to it from where those stopped
+            profiled_runners = []
+            for signal, feature_runner in zip(self._signals, feature_runners):
+                profiled_runner = signal.feature.activate(
+                    assembly_context=self.assembly_context,
+                    next_event=feature_runner.next_event)
+                profiled_runner.take_over(feature_runner)
+                profiled_runners.append(profiled_runner)
+            feature_runners = profiled_runners
+        if feature_runners is None:
+            feature_runners = [None] * len(self._signals)
+            if self._restored is not None:
+                # features saved with controls compiled for the next-event engine
+                # go on with them, as they would without the checkpoint
+                for i, (signal, states) in enumerate(zip(self._signals, self._restored)):
+                    if states[0] is not None and states[0][2] is not None:
+                        feature_runners[i] = signal.feature.activate(
+                            assembly_context=self.assembly_context, next_event=True)
+        runners = [signal.activate_components(assembly_context=self.assembly_context,
+                                              next_event=next_event,
+                                              feature_runner=feature_runner)
+                   for signal, feature_runner in zip(self._signals, feature_runners)]
+        if self._restored is not None:
+            for signal_runners, states in zip(runners, self._restored):
+                for runner, runner_state in zip(signal_runners, states):
+                    if runner_state is not None:
+                        runner.set_state(runner_state)
+            self._restored = None
+        self._runners = runners
+        return runners
+
+    def _run_features(self, feature_runners, n_ticks, next_event=False, truths=None):
+        """Run the features for `n_ticks` ticks.
+
+           The values are written to the rows of the `truths` array, if given,
+           with a column per feature.
+        """
+        synced_version = None
+        lookahead = _MIN_LOOKAHEAD
+        # while the segments are too short to pay for planning them,
+        # the engine goes tick by tick for `backoff` ticks
+        backoff = 0
+        wait = 0
+        i = 0
+        while i < n_ticks:
+            if self.assembly_context.version != synced_version:
+                synced_version = self._update_parameters()
+            if wait > 0:
+                wait -= 1
+                k = 0
+            elif next_event and all(feature_runner.plannable
+                                    for feature_runner in feature_runners):
+                # jump to the next tick in which a control may fire
+                planned = min(lookahead, n_ticks - i)
+                k = self._next_segment(feature_runners, planned, self._order)
+                # look further ahead after long segments
+                lookahead = max(_MIN_LOOKAHEAD, 2 * k)
+                if k < _MIN_SEGMENT:
+                    backoff = min(max(2 * backoff, 1), _MAX_BACKOFF)
+                    wait = backoff
+                else:
+                    backoff = 0
+                if k > 0:
+                    _advance_features(feature_runners, k, truths, i)
+                    i += k
+                    if k == planned or i == n_ticks:
+                        continue
+                # a control may fire in the next tick
+                k = 0
+            elif all(feature_runner.chunkable for feature_runner in feature_runners):
+                # no control can fire: produce the rest at once
+                k = n_ticks - i
+            else:
+                k = 0
+            if k > 0:
+                _advance_features(feature_runners, k, truths, i)
+                i += k
+            elif truths is None:
+                for j in self._order:
+                    next(feature_runners[j])
+                i += 1
+            else:
+                for j in self._order:
+                    truths[i, j] = next(feature_runners[j])
+                i += 1
+
+    def _update_parameters(self):
+        """Sync parameters of all signals with the context; return context's version."""
+        for signal in self._signals:
+            signal.update_parameters(assembly_context=self.assembly_context)
+        return self.assembly_context.version
+
+    def run_batch(self, n_ticks, next_event=False):
+        """Run the assembly for `n_ticks` ticks and return an `AssemblyBatch`."""
+        return next(self.launch(batch=n_ticks, next_event=next_event))
+
+    @staticmethod
+    def _next_segment(feature_runners, k, order):
+        """Return the number of the next ticks (at most `k`) in which no control
+           can switch behaviors or change parameters; the features are evaluated
+           in every tick in the `order` of their indices.
+
+           Every feature forecasts its values from its running behavior and
+           every control reports how many ticks its trigger stays False on
+           the forecast data. A feature's forecast is only good up to its own
+           next possible switch, and only the shortest horizon is needed,
+           so the forecasts are cut and the horizons of the features that read
+           the cut values are found again until the shortest one holds.
+        """
+        forecast = _Forecast(feature_runners, k, order)
+        horizons = [feature_runner.horizon(forecast, j, k)
+                    for j, feature_runner in enumerate(feature_runners)]
+        segment = min(horizons)
+        while segment > 0:
+            stale = set()
+            for j, horizon in enumerate(horizons):
+                stale.update(forecast.limit(j, min(horizon, segment) + 1))
+            if not stale:
+                break
+            for j in stale:
+                horizons[j] = feature_runners[j].horizon(forecast, j, segment)
+            segment = min(horizons)
+        return segment
+
+    def _launch_batches(self, batch, next_event=False):
+        batch = int(batch)
+        if batch <= 0:
+            raise ValueError("Batch size must be positive. Got {}".format(batch))
+        signal_names = tuple(signal.name for signal in self._signals)
+        components_runners = self._activate_signals(next_event=next_event)
+        feature_runners = [runners[0] for runners in components_runners]
+
+        def batch_runner():
+            nonlocal batch
+            first_tick = 0
+            while True:
+                shape = (batch, len(signal_names))
+                truths = np.empty(shape)
+                self._run_features(feature_runners, batch, next_event, truths)
+
+                # readers and networks process whole columns
+                self._update_parameters()
+                readings = np.empty(shape)
+                arrived = np.empty(shape, dtype=bool)
+                arrival_delays = np.empty(shape)
+                for j, (_, reader_runner, network_runner) in enumerate(components_runners):
+                    readings[:, j] = _apply_reader(reader_runner, truths[:, j])
+                    arrived[:, j], arrival_delays[:, j] = \
+                        _apply_network(network_runner, readings[:, j])
+
+                next_batch = yield AssemblyBatch(signal_names, first_tick,
+                                                 truths, readings, arrived,
+                                                 arrival_delays)
+                first_tick += batch
+                if next_batch is not None:
+                    batch = int(next_batch)
+                    if batch < 0:
+                        raise ValueError("Batch size must be non-negative. Got {}".
+                                         format(batch))
+
+        return batch_runner()
+
+
+SignalDependency = namedtuple('SignalDependency', 'signal source data same_tick')
+# `signal` depends on `source` through `data`, a `Dependency`:
+# it reads the data written by `source`, or `source` writes its data.
+# The dependency is `same_tick` if `signal` reads what `source` writes
+# in the same tick, so that `source` must be evaluated first.
+
+
+class DependencyGraph:
+    """Dependencies between the signals of an assembly.
+
+       They are found from the data that the controls of every feature read
+       (`Control.dependencies`) and write (`Control.effects`): the history
+       of a feature is written by its signal, the parameters and the counters
+       of a component - by the controls that update them.
+
+       `order` has the names of the signals in the order of evaluation:
+       every signal comes after the signals it depends on in the same tick,
+       otherwise the signals keep their order in the assembly.
+       `cycles` lists the groups of signals that depend on each other
+       in the same tick; they are evaluated in the order of the assembly.
+       `groups` are sets of signals with no dependencies between them,
+       which can be run separately (see `Assembly.subassembly`).
+       `unknown` lists the signals with controls whose dependencies
+       or effects are unknown; if there are any, all signals make one group.
+    """
+
+    def __init__(self, signals):
+        self._names = [signal.name for signal in signals]
+        self._position = {name: i for i, name in enumerate(self._names)}
+        owner = {name: signal.name for signal in signals for name in signal.namespace}
+        reads = {signal.name: [] for signal in signals}
+        # (kind, component) -> names of the signals that write it
+        writers = dict()
+        self.unknown = []
+        for signal in signals:
+            writers.setdefault(('history', signal.feature.name), set()).add(signal.name)
+            known = True
+            for controls in signal.feature._controls.values():
+                for control in controls:
+                    dependencies, effects = control.dependencies, control.effects
+                    if dependencies is None or effects is None:
+                        known = False
+                        continue
+                    reads[signal.name].extend(dependencies)
+                    for effect in effects:
+                        writers.setdefault((effect.kind, to_name(effect.component)),
+                                           set()).add(signal.name)
+            if not known:
+                self.unknown.append(signal.name)
+
+        self.edges = []
+        for name in self._names:
+            for dependency in reads[name]:
+                same_tick = dependency.kind != 'history' or dependency.key == 0
+                for source in sorted(writers.get((dependency.kind,
+                                                  to_name(dependency.component)), ()),
+                                     key=self._position.get):
+                    if source != name:
+                        self.edges.append(
+                            SignalDependency(name, source, dependency, same_tick))
+        for (kind, component), sources in sorted(writers.items()):
+            target = owner.get(component)
+            for source in sorted(sources, key=self._position.get):
+                if target is not None and source != target:
+                    self.edges.append(SignalDependency(
+                        target, source, Dependency(kind, component, None), False))
+
+        # several controls may read the same data
+        self.edges = list(dict.fromkeys(self.edges))
+        self.cycles = self._find_cycles()
+        self.order = self._sort()
+        self.groups = self._find_groups()
+
+    def sources(self, signal_name):
+        """Return the names of the signals that `signal_name` depends on."""
+        return {edge.source for edge in self.edges if edge.signal == signal_name}
+
+    def _same_tick_sources(self):
+        sources = {name: set() for name in self._names}
+        for edge in self.edges:
+            if edge.same_tick:
+                sources[edge.signal].add(edge.source)
+        return sources
+
+    def _find_cycles(self):
+        """Return strongly connected components of the same-tick dependencies
+           with more than one signal (Tarjan's algorithm, without recursion)."""
+        sources = {name: sorted(names, key=self._position.get)
+                   for name, names in self._same_tick_sources().items()}
+        index, lowlink, on_stack = dict(), dict(), set()
+        stack, cycles = [], []
+        for root in self._names:
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                name, i = work.pop()
+                if i == 0:
+                    index[name] = lowlink[name] = len(index)
+                    stack.append(name)
+                    on_stack.add(name)
+                if i < len(sources[name]):
+                    work.append((name, i + 1))
+                    source = sources[name][i]
+                    if source not in index:
+                        work.append((source, 0))
+                    elif source in on_stack:
+                        lowlink[name] = min(lowlink[name], index[source])
+                    continue
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+                if lowlink[name] == index[name]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    if len(component) > 1:
+                        cycles.append(sorted(component, key=self._position.get))
+        return sorted(cycles, key=lambda cycle: self._position[cycle[0]])
+
+    def _sort(self):
+        """Return the names of the signals in a topological order of the same-tick
+           dependencies that keeps the order of the assembly where it can."""
+        position = self._position
+        sources = self._same_tick_sources()
+        # the dependencies inside a cycle are ignored
+        for cycle in self.cycles:
+            members = set(cycle)
+            for name in cycle:
+                sources[name] -= members
+        waiting = {name: len(names) for name, names in sources.items()}
+        dependents = {name: [] for name in self._names}
+        for name, names in sources.items():
+            for source in names:
+                dependents[source].append(name)
+        ready = [position[name] for name, n in waiting.items() if n == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            name = self._names[heapq.heappop(ready)]
+            order.append(name)
+            for dependent in dependents[name]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, position[dependent])
+        return tuple(order)
+
+    def _find_groups(self):
+        if self.unknown:
+            return [list(self.order)]
+        group_of = {name: name for name in self._names}
+
+        def find(name):
+            while group_of[name] != name:
+                group_of[name] = group_of[group_of[name]]
+                name = group_of[name]
+            return name
+
+        for edge in self.edges:
+            group_of[find(edge.signal)] = find(edge.source)
+        groups = dict()
+        for name in self.order:
+            groups.setdefault(find(name), []).append(name)
+        return sorted(groups.values(), key=lambda group: min(map(self._position.get, group)))
+
+
+_CHECKPOINT_HEADER = b'IOTSIM-CHECKPOINT-1\n'
+_RUNNER_KINDS = ('feature', 'reader', 'network')
+
+
+def _runner_state(runner, kind):
+    try:
+        get_state = runner.get_state
+    except AttributeError:
+        raise TypeError("State of {} runner {!r} cannot be saved".format(
+                        kind, runner)) from None
+    return get_state()
+
+
+# shortest forecast of the next-event engine, in ticks
+_MIN_LOOKAHEAD = 16
+# segments shorter than this make the engine go tick by tick for a while
+_MIN_SEGMENT = 10
+_MAX_BACKOFF = 64
+
+
+def _advance_features(feature_runners, k, truths=None, first_row=0):
+    if truths is None:
+        for feature_runner in feature_runners:
+            feature_runner.skip(k)
+    else:
+        for j, feature_runner in enumerate(feature_runners):
+            truths[first_row:first_row + k, j] = feature_runner.advance(k)
+
 
 Reading = namedtuple('Reading', 'signal_name value arrived arrival_delay')
 Truth = namedtuple('Truth', 'signal_name value')
 SignalSnapshot = namedtuple('SignalSnapshot', 'truth reading')
+SignalBatch = namedtuple('SignalBatch', 'truths readings arrived arrival_delays')
+
+# Controls compiled for the next-event engine by `Control.bind_events`.
+# A steady control fires on every tick: `advance(k)` applies its action
+# for `k` ticks at once and `rates` maps (ComponentHandle, counter) to
+# the increment of the counter per tick.
+SteadyControl = namedtuple('SteadyControl', 'condition action advance rates')
+# A waiting control fires when its trigger holds: `horizon(forecast, reader, k)`
+# returns the number of the next ticks (at most `k`) in which it cannot fire.
+# `state` is None or an object with methods `get_state` and `set_state`
+# of the data that the compiled trigger keeps between ticks.
+WaitingControl = namedtuple('WaitingControl', 'condition action horizon state')
+
+
+class AssemblyBatch(namedtuple('AssemblyBatch', 'signals first_tick truths readings '
+                                                'arrived arrival_delays')):
+    """Columnar output of an assembly for a number of consecutive ticks.
+
+       `truths`, `readings`, `arrived` and `arrival_delays` are numpy arrays
+       with one row per tick and one column per signal; the columns follow
+       the order of `signals`. A reading that was not done at a tick is NaN.
+       `arrived` and `arrival_delays` are network's output for every tick,
+       same as in `Reading`.
+    """
+    __slots__ = ()
+
+    @property
+    def n_ticks(self):
+        return self.truths.shape[0]
+
+    def signal(self, signal_name):
+        try:
+            j = self.signals.index(signal_name)
+        except ValueError:
+            raise ValueError('Uknown signal {}'.format(signal_name))
+        return SignalBatch(self.truths[:, j], self.readings[:, j],
+                           self.arrived[:, j], self.arrival_delays[:, j])
+
 
 class AssemblySnapshot:
+    """Truths and readings of the signals of an assembly at one tick.
+
+       `true_values` and `readings` (tuples of value, arrived, arrival_delay)
+       are in the order of the assembly's signals, one per signal, as
+       produced by the assembly's runner, so they are not validated here.
+       `Truth` and `Reading` tuples are only created when they are asked for.
+    """
+
+    __slots__ = ('_assembly', '_true_values', '_readings', '_truths_view',
+                 '_readings_view')
 
-    def __init__(self, assembly, truths, readings):
-        self._truths = {truth.signal_name : truth for truth in truths}
-        self._readings = {reading.signal_name : reading for reading in readings}
-        self._assembly_sig_names = set([signal.name for signal in assembly.signals])
+    def __init__(self, assembly, true_values, readings):
         self._assembly = assembly
-        if set(self._truths.keys()) != self._assembly_sig_names:
-            raise ValueError("Unexpected or missing signals in {}. "
-                             "Assembly {} has signals {}.".format(
-                self._truths.keys(), assembly.name, self._assembly_sig_names
-            ))
-        if not set(self._readings.keys()) <= self._assembly_sig_names:
-            raise ValueError("Unexpected signals in readings: {}. "
-                             "Assembly {} has signals {}.".format(
-                self._readings.keys(), assembly.name, self._assembly_sig_names
-            ))
+        self._true_values = true_values
+        self._readings = readings
+        self._truths_view = None
+        self._readings_view = None
 
     def __repr__(self):
         repr = "AssemblySnapshot for {!r}:\n".format(self._assembly.name)
         repr += "{:14} {:>14} {:>14} {:>14}\n".format(
             'Signal', 'True value', 'Reading', 'Delay')
-        for signame in self._assembly_sig_names:
-            reading_value = self._readings[signame].value
-            delay = self._readings[signame].arrival_delay \
-                    if self._readings[signame].arrived else "lost"
+        for signame, true_value, (reading_value, arrived, arrival_delay) in zip(
+                self._assembly._signal_names, self._true_values, self._readings):
             if reading_value is None:
                 repr += "{:14} {:14.4f} {:>14}\n".format(
                              signame,
-                             self._truths[signame].value,
+                             true_value,
                              'None',
                          )
-            elif self._readings[signame].arrived:
+            elif arrived:
                 repr += "{:14} {:14.4f} {:14.4f} {:14.4f}\n".format(
                             signame,
-                            self._truths[signame].value,
+                            true_value,
                             reading_value,
-                            self._readings[signame].arrival_delay,
+                            arrival_delay,
                          )
             else:
                 repr += "{:14} {:14.4f} {:14.4f} {:>14}\n".format(
                             signame,
-                            self._truths[signame].value,
+                            true_value,
                             reading_value,
                             'lost',
                          )
-            return repr
+        return repr
 
     @property
     def readings(self):
-        return [reading for reading in self._readings.values()
-                        if not reading is None and reading.arrived]
+        return [reading for reading in self.all_readings if reading.arrived]
 
     @property
     def all_readings(self):
-        return [reading for reading in self._readings.values()
-                        if not reading is None]
+        if self._readings_view is None:
+            self._readings_view = [
+                Reading(signal_name, *reading)
+                for signal_name, reading in zip(self._assembly._signal_names,
+                                                self._readings)]
+        return self._readings_view
 
     @property
     def truths(self):
-        return list(self._truths.values())
+        if self._truths_view is None:
+            self._truths_view = [
+                Truth(signal_name, true_value)
+                for signal_name, true_value in zip(self._assembly._signal_names,
+                                                   self._true_values)]
+        return self._truths_view
 
     def signal(self, signal_name):
-        if signal_name not in self._assembly_sig_names:
-            raise ValueError('Uknown signal {}'.format(signal_name))
-        reading = self._readings.get(signal_name, None)
-        return SignalSnapshot(self._truths[signal_name], reading)
+        try:
+            i = self._assembly._signal_index[signal_name]
+        except KeyError:
+            raise ValueError('Uknown signal {}'.format(signal_name)) from None
+        return SignalSnapshot(Truth(signal_name, self._true_values[i]),
+                              Reading(signal_name, *self._readings[i]))
 
 
 class AssemblyContext:
+    """Parameters, counters and history of the components of an assembly.
 
-    def __init__(self, namespace, history_depth=1):
+       The namespace is frozen into an index table when the context is created:
+       every name gets an integer slot and a `ComponentHandle` that gives
+       direct access to the component's data. Runners resolve the handles
+       once at activation, so no name handling is done on every tick.
+    """
+
+    def __init__(self, namespace, history_depth=1, seed=None):
         history_depth = int(history_depth)
         if history_depth < 1:
             raise ValueError("History depth must be at least one, got {}".
                              format(history_depth))
         self._depth = history_depth
-        self._parameters = {to_name(name): dict() for name in namespace}
-        self._counters = {to_name(name): dict() for name in namespace}
-        self._history = {to_name(name): deque() for name in namespace}
+        self._version = 0
+        self._names = tuple(to_name(name) for name in namespace)
+        self._handles = [ComponentHandle(self, slot, name)
+                         for slot, name in enumerate(self._names)]
+        self._index = {handle.name: handle for handle in self._handles}
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self._random_streams = dict()
+        # `iotsim.profiling.Profiler` of the runners activated in this context
+        self.profiler = None
+
+    @property
+    def names(self):
+        """Names of the namespace in the order of their slots."""
+        return self._names
+
+    @property
+    def history_depth(self):
+        return self._depth
+
+    def random_stream(self, key):
+        """Return `RandomStream` identified by `key`.
 
-    def _retrieve(self, name, store):
+           Every stream is seeded from context's seed and the key,
+           so a component that always asks for the same key gets
+           reproducible random numbers that do not depend on other components.
+        """
+        key = str(key)
+        try:
+            return self._random_streams[key]
+        except KeyError:
+            seed = np.random.SeedSequence(self._seed_sequence.entropy,
+                                          spawn_key=(zlib.crc32(key.encode()),))
+            stream = RandomStream(seed)
+            self._random_streams[key] = stream
+            return stream
+
+    def reseed_random_stream(self, key):
+        """Seed stream `key` again from context's seed, e.g. after `set_state`
+           set it to the state of another context."""
+        self._random_streams.pop(str(key), None)
+        return self.random_stream(key)
+
+    def slot(self, name):
+        """Return the integer slot of `name`."""
+        return self.handle(name).slot
+
+    def handle(self, name):
+        """Return `ComponentHandle` of component `name`."""
+        try:
+            return self._index[name]
+        except (KeyError, TypeError):
+            pass
         try:
-            return  store[to_name(name)]
+            return self._index[to_name(name)]
         except KeyError:
             raise KeyError("Name {} not in namespace".format(to_name(name)))
 
+    def slot_handle(self, slot):
+        """Return `ComponentHandle` of the component at integer `slot`."""
+        return self._handles[slot]
+
     def get_parameter(self, name, parameter, default=None):
-        params = self._retrieve(name, self._parameters)
-        return params.get(parameter, default)
+        return self.handle(name).parameters.get(parameter, default)
 
     def set_parameter(self, name, parameter, value):
-        params = self._retrieve(name, self._parameters)
-        params[parameter] = value
+        self.handle(name).set_parameter(parameter, value)
         return True
 
+    @property
+    def version(self):
+        """Number of parameter writes in the context.
+
+           Components' parameters need to be re-synced only after it changes.
+        """
+        return self._version
+
+    def parameters_version(self, name):
+        """Number of writes of parameters of component `name`."""
+        return self.handle(name).version
+
     def reset_counter(self, name, counter):
-        counters_for_a_name = self._retrieve(name, self._counters)
-        counters_for_a_name[counter] = 0
+        self.handle(name).reset_counter(counter)
 
     def increment_counter(self, name, counter, increment=1):
-        counters_for_a_name = self._retrieve(name, self._counters)
-        counters_for_a_name[counter] += increment
+        self.handle(name).counters[counter] += increment
 
     def read_counter(self, name, counter):
-        counters_for_a_name = self._retrieve(name, self._counters)
-        return counters_for_a_name.get(counter, None)
+        return self.handle(name).counters.get(counter, None)
+
+    def history_handle(self, name):
+        """Return `HistoryBuffer` of component `name`."""
+        return self.handle(name).history
 
     def query(self, name, lag):
-        history = self._retrieve(name, self._history)
-        try:
-            record = history[lag]
-        except IndexError:
-            return None
-        return record
+        return self.handle(name).history.query(lag)
 
     def record(self, name, value):
-        history = self._retrieve(name, self._history)
-        history.appendleft(value)
-        overflow = len(history) - self._depth
-        if overflow > 0:
-            for _ in range(overflow):
-                history.pop()
+        self.handle(name).history.record(value)
         return True
 
+    def record_many(self, name, values):
+        """Record consecutive values, oldest first."""
+        self.handle(name).history.record_many(values)
+        return True
+
+    def history_window(self, name, k=None):
+        """Return a read-only view of the latest `k` values of component `name`.
+
+           The view is ordered by lag, i.e. `history_window(name, k)[lag]`
+           is the same as `query(name, lag)`.
+        """
+        return self.handle(name).history.window(k)
+
+    def get_state(self):
+        """Return the data of the components and the states of the random
+           streams as a dictionary of plain values and numpy arrays."""
+        return dict(
+            history_depth=self._depth,
+            version=self._version,
+            handles=[handle.get_state() for handle in self._handles],
+            random_streams={key: stream.get_state()
+                            for key, stream in self._random_streams.items()},
+        )
+
+    def set_state(self, state):
+        """Set the state returned by `get_state` of a context with the same namespace."""
+        if state['history_depth'] != self._depth:
+            raise ValueError("History depth of the state is {}, of the context {}".
+                             format(state['history_depth'], self._depth))
+        for handle, handle_state in zip(self._handles, state['handles']):
+            handle.set_state(handle_state)
+        # versions only go up, so that every component syncs its parameters again
+        self._version = max(self._version, state['version']) + 1
+        for key, stream_state in state['random_streams'].items():
+            self.random_stream(key).set_state(stream_state)
+
+
+class ComponentHandle:
+    """Data of one component in `AssemblyContext`."""
+
+    __slots__ = ('_context', 'slot', 'name', 'parameters', 'version',
+                 'counters', 'resets', 'history')
+
+    def __init__(self, assembly_context, slot, name):
+        self._context = assembly_context
+        self.slot = slot
+        self.name = name
+        self.parameters = dict()
+        self.version = 0
+        self.counters = dict()
+        # counter -> number of its resets, which tell them from the counts going down
+        self.resets = dict()
+        self.history = HistoryBuffer(assembly_context.history_depth)
+
+    def get_parameter(self, parameter, default=None):
+        return self.parameters.get(parameter, default)
+
+    def set_parameter(self, parameter, value):
+        self.parameters[parameter] = value
+        self.version += 1
+        self._context._version += 1
+
+    def reset_counter(self, counter):
+        self.counters[counter] = 0
+        self.resets[counter] = self.resets.get(counter, 0) + 1
+
+    def increment_counter(self, counter, increment=1):
+        self.counters[counter] += increment
+
+    def read_counter(self, counter):
+        return self.counters.get(counter, None)
+
+    def get_state(self):
+        return (dict(self.parameters), self.version, dict(self.counters),
+                dict(self.resets), self.history.get_state())
+
+    def set_state(self, state):
+        parameters, version, counters, resets, history = state
+        # the dictionaries are updated in place: bound triggers keep them
+        self.parameters.clear()
+        self.parameters.update(parameters)
+        self.version = max(self.version, version) + 1
+        self.counters.clear()
+        self.counters.update(counters)
+        self.resets.clear()
+        self.resets.update(resets)
+        self.history.set_state(history)
+
+    def query(self, lag):
+        return self.history.query(lag)
+
+    def record(self, value):
+        self.history.record(value)
+
+
+# kinds of the values of a history, in the order of promotion:
+# ints, floats, anything; bools are kept as objects, so that they are read back as bools
+_HISTORY_DTYPES = {'i': np.int64, 'f': np.float64, 'O': object}
+_VALUE_KINDS = {int: 'i', float: 'f', np.int64: 'i', np.float64: 'f'}
+
+
+def _value_kind(value):
+    kind = _VALUE_KINDS.get(type(value))
+    if kind is not None:
+        return kind
+    if isinstance(value, (bool, np.bool_)):
+        return 'O'
+    if isinstance(value, (int, np.integer)):
+        return 'i'
+    if isinstance(value, (float, np.floating)):
+        return 'f'
+    return 'O'
+
+
+class HistoryBuffer:
+    """Ring buffer of the latest values of a component.
+
+       Every value is stored twice, at positions `i` and `i + depth`
+       of a preallocated numpy array, so that the latest `k` values
+       always make a contiguous slice of the array.
+       The array holds ints while all recorded values are ints, floats
+       while they are numbers (ints recorded after a float are read back
+       as floats), and the values as they are otherwise.
+    """
+
+    def __init__(self, depth):
+        self._depth = depth
+        self._values = np.empty(2 * depth, dtype=np.int64)
+        self._kind = 'i'
+        self._latest = depth - 1
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def _promote(self, kind):
+        """Convert the array to hold values of `kind`, if it does not."""
+        if kind == self._kind or kind == 'i' or self._kind == 'O':
+            return
+        self._values = self._values.astype(_HISTORY_DTYPES[kind])
+        self._kind = kind
+
+    def _store(self, position, value):
+        try:
+            self._values[position] = value
+        except OverflowError:
+            self._promote('O')
+            self._values[position] = value
+
+    def record(self, value):
+        kind = _VALUE_KINDS.get(type(value)) or _value_kind(value)
+        if kind != self._kind:
+            self._promote(kind)
+        latest = self._latest + 1
+        if latest == self._depth:
+            latest = 0
+        self._store(latest, value)
+        self._store(latest + self._depth, value)
+        self._latest = latest
+        if self._size < self._depth:
+            self._size += 1
+
+    def record_many(self, values):
+        """Record consecutive values, oldest first."""
+        values = values[-self._depth:]
+        n = len(values)
+        if n == 0:
+            return
+        positions = (self._latest + 1 + np.arange(n)) % self._depth
+        if isinstance(values, np.ndarray):
+            kind = values.dtype.kind
+            kind = 'i' if kind in 'iu' else 'f' if kind == 'f' else 'O'
+        else:
+            kinds = {_value_kind(value) for value in values}
+            kind = 'O' if 'O' in kinds else 'f' if 'f' in kinds else 'i'
+            converted = np.empty(n, dtype=_HISTORY_DTYPES[kind])
+            try:
+                converted[:] = values
+            except OverflowError:
+                kind = 'O'
+                converted = np.empty(n, dtype=object)
+                converted[:] = values
+            values = converted
+        self._promote(kind)
+        self._values[positions] = values
+        self._values[positions + self._depth] = values
+        self._latest = int(positions[-1])
+        self._size = min(self._size + n, self._depth)
+
+    def query(self, lag):
+        if not 0 <= lag < self._size:
+            return None
+        return self._values.item(self._latest + self._depth - lag)
+
+    def window(self, k=None):
+        """Return a read-only view of the latest `k` values, the latest first.
+
+           The view shares memory with the buffer, so it is valid
+           only until the next value is recorded.
+        """
+        k = self._size if k is None else min(int(k), self._size)
+        end = self._latest + self._depth + 1
+        view = self._values[end - k:end][::-1]
+        view.flags.writeable = False
+        return view
+
+    def get_state(self):
+        """Return a copy of the recorded values, oldest first."""
+        return self.window()[::-1].copy()
+
+    def set_state(self, values):
+        """Replace the recorded values with `values`, oldest first."""
+        self._values = np.empty(2 * self._depth, dtype=np.int64)
+        self._kind = 'i'
+        self._latest = self._depth - 1
+        self._size = 0
+        self.record_many(values)
+
 
 class Signal:
 
@@ -221,10 +1069,40 @@ class Signal:
     def character(self):
         return self._character
 
+    @property
+    def feature(self):
+        return self._feature
+
+    def activate_components(self, assembly_context: AssemblyContext, next_event=False,
+                            feature_runner=None):
+        """Return a tuple of runners (feature, reader, network) of the signal.
+
+           An already active `feature_runner` may be given to go on with.
+        """
+        if assembly_context is None:
+            reader_stream = network_stream = None
+        else:
+            reader_stream = assembly_context.random_stream('reader:' + self.name)
+            network_stream = assembly_context.random_stream('network:' + self.name)
+        if feature_runner is None:
+            feature_runner = self._feature.activate(assembly_context=assembly_context,
+                                                    next_event=next_event)
+        runners = (feature_runner,
+                   self._reader.activate(assembly_context=assembly_context,
+                                         random_stream=reader_stream),
+                   self._network.activate(assembly_context=assembly_context,
+                                          random_stream=network_stream))
+        profiler = None if assembly_context is None else assembly_context.profiler
+        if profiler is not None:
+            feature_runner, reader_runner, network_runner = runners
+            runners = (feature_runner,
+                       profiler.wrap_reader(self.name, reader_runner),
+                       profiler.wrap_network(self.name, network_runner))
+        return runners
+
     def activate(self, assembly_context: AssemblyContext):
-        feature_runner = self._feature.activate(assembly_context=assembly_context)
-        reader_runner = self._reader.activate(assembly_context=assembly_context)
-        network_runner = self._network.activate(assembly_context=assembly_context)
+        feature_runner, reader_runner, network_runner = \
+            self.activate_components(assembly_context=assembly_context)
 
         def signal_runner():
             while True:
@@ -255,6 +1133,7 @@ class _AssemblyComponentTemplate(ABC):
             self._namespace = [self._name]
         self._default_parameters = parameters
         self._parameters = self._default_parameters.copy()
+        self._synced_with = None
         super().__init__()
 
 
@@ -267,16 +1146,24 @@ class _AssemblyComponentTemplate(ABC):
         return self._namespace
 
     def update_parameters(self, assembly_context: AssemblyContext, none_is_ok=False):
+        # parameters are re-synced only if the context has changed them
+        # since the last sync
+        if assembly_context is None or self.name is None:
+            context_parameters = dict()
+            sync_key = (None, none_is_ok)
+        else:
+            handle = assembly_context.handle(self.name)
+            context_parameters = handle.parameters
+            sync_key = (assembly_context, none_is_ok, handle.version)
+        if sync_key == self._synced_with:
+            return
         for param_name, default_value in self._default_parameters.items():
-            if assembly_context is None or self.name is None:
-                param_value = default_value
-            else:
-                param_value = assembly_context.get_parameter(
-                    self.name, param_name, default_value)
+            param_value = context_parameters.get(param_name, default_value)
             if not none_is_ok and param_value is None:
                 raise RuntimeError("Parameter {} undefined for {} '{}'".
                     format(param_name, self.__class__.__name__, self.name))
             self._parameters[param_name] = param_value
+        self._synced_with = sync_key
 
     @abstractmethod
     def activate(self, assembly_context: AssemblyContext):
@@ -287,20 +1174,61 @@ class _AssemblyComponentTemplate(ABC):
 class Reader(_AssemblyComponentTemplate):
 
     @abstractmethod
-    def activate(self, assembly_context=None):
+    def activate(self, assembly_context=None, random_stream=None):
         """Return a reading of some feature's value.
 
            Given a true value of the feature return
            a reading  of this value (i.e. it may add some noise or bias)
            or None it no reading is to be done at this particular tick.
+           Random numbers, if any, must be drawn from `random_stream`.
+           The returned function may be a `ReaderRunner` that also
+           processes arrays of values.
         """
         pass
 
 
+class ReaderRunner(ABC):
+    """Function returned by `Reader.activate` that can also process arrays."""
+
+    @abstractmethod
+    def __call__(self, true_value):
+        pass
+
+    def apply_batch(self, truths):
+        """Return an array of readings of an array of true values.
+
+           The readings that are not done are NaN.
+           Override this with a vectorized implementation.
+        """
+        return _read_one_by_one(self, truths)
+
+    def get_state(self):
+        """Return what the runner keeps between the readings, None if nothing."""
+        return None
+
+    def set_state(self, state):
+        pass
+
+
+def _apply_reader(reader_runner, truths):
+    if isinstance(reader_runner, ReaderRunner):
+        return reader_runner.apply_batch(truths)
+    return _read_one_by_one(reader_runner, truths)
+
+
+def _read_one_by_one(reader_runner, truths):
+    readings = np.full(len(truths), np.nan)
+    for i, true_value in enumerate(truths.tolist()):
+        reading_value = reader_runner(true_value)
+        if reading_value is not None:
+            readings[i] = reading_value
+    return readings
+
+
 class Network(_AssemblyComponentTemplate):
 
     @abstractmethod
-    def activate(self, assembly_context=None):
+    def activate(self, assembly_context=None, random_stream=None):
         """Return a generator of network effects on a reading.
 
            The generator yields a tuple of (arrived, arrival_delay) where:
@@ -308,10 +1236,56 @@ class Network(_AssemblyComponentTemplate):
              or has been lost in transition (False)
            - `arrival_delay` is the delay of reading's arrival in seconds (must be
              ignored if `arrived` is False)
+           Random numbers, if any, must be drawn from `random_stream`.
+           The generator may be a `NetworkRunner` that also
+           processes arrays of readings.
         """
         pass
 
 
+class NetworkRunner(ABC):
+    """Generator returned by `Network.activate` that can also process arrays."""
+
+    def __iter__(self):
+        return self
+
+    @abstractmethod
+    def __next__(self):
+        pass
+
+    def apply_batch(self, readings):
+        """Return arrays (arrived, arrival_delays) for an array of readings.
+
+           Override this with a vectorized implementation.
+        """
+        return _transmit_one_by_one(self, readings)
+
+    def get_state(self):
+        """Return what the runner keeps between the transmissions, None if nothing.
+
+           Random streams are part of the assembly's context.
+        """
+        return None
+
+    def set_state(self, state):
+        pass
+
+
+def _apply_network(network_runner, readings):
+    if isinstance(network_runner, NetworkRunner):
+        return network_runner.apply_batch(readings)
+    return _transmit_one_by_one(network_runner, readings)
+
+
+def _transmit_one_by_one(network_runner, readings):
+    n = len(readings)
+    arrived = np.empty(n, dtype=bool)
+    arrival_delays = np.empty(n)
+    for i in range(n):
+        arrived[i], arrival_delays[i] = next(network_runner)
+    return arrived, arrival_delays
+
+
 class Behavior(_AssemblyComponentTemplate):
 
     def __init__(self, name, **parameters):
@@ -321,15 +1295,84 @@ class Behavior(_AssemblyComponentTemplate):
 
     @abstractmethod
     def activate(self, assembly_context=None):
-        """Return a generator of true values of a feature that uses this behavior."""
+        """Return a generator of true values of a feature that uses this behavior.
+
+           The generator may also be a `BehaviorRunner`
+           that produces the values in chunks.
+        """
+        pass
+
+
+class BehaviorRunner(ABC):
+    """Iterator over true values of an activated behavior.
+
+       Besides producing the values one by one, the runner can produce
+       the next `k` values at once as a numpy array.
+    """
+
+    def __init__(self):
+        self._position = 0
+
+    @property
+    def position(self):
+        """Number of values produced since the activation."""
+        return self._position
+
+    def __iter__(self):
+        return self
+
+    @abstractmethod
+    def __next__(self):
+        pass
+
+    @abstractmethod
+    def next_chunk(self, k):
+        """Return the next `k` values as a numpy array."""
         pass
 
+    def preview(self, k):
+        """Return the next `k` values as a numpy array without producing them.
+
+           None means that the values cannot be known in advance.
+        """
+        return None
+
+    def skip(self, k, keep=1):
+        """Go `k` values forward and return the last `keep` of them
+           as a numpy array."""
+        values = self.next_chunk(k)
+        return values[max(len(values) - keep, 0):]
+
+    def get_state(self):
+        """Return the position and the other data of the runner as a dictionary.
+
+           Override this with `set_state` if the attributes of the runner
+           are not plain data.
+        """
+        return dict(vars(self))
+
+    def set_state(self, state):
+        vars(self).update(state)
+
+
+Dependency = namedtuple('Dependency', 'kind component key')
+# `kind` is one of 'counter', 'history' or 'parameter';
+# `key` is the counter's name, the history lag or the parameter's name respectively
+
 
 class Trigger(_AssemblyComponentTemplate):
 
     def __init__(self, name, active=True, **condition_parameters):
         super().__init__(name, active=active, **condition_parameters)
 
+    @property
+    def dependencies(self):
+        """Return a list of `Dependency` tuples for the data read by the condition.
+
+           None means that the dependencies are unknown.
+        """
+        return None
+
     @abstractmethod
     def _evaluate_condition(self, assembly_context: AssemblyContext,
                             **condition_parameters):
@@ -349,6 +1392,61 @@ class Trigger(_AssemblyComponentTemplate):
 
     check=activate
 
+    def _bind_condition(self, assembly_context: AssemblyContext,
+                        **condition_parameters):
+        """Return a function without arguments that evaluates `condition`."""
+        return partial(self._evaluate_condition, assembly_context,
+                       **condition_parameters)
+
+    def bind(self, assembly_context: AssemblyContext=None):
+        """Return a function without arguments equivalent to `check`.
+
+           Parameters of an unnamed trigger cannot be changed in the context,
+           so its condition is compiled only once.
+        """
+        if self.name is not None:
+            return partial(self.check, assembly_context=assembly_context)
+        self.update_parameters(assembly_context=assembly_context)
+        condition_parameters = self._parameters.copy()
+        active = condition_parameters.pop('active')
+        if not active:
+            return lambda: None
+        return self._bind_condition(assembly_context, **condition_parameters)
+
+    def _bind_horizon(self, assembly_context: AssemblyContext,
+                      **condition_parameters):
+        """Return a function `horizon(forecast, reader, k)` for `bind_events`
+           or None if the condition cannot be forecast."""
+        return None
+
+    def _bind_events(self, assembly_context: AssemblyContext,
+                     **condition_parameters):
+        horizon = self._bind_horizon(assembly_context, **condition_parameters)
+        if horizon is None:
+            return None
+        return (self._bind_condition(assembly_context, **condition_parameters),
+                horizon, None)
+
+    def bind_events(self, assembly_context: AssemblyContext):
+        """Return (condition, horizon, state) for the next-event engine.
+
+           `horizon(forecast, reader, k)` returns the number of the next ticks
+           (at most `k`) in which the condition cannot be True, given
+           the `_Forecast` of the data and the position `reader` of the control
+           in the order of controls, (feature index, control index).
+           `state` is None or the state of the compiled condition
+           (see `WaitingControl`).
+           Return None if the trigger cannot forecast its condition.
+        """
+        if self.name is not None:
+            return None
+        self.update_parameters(assembly_context=assembly_context)
+        condition_parameters = self._parameters.copy()
+        active = condition_parameters.pop('active')
+        if not active:
+            return lambda: None, lambda forecast, reader, k: k, None
+        return self._bind_events(assembly_context, **condition_parameters)
+
 
 class Control(_AssemblyComponentTemplate):
 
@@ -386,6 +1484,31 @@ class Control(_AssemblyComponentTemplate):
     def priority(self):
         return self._priority
 
+    @property
+    def dependencies(self):
+        """Return a list of `Dependency` tuples for the data read by the trigger
+           and the action of the control. None means that they are unknown."""
+        trigger_dependencies = self._trigger.dependencies
+        action_dependencies = self._action_dependencies(
+            **self._default_parameters['action_parameters'])
+        if trigger_dependencies is None or action_dependencies is None:
+            return None
+        return list(trigger_dependencies) + list(action_dependencies)
+
+    @property
+    def effects(self):
+        """Return a list of `Dependency` tuples for the data written by the action.
+
+           None means that the effects are unknown.
+        """
+        return self._action_effects(**self._default_parameters['action_parameters'])
+
+    def _action_dependencies(self, **action_parameters):
+        return None
+
+    def _action_effects(self, **action_parameters):
+        return None
+
     def activate(self, assembly_context: AssemblyContext):
         self.update_parameters(assembly_context=assembly_context)
         if self._trigger.check(assembly_context=assembly_context):
@@ -394,6 +1517,70 @@ class Control(_AssemblyComponentTemplate):
 
     execute=activate
 
+    def _bind_action(self, assembly_context: AssemblyContext, **action_parameters):
+        """Return a function without arguments that runs `action`."""
+        return partial(self._parameters['action'], assembly_context,
+                       **action_parameters)
+
+    def bind_parts(self, assembly_context: AssemblyContext):
+        """Return functions without arguments (condition, action) of the control.
+
+           Parameters of an unnamed control cannot be changed in the context,
+           so its condition and action are compiled only once.
+        """
+        if self.name is not None:
+
+            def condition():
+                self.update_parameters(assembly_context=assembly_context)
+                return self._trigger.check(assembly_context=assembly_context)
+
+            def action():
+                self._parameters['action'](assembly_context,
+                                           **self._parameters['action_parameters'])
+
+            return condition, action
+        self.update_parameters(assembly_context=assembly_context)
+        return (self._trigger.bind(assembly_context=assembly_context),
+                self._bind_action(assembly_context,
+                                  **self._parameters['action_parameters']))
+
+    def _bind_steady(self, assembly_context: AssemblyContext, **action_parameters):
+        """Return `SteadyControl` if the control fires on every tick
+           and its action can be applied for many ticks at once, else None."""
+        return None
+
+    def bind_events(self, assembly_context: AssemblyContext):
+        """Return `SteadyControl` or `WaitingControl` for the next-event engine.
+
+           Return None if the effect of the control cannot be forecast.
+        """
+        if self.name is not None:
+            return None
+        self.update_parameters(assembly_context=assembly_context)
+        action_parameters = self._parameters['action_parameters']
+        steady = self._bind_steady(assembly_context, **action_parameters)
+        if steady is not None:
+            return steady
+        events = self._trigger.bind_events(assembly_context=assembly_context)
+        if events is None:
+            return None
+        condition, horizon, state = events
+        return WaitingControl(condition,
+                              self._bind_action(assembly_context, **action_parameters),
+                              horizon, state)
+
+    def bind(self, assembly_context: AssemblyContext):
+        """Return a function without arguments equivalent to `execute`."""
+        if self.name is not None:
+            return partial(self.execute, assembly_context=assembly_context)
+        condition, action = self.bind_parts(assembly_context=assembly_context)
+
+        def fire():
+            if condition():
+                action()
+
+        return fire
+
 
 class Feature(_AssemblyComponentTemplate):
 
@@ -423,6 +1610,10 @@ class Feature(_AssemblyComponentTemplate):
                                  format(ctrl.behavior, ctrl.name, self.name))
         for ctrl_list in self._controls.values():
             ctrl_list.sort(key=lambda ctrl: ctrl.priority)
+        self._on_activation = {bhv_name: [c for c in ctrl_list if c.when == 'on_activation']
+                               for bhv_name, ctrl_list in self._controls.items()}
+        self._on_yield = {bhv_name: [c for c in ctrl_list if c.when == 'on_yield']
+                          for bhv_name, ctrl_list in self._controls.items()}
 
         super().__init__(name, running_behavior=start_with)
         if self.name is None:
@@ -431,31 +1622,330 @@ class Feature(_AssemblyComponentTemplate):
                                            title=self.__class__.__name__)
 
 
-    def activate(self, assembly_context: AssemblyContext):
+    def activate(self, assembly_context: AssemblyContext, next_event=False):
         """Return a generator of true feature's values.
 
            Actual values are produced by feature's behaviors.
            Feature manages activating the behaviors and switching between them.
         """
+        return FeatureRunner(self, assembly_context, next_event=next_event)
 
-        def runner():
-            current_bhv = None
-            bhv_runner = iter([])
-            while True:
-                running_bhv_name = self._parameters['running_behavior']
-                if current_bhv is None or running_bhv_name != current_bhv.name:
-                    new_bhv = self._behaviors[running_bhv_name]
-                    for ctrl in [c for c in self._controls[new_bhv.name]
-                                 if c.when == 'on_activation']:
-                        ctrl.execute(assembly_context=assembly_context)
-                    bhv_runner=new_bhv.activate(assembly_context=assembly_context)
-                    current_bhv = new_bhv
-                feature_value = next(bhv_runner)
-                assembly_context.record(self.name, feature_value)
-                for ctrl in [c for c in self._controls[current_bhv.name]
-                               if c.when=='on_yield']:
-                    ctrl.execute(assembly_context=assembly_context)
-                yield feature_value
-
-        return runner()
 
+class FeatureRunner:
+    """Generator of true feature's values returned by `Feature.activate`.
+
+       Every call of `next` produces the value for one tick.
+       `next_chunk` produces the values for many ticks in one step
+       while the running behavior has no `on_yield` controls.
+       With `next_event`, the `on_yield` controls are also compiled
+       for the next-event engine: the runner reports the `horizon` of its
+       controls and `advance`s by many ticks while none of them can fire.
+    """
+
+    def __init__(self, feature: Feature, assembly_context: AssemblyContext,
+                 next_event=False):
+        self._feature = feature
+        self._assembly_context = assembly_context
+        self.next_event = next_event
+        self.handle = assembly_context.handle(feature.name)
+        self._history = self.handle.history
+        self._profiler = assembly_context.profiler
+        self._behavior = None
+        self._behavior_runner = iter([])
+        # controls compiled for the next-event engine:
+        # behavior name -> on_yield controls (None for those that cannot be forecast)
+        self._events = {
+            bhv_name: tuple(ctrl.bind_events(assembly_context=assembly_context)
+                            if next_event else None
+                            for ctrl in feature._on_yield[bhv_name])
+            for bhv_name in feature._behaviors
+        }
+        # states kept by the compiled triggers, saved with the runner's state
+        self._event_states = [event.state
+                              for bhv_name in feature._behaviors
+                              for event in self._events[bhv_name]
+                              if isinstance(event, WaitingControl)
+                              and event.state is not None]
+        # compiled control schedule:
+        # behavior name -> (on_activation controls, on_yield controls)
+        self._schedule = {
+            bhv_name: (
+                tuple(self._bind_control(ctrl, bhv_name, 'on_activation', i)
+                      for i, ctrl in enumerate(feature._on_activation[bhv_name])),
+                tuple(self._bind_control(ctrl, bhv_name, 'on_yield', i, event)
+                      for i, (ctrl, event) in enumerate(zip(
+                          feature._on_yield[bhv_name], self._events[bhv_name]))),
+            )
+            for bhv_name in feature._behaviors
+        }
+        self._on_yield = ()
+        self.on_yield_events = ()
+
+    def _bind_control(self, control, behavior_name, when, index, event=None):
+        if event is not None:
+            # the engine's condition must also decide the ticks that are
+            # not skipped, e.g. it keeps the counter threshold drawn for a segment
+            condition, action = event.condition, event.action
+        elif self._profiler is None:
+            return control.bind(assembly_context=self._assembly_context)
+        else:
+            condition, action = control.bind_parts(assembly_context=self._assembly_context)
+        if self._profiler is None:
+
+            def fire():
+                if condition():
+                    action()
+
+            return fire
+        if control.name is None:
+            label = '{}/{}/{}[{}]'.format(self._feature.name, behavior_name, when, index)
+        else:
+            label = control.name
+        return self._profiler.wrap_control(label, condition, action)
+
+    def __iter__(self):
+        return self
+
+    @property
+    def chunkable(self):
+        """Whether the next chunk of values can be longer than one tick."""
+        running_bhv_name = self._feature._parameters['running_behavior']
+        if self._behavior is None or running_bhv_name != self._behavior.name:
+            return False
+        return len(self._on_yield) == 0
+
+    @property
+    def plannable(self):
+        """Whether the running behavior is activated and the next-event engine
+           can forecast all its `on_yield` controls."""
+        running_bhv_name = self._feature._parameters['running_behavior']
+        return (self._behavior is not None and running_bhv_name == self._behavior.name
+                and None not in self.on_yield_events)
+
+    def _sync_behavior(self):
+        running_bhv_name = self._feature._parameters['running_behavior']
+        if self._behavior is None or running_bhv_name != self._behavior.name:
+            new_bhv = self._feature._behaviors[running_bhv_name]
+            on_activation, _ = self._schedule[new_bhv.name]
+            for fire in on_activation:
+                fire()
+            self._activate_behavior(new_bhv)
+
+    def _activate_behavior(self, behavior, behavior_runner=None):
+        _, self._on_yield = self._schedule[behavior.name]
+        self.on_yield_events = self._events[behavior.name]
+        if behavior_runner is None:
+            behavior_runner = behavior.activate(assembly_context=self._assembly_context)
+        self._behavior_runner = behavior_runner
+        if self._profiler is not None:
+            self._behavior_runner = self._profiler.wrap_behavior(
+                behavior.name, self._behavior_runner)
+        self._behavior = behavior
+
+    def get_state(self):
+        """Return the name of the running behavior, the state of its runner
+           and the states of the controls compiled for the next-event engine
+           (None without it), or None if no behavior is activated yet."""
+        if self._behavior is None:
+            return None
+        if not hasattr(self._behavior_runner, 'get_state'):
+            raise TypeError("State of behavior {} of feature {} cannot be saved".
+                            format(self._behavior.name, self._feature.name))
+        event_states = None
+        if self.next_event:
+            event_states = [state.get_state() for state in self._event_states]
+        return self._behavior.name, self._behavior_runner.get_state(), event_states
+
+    def set_state(self, state):
+        """Activate the behavior saved by `get_state` (without firing
+           its `on_activation` controls) and set the state of its runner."""
+        if state is None:
+            return
+        behavior_name, runner_state, event_states = state
+        self._activate_behavior(self._feature._behaviors[behavior_name])
+        self._behavior_runner.set_state(runner_state)
+        if self.next_event and event_states is not None:
+            for event_state, saved in zip(self._event_states, event_states):
+                event_state.set_state(saved)
+
+    def take_over(self, feature_runner):
+        """Go on from where `feature_runner`, a runner of the same feature,
+           stopped: its running behavior goes on with the same runner
+           and the controls compiled here."""
+        if feature_runner._behavior is not None:
+            self._activate_behavior(feature_runner._behavior,
+                                    feature_runner._behavior_runner)
+        for event_state, taken in zip(self._event_states, feature_runner._event_states):
+            event_state.set_state(taken.get_state())
+
+    def __next__(self):
+        self._sync_behavior()
+        feature_value = next(self._behavior_runner)
+        self._history.record(feature_value)
+        for fire in self._on_yield:
+            fire()
+        return feature_value
+
+    def next_chunk(self, k):
+        """Return the values for the next `k` ticks (or fewer) as a numpy array.
+
+           The chunk has only one value if the running behavior has
+           `on_yield` controls because any of them may switch the behavior.
+        """
+        if not self.chunkable:
+            return np.array([next(self)])
+        if isinstance(self._behavior_runner, BehaviorRunner):
+            values = self._behavior_runner.next_chunk(k)
+        else:
+            values = np.array([next(self._behavior_runner) for _ in range(k)])
+        self._history.record_many(values)
+        return values
+
+    def preview(self, k):
+        """Return the values of the next `k` ticks of the running behavior
+           without producing them, or None if they cannot be known in advance."""
+        if isinstance(self._behavior_runner, BehaviorRunner):
+            return self._behavior_runner.preview(k)
+        return None
+
+    def horizon(self, forecast, index, k):
+        """Return the number of the next ticks (at most `k`) in which none of
+           the `on_yield` controls can fire, except for the steady ones.
+
+           `index` is the position of this feature in the assembly.
+        """
+        horizon = k
+        for position, event in enumerate(self.on_yield_events):
+            if event is None:
+                return 0
+            if isinstance(event, WaitingControl):
+                horizon = event.horizon(forecast, (index, position), horizon)
+                if horizon == 0:
+                    return 0
+        return horizon
+
+    def advance(self, k):
+        """Return the values for the next `k` ticks in which no control
+           but the steady ones fires (as found by `horizon`)."""
+        if isinstance(self._behavior_runner, BehaviorRunner):
+            values = self._behavior_runner.next_chunk(k)
+        else:
+            values = np.array([next(self._behavior_runner) for _ in range(k)])
+        self._history.record_many(values)
+        for event in self.on_yield_events:
+            if isinstance(event, SteadyControl):
+                event.advance(k)
+        return values
+
+    def skip(self, k):
+        """Same as `advance` but only the values kept in the history are produced."""
+        if isinstance(self._behavior_runner, BehaviorRunner):
+            self._history.record_many(
+                self._behavior_runner.skip(k, keep=self._history.depth))
+            for event in self.on_yield_events:
+                if isinstance(event, SteadyControl):
+                    event.advance(k)
+        else:
+            self.advance(k)
+
+
+class _Forecast:
+    """Data that the controls of an assembly will read in the next ticks
+       if no control fires but the steady ones.
+
+       Forecast of a feature's history are the values previewed by its running
+       behavior, as long as they are valid (see `limit`); counters change
+       only by the steady controls.
+    """
+
+    def __init__(self, feature_runners, k, order):
+        self._feature_runners = feature_runners
+        self._k = k
+        self._features = {feature_runner.handle: j
+                          for j, feature_runner in enumerate(feature_runners)}
+        # feature index -> rank of the feature in the order of evaluation
+        self._ranks = [0] * len(feature_runners)
+        for rank, j in enumerate(order):
+            self._ranks[j] = rank
+        n = len(feature_runners)
+        # previews are made when they are read for the first time
+        self._values = [None] * n
+        self._valid = [k] * n
+        # feature -> {reader feature: the longest part of the forecast it read}
+        self._read = [dict() for _ in range(n)]
+        # (handle, counter) -> list of (position of the steady control, increment)
+        self._rates = dict()
+        for j, feature_runner in enumerate(feature_runners):
+            for position, event in enumerate(feature_runner.on_yield_events):
+                if isinstance(event, SteadyControl):
+                    for key, increment in event.rates.items():
+                        self._rates.setdefault(key, []).append(((j, position), increment))
+
+    def limit(self, index, n):
+        """Keep at most `n` values of the feature's forecast; return
+           the indices of the features that read the cut values."""
+        if n >= self._valid[index]:
+            return ()
+        self._valid[index] = n
+        return [reader for reader, length in self._read[index].items() if length > n]
+
+    def _preview(self, index):
+        values = self._values[index]
+        if values is None:
+            values = self._feature_runners[index].preview(self._k)
+            if values is None:
+                values = np.empty(0)
+            self._values[index] = values
+        return values
+
+    def history(self, handle, lag, reader, k):
+        """Return the values (at most `k`) that the control at position `reader`
+           will read from the history of `handle` with `lag` in the next ticks.
+
+           The values are a list of the ones already in the history
+           followed by a numpy array of forecast ones.
+        """
+        try:
+            component = self._features[handle]
+        except KeyError:
+            return [], np.empty(0)
+        # features evaluated after the reader have not yet produced
+        # the value of the tick
+        shift = lag + (1 if self._ranks[component] > self._ranks[reader[0]] else 0)
+        known = [handle.history.query(shift - 1 - i) for i in range(min(shift, k))]
+        values = self._preview(component)[:min(self._valid[component], k - len(known))]
+        read = self._read[component]
+        read[reader[0]] = max(read.get(reader[0], 0), len(values))
+        return known, values
+
+    def counter(self, handle, counter, reader):
+        """Return (first, rate) of the counter that the control at position
+           `reader` reads in the next ticks: it will read `first + rate * i`
+           at the `i`-th tick. Return None if the counter does not exist."""
+        count = handle.counters.get(counter)
+        if count is None:
+            return None
+        first = count
+        rate = 0
+        reader_rank = (self._ranks[reader[0]], reader[1])
+        for (j, position), increment in self._rates.get((handle, counter), ()):
+            rate += increment
+            # steady controls evaluated before the reader in the same tick
+            if (self._ranks[j], position) < reader_rank:
+                first += increment
+        return first, rate
+
+
+def _first_hit(condition, known, values):
+    """Return the index of the first value for which `condition` is True,
+       or the number of values; `condition` is evaluated once per run
+       of equal forecast values."""
+    for i, x in enumerate(known):
+        if x is not None and condition(x):
+            return i
+    if len(values) > 0:
+        starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+        for start in [0] + starts.tolist():
+            if condition(values[start].item()):
+                return len(known) + start
+    return len(known) + len(values)
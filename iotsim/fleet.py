@@ -0,0 +1,307 @@
+"""
+Simulation of a fleet of independent assemblies, e.g. one per physical device.
+
+The devices are split into shards; every shard is stepped by its own worker
+process, and the coordinator merges the workers' outputs ordered by event time.
+"""
+
+import copy
+import itertools
+import multiprocessing
+import os
+import pickle
+import traceback
+from collections import namedtuple
+from collections.abc import Mapping
+
+import numpy as np
+import yaml
+
+from .assembler import from_config
+
+
+FleetChunk = namedtuple('FleetChunk', 'event_time device signal truth reading '
+                                      'arrived arrival_delay')
+# Flat output of a fleet for a window of simulated time.
+# All fields are 1-d numpy arrays with one element per (device, signal, tick),
+# ordered by `event_time` (seconds since the start of the run).
+# `device` and `signal` are indices into `Fleet.devices` and `Fleet.signals`.
+# The rest have the meaning of the same fields of `AssemblyBatch`.
+
+
+def _load_config(config):
+    try:
+        config.items()
+    except AttributeError:
+        with open(str(config), 'r') as f:
+            config = yaml.load(f, Loader=yaml.SafeLoader)
+    return config
+
+
+class _Shard:
+    """Devices stepped together by one worker."""
+
+    def __init__(self, devices):
+        # devices: list of tuples (device index, assembly config, device seed)
+        self._devices = []
+        for device_idx, config, seed in devices:
+            config = copy.deepcopy(config)
+            config['assembly'].setdefault('parameters', dict())['seed'] = seed
+            self._devices.append([device_idx, from_config(config), None])
+        self._processed_ticks = [0] * len(self._devices)
+        self._signal_codes = None
+
+    def info(self):
+        return [(device_idx, assembly.name, assembly.tick,
+                 [signal.name for signal in assembly.signals])
+                for device_idx, assembly, _ in self._devices]
+
+    def set_signal_codes(self, signal_codes):
+        self._signal_codes = signal_codes
+
+    def run_until(self, time_limit):
+        """Step every device through all ticks with event time before `time_limit`."""
+        outputs = []
+        for k, device in enumerate(self._devices):
+            device_idx, assembly, runner = device
+            n_ticks = max(int(np.ceil(round(time_limit / assembly.tick, 9))), 0) \
+                      - self._processed_ticks[k]
+            if runner is None:
+                runner = assembly.launch(batch=n_ticks)
+                batch = next(runner)
+                device[2] = runner
+            else:
+                batch = runner.send(n_ticks)
+            self._processed_ticks[k] += n_ticks
+
+            n_signals = len(batch.signals)
+            event_time = (batch.first_tick + np.arange(n_ticks)) * float(assembly.tick)
+            outputs.append((
+                np.repeat(event_time, n_signals),
+                np.full(n_ticks * n_signals, device_idx),
+                np.tile(self._signal_codes[device_idx], n_ticks),
+                batch.truths.ravel(),
+                batch.readings.ravel(),
+                batch.arrived.ravel(),
+                batch.arrival_delays.ravel(),
+            ))
+        return _merge(outputs)
+
+
+def _merge(outputs):
+    """Concatenate flat outputs and order them by event time."""
+    if len(outputs) == 0:
+        return FleetChunk(*[np.empty(0)] * len(FleetChunk._fields))
+    columns = [np.concatenate(column) for column in zip(*outputs)]
+    order = np.argsort(columns[0], kind='stable')
+    return FleetChunk(*[column[order] for column in columns])
+
+
+class _RemoteTraceback(Exception):
+    """Traceback of an exception raised in a worker process."""
+
+    def __str__(self):
+        return self.args[0]
+
+
+def _worker_error(error):
+    """Return (exception, formatted traceback) of an error in a worker
+       that can be sent to the coordinator."""
+    text = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        error = RuntimeError("{}: {}".format(type(error).__name__, error))
+    return error, text
+
+
+def _shard_worker(connection, devices):
+    # every message to the coordinator is (True, result) or (False, error)
+    try:
+        shard = _Shard(devices)
+        connection.send((True, shard.info()))
+        while True:
+            command, arguments = connection.recv()
+            if command == 'stop':
+                break
+            connection.send((True, getattr(shard, command)(*arguments)))
+    except Exception as error:
+        connection.send((False, _worker_error(error)))
+    finally:
+        connection.close()
+
+
+class _ShardProcess:
+
+    def __init__(self, devices):
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_shard_worker, args=(child_connection, devices), daemon=True)
+        self._process.start()
+        # the worker has its own copy
+        child_connection.close()
+        self._info = None
+
+    def _receive(self):
+        ok, result = self._connection.recv()
+        if not ok:
+            error, text = result
+            raise error from _RemoteTraceback(text)
+        return result
+
+    def info(self):
+        if self._info is None:
+            self._info = self._receive()
+        return self._info
+
+    def request(self, command, *arguments):
+        self._connection.send((command, arguments))
+
+    def response(self):
+        return self._receive()
+
+    def stop(self):
+        try:
+            self._connection.send(('stop', ()))
+        except OSError:
+            # the worker has stopped on an error
+            pass
+        self._process.join()
+        self._connection.close()
+
+
+class _LocalShard(_Shard):
+
+    def request(self, command, *arguments):
+        self._response = getattr(self, command)(*arguments)
+
+    def response(self):
+        return self._response
+
+    def stop(self):
+        pass
+
+
+class Fleet:
+    """Simulation of many independent assemblies.
+
+       `configs` is a list of assembly configs as accepted by `from_config`.
+       Every device gets its own random seed derived from the fleet's `seed`,
+       so that a device produces the same data regardless of the number
+       of processes. With `processes=0` all devices run in this process.
+    """
+
+    def __init__(self, configs, seed=None, processes=None):
+        self._configs = [_load_config(config) for config in configs]
+        if len(self._configs) == 0:
+            raise ValueError("Fleet must have at least one device")
+        seed_sequence = np.random.SeedSequence(seed)
+        self._seeds = [int(child.generate_state(1)[0])
+                       for child in seed_sequence.spawn(len(self._configs))]
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = int(processes)
+        if processes < 0:
+            raise ValueError("Number of processes must be non-negative. Got {}".
+                             format(processes))
+        self._processes = processes
+        self._devices = None
+        self._signals = None
+        self._signal_codes = None
+
+    @classmethod
+    def from_template(cls, config, sweep, **kwargs):
+        """Create a fleet of devices that differ in assembly parameters.
+
+           `sweep` is either a list of dictionaries of assembly parameters,
+           one per device, or a dictionary of lists of parameter values,
+           in which case there is a device for every combination of the values.
+        """
+        config = _load_config(config)
+        if isinstance(sweep, Mapping):
+            names = list(sweep.keys())
+            sweep = [dict(zip(names, values))
+                     for values in itertools.product(*sweep.values())]
+        configs = []
+        for parameters in sweep:
+            device_config = copy.deepcopy(config)
+            device_config['assembly'].setdefault('parameters', dict()).update(parameters)
+            configs.append(device_config)
+        return cls(configs, **kwargs)
+
+    def __len__(self):
+        return len(self._configs)
+
+    @property
+    def devices(self):
+        """Names of the devices; known after the fleet is launched."""
+        return self._devices
+
+    @property
+    def signals(self):
+        """Names of the signals of all devices; known after the fleet is launched."""
+        return self._signals
+
+    def _start_shards(self):
+        devices = [(i, config, seed) for i, (config, seed)
+                   in enumerate(zip(self._configs, self._seeds))]
+        if self._processes == 0:
+            shards = [_LocalShard(devices)]
+        else:
+            n_shards = min(self._processes, len(devices))
+            shards = [_ShardProcess([devices[i] for i in indices])
+                      for indices in np.array_split(np.arange(len(devices)), n_shards)]
+        try:
+            info = [device_info for shard in shards for device_info in shard.info()]
+        except BaseException:
+            for shard in shards:
+                shard.stop()
+            raise
+        names = [name for _, name, _, _ in info]
+        if len(set(names)) < len(names):
+            names = ['{}-{}'.format(name, i) for i, name in enumerate(names)]
+        self._devices = names
+        self._signals = []
+        self._signal_codes = []
+        for _, _, _, signal_names in info:
+            codes = []
+            for signal_name in signal_names:
+                if signal_name not in self._signals:
+                    self._signals.append(signal_name)
+                codes.append(self._signals.index(signal_name))
+            self._signal_codes.append(np.array(codes))
+        for shard in shards:
+            shard.request('set_signal_codes', self._signal_codes)
+        for shard in shards:
+            shard.response()
+        return shards
+
+    def launch(self, window):
+        """Return a runner that advances every device by `window` seconds per call.
+
+           Every call on the runner returns a `FleetChunk` with the output
+           of all ticks whose event time falls into the next window.
+        """
+        if window <= 0:
+            raise ValueError("Window must be positive. Got {}".format(window))
+
+        def fleet_runner():
+            shards = self._start_shards()
+            try:
+                for k in itertools.count(1):
+                    for shard in shards:
+                        shard.request('run_until', k * window)
+                    yield _merge([shard.response() for shard in shards])
+            finally:
+                for shard in shards:
+                    shard.stop()
+
+        return fleet_runner()
+
+    def run(self, duration):
+        """Run all devices for `duration` seconds and return a `FleetChunk`."""
+        runner = self.launch(duration)
+        try:
+            return next(runner)
+        finally:
+            runner.close()
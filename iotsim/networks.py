@@ -1,14 +1,46 @@
-from .core import Network, AssemblyContext
-from itertools import repeat
-from numpy.random import normal, choice
+from .core import Network, NetworkRunner, AssemblyContext
+from .utils import RandomStream
+import numpy as np
+
+
+class _IdealNetworkRunner(NetworkRunner):
+
+    def __next__(self):
+        return (True, 0)
+
+    def apply_batch(self, readings):
+        n = len(readings)
+        return np.ones(n, dtype=bool), np.zeros(n)
+
 
 class IdealNetwork(Network):
 
     def __init__(self, name=None):
         super().__init__(name)
 
-    def activate(self, assembly_context=None):
-        return repeat((True, 0))
+    def activate(self, assembly_context=None, random_stream=None):
+        return _IdealNetworkRunner()
+
+
+class _NormalNetworkRunner(NetworkRunner):
+
+    def __init__(self, network, random_stream):
+        self._parameters = network._parameters
+        self._random_stream = random_stream
+
+    def __next__(self):
+        return (
+            self._random_stream.random() >= self._parameters['drop_rate'],
+            self._random_stream.normal(self._parameters['delay'],
+                                       self._parameters['jitter'])
+        )
+
+    def apply_batch(self, readings):
+        n = len(readings)
+        arrived = self._random_stream.random_array(n) >= self._parameters['drop_rate']
+        arrival_delays = self._random_stream.normal_array(
+            self._parameters['delay'], self._parameters['jitter'], n)
+        return arrived, arrival_delays
 
 
 class NormalNetwork(Network):
@@ -16,7 +48,7 @@ class NormalNetwork(Network):
     def __init__(self, name=None, delay=None, jitter=None, drop_rate=None):
         super().__init__(name, delay=delay, jitter=jitter, drop_rate=drop_rate)
 
-    def activate(self, assembly_context: AssemblyContext = None):
+    def activate(self, assembly_context: AssemblyContext = None, random_stream=None):
         self.update_parameters(assembly_context=assembly_context)
         if self._parameters['delay'] < 0 or self._parameters['jitter'] < 0:
             raise ValueError("Network {} delay and jitter must be non-negative. "
@@ -25,13 +57,6 @@ class NormalNetwork(Network):
         if not 0 <= self._parameters['drop_rate'] < 1:
             raise ValueError("Network {} drop rate msu be in [0, 1). Got {} ".
                              format(self.name, self._parameters['drop_rate']))
-
-        def runner():
-            while True:
-                yield (
-                    choice([True, False], p=[1 - self._parameters['drop_rate'],
-                                              self._parameters['drop_rate']]),
-                    normal(self._parameters['delay'], self._parameters['jitter'])
-                )
-
-        return runner()
+        if random_stream is None:
+            random_stream = RandomStream()
+        return _NormalNetworkRunner(self, random_stream)
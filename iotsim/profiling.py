@@ -0,0 +1,259 @@
+"""
+Opt-in instrumentation of assembly runs.
+
+Pass a `Profiler` to `Assembly.launch(profiler=...)` to count calls and
+measure the time spent in every behavior, reader and network, and to count
+evaluations and hits of the trigger of every control. Runners of an assembly
+launched without a profiler are not instrumented at all.
+
+The collected statistics are returned by `Profiler.table()` as text
+or by `Profiler.prometheus()` in Prometheus text exposition format.
+"""
+
+from time import perf_counter_ns
+
+import numpy as np
+
+from .core import BehaviorRunner, ReaderRunner, NetworkRunner, _apply_reader, _apply_network
+
+
+class Profiler:
+
+    def __init__(self, prefix='iotsim'):
+        self.prefix = prefix
+        # (kind, component) -> [calls, ns]
+        self.components = dict()
+        # control -> [evaluations, hits, trigger ns, action ns]
+        self.controls = dict()
+        # name -> [count, sum, max, last]
+        self.observations = dict()
+
+    def component_stats(self, kind, component):
+        return self.components.setdefault((kind, component), [0, 0])
+
+    def observe(self, name, value):
+        """Record a value of a metric, e.g. the lag behind schedule in seconds."""
+        stats = self.observations.get(name)
+        if stats is None:
+            self.observations[name] = [1, value, value, value]
+        else:
+            stats[0] += 1
+            stats[1] += value
+            if value > stats[2]:
+                stats[2] = value
+            stats[3] = value
+
+    def wrap_function(self, kind, component, function):
+        stats = self.component_stats(kind, component)
+
+        def profiled(*args, **kwargs):
+            started_at = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats[1] += perf_counter_ns() - started_at
+                stats[0] += 1
+
+        return profiled
+
+    def wrap_behavior(self, component, behavior_runner):
+        return _ProfiledBehaviorRunner(self.component_stats('behavior', component),
+                                       behavior_runner)
+
+    def wrap_reader(self, component, reader_runner):
+        return _ProfiledReaderRunner(self.component_stats('reader', component),
+                                     reader_runner)
+
+    def wrap_network(self, component, network_runner):
+        return _ProfiledNetworkRunner(self.component_stats('network', component),
+                                      network_runner)
+
+    def wrap_control(self, control, condition, action):
+        """Return a function that fires a control and counts its trigger's hits."""
+        stats = self.controls.setdefault(control, [0, 0, 0, 0])
+
+        def fire():
+            started_at = perf_counter_ns()
+            hit = condition()
+            checked_at = perf_counter_ns()
+            stats[0] += 1
+            stats[2] += checked_at - started_at
+            if hit:
+                action()
+                stats[1] += 1
+                stats[3] += perf_counter_ns() - checked_at
+
+        return fire
+
+    def table(self):
+        lines = ['{:10s} {:30s} {:>12s} {:>14s} {:>10s}'.format(
+            'kind', 'component', 'calls', 'total ms', 'ns/call')]
+        for (kind, component), (calls, ns) in sorted(self.components.items()):
+            lines.append('{:10s} {:30s} {:>12d} {:>14.3f} {:>10.0f}'.format(
+                kind, component, calls, ns / 1e6, ns / calls if calls else 0))
+        if self.controls:
+            lines.append('')
+            lines.append('{:41s} {:>12s} {:>10s} {:>14s} {:>14s}'.format(
+                'control', 'evaluations', 'hit rate', 'trigger ms', 'action ms'))
+            for control, (evaluations, hits, trigger_ns, action_ns) \
+                    in sorted(self.controls.items()):
+                lines.append('{:41s} {:>12d} {:>10.2%} {:>14.3f} {:>14.3f}'.format(
+                    control, evaluations, hits / evaluations if evaluations else 0,
+                    trigger_ns / 1e6, action_ns / 1e6))
+        if self.observations:
+            lines.append('')
+            lines.append('{:41s} {:>12s} {:>10s} {:>14s} {:>14s}'.format(
+                'metric', 'count', 'last', 'mean', 'max'))
+            for name, (count, total, maximum, last) in sorted(self.observations.items()):
+                lines.append('{:41s} {:>12d} {:>10.4g} {:>14.4g} {:>14.4g}'.format(
+                    name, count, last, total / count, maximum))
+        return '\n'.join(lines) + '\n'
+
+    def prometheus(self):
+        prefix = self.prefix
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, metric_type))
+            for labels, value in samples:
+                lines.append('{}_{}{} {}'.format(prefix, name, _labels(labels), value))
+
+        components = sorted(self.components.items())
+        metric('component_calls_total', 'counter', 'Calls of assembly components.',
+               [(dict(kind=kind, component=component), calls)
+                for (kind, component), (calls, _) in components])
+        metric('component_seconds_total', 'counter',
+               'Time spent in assembly components.',
+               [(dict(kind=kind, component=component), ns / 1e9)
+                for (kind, component), (_, ns) in components])
+        controls = sorted(self.controls.items())
+        metric('control_evaluations_total', 'counter',
+               'Evaluations of the triggers of controls.',
+               [(dict(control=control), stats[0]) for control, stats in controls])
+        metric('control_hits_total', 'counter',
+               'Evaluations of the triggers of controls that fired the action.',
+               [(dict(control=control), stats[1]) for control, stats in controls])
+        metric('control_trigger_seconds_total', 'counter',
+               'Time spent in the triggers of controls.',
+               [(dict(control=control), stats[2] / 1e9) for control, stats in controls])
+        metric('control_action_seconds_total', 'counter',
+               'Time spent in the actions of controls.',
+               [(dict(control=control), stats[3] / 1e9) for control, stats in controls])
+        for name, (count, total, maximum, last) in sorted(self.observations.items()):
+            metric(name, 'gauge', 'Last observed value.', [(dict(), last)])
+            metric(name + '_max', 'gauge', 'Maximum observed value.', [(dict(), maximum)])
+            metric(name + '_sum', 'counter', 'Sum of observed values.', [(dict(), total)])
+            metric(name + '_count', 'counter', 'Number of observations.', [(dict(), count)])
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()) + '}'
+
+
+class _ProfiledBehaviorRunner(BehaviorRunner):
+
+    def __init__(self, stats, runner):
+        self._stats = stats
+        self._runner = runner
+
+    @property
+    def position(self):
+        return getattr(self._runner, 'position', None)
+
+    def __next__(self):
+        started_at = perf_counter_ns()
+        value = next(self._runner)
+        self._stats[1] += perf_counter_ns() - started_at
+        self._stats[0] += 1
+        return value
+
+    def next_chunk(self, k):
+        started_at = perf_counter_ns()
+        if isinstance(self._runner, BehaviorRunner):
+            values = self._runner.next_chunk(k)
+        else:
+            values = np.array([next(self._runner) for _ in range(k)])
+        self._stats[1] += perf_counter_ns() - started_at
+        self._stats[0] += len(values)
+        return values
+
+    def preview(self, k):
+        if isinstance(self._runner, BehaviorRunner):
+            return self._runner.preview(k)
+        return None
+
+    def skip(self, k, keep=1):
+        started_at = perf_counter_ns()
+        if isinstance(self._runner, BehaviorRunner):
+            values = self._runner.skip(k, keep)
+        else:
+            values = np.array([next(self._runner) for _ in range(k)])[-keep:]
+        self._stats[1] += perf_counter_ns() - started_at
+        self._stats[0] += k
+        return values
+
+    def get_state(self):
+        return self._runner.get_state()
+
+    def set_state(self, state):
+        self._runner.set_state(state)
+
+
+class _ProfiledReaderRunner(ReaderRunner):
+
+    def __init__(self, stats, runner):
+        self._stats = stats
+        self._runner = runner
+
+    def __call__(self, true_value):
+        started_at = perf_counter_ns()
+        reading_value = self._runner(true_value)
+        self._stats[1] += perf_counter_ns() - started_at
+        self._stats[0] += 1
+        return reading_value
+
+    def apply_batch(self, truths):
+        started_at = perf_counter_ns()
+        readings = _apply_reader(self._runner, truths)
+        self._stats[1] += perf_counter_ns() - started_at
+        self._stats[0] += len(truths)
+        return readings
+
+    def get_state(self):
+        return self._runner.get_state()
+
+    def set_state(self, state):
+        self._runner.set_state(state)
+
+
+class _ProfiledNetworkRunner(NetworkRunner):
+
+    def __init__(self, stats, runner):
+        self._stats = stats
+        self._runner = runner
+
+    def __next__(self):
+        started_at = perf_counter_ns()
+        transmission = next(self._runner)
+        self._stats[1] += perf_counter_ns() - started_at
+        self._stats[0] += 1
+        return transmission
+
+    def apply_batch(self, readings):
+        started_at = perf_counter_ns()
+        transmissions = _apply_network(self._runner, readings)
+        self._stats[1] += perf_counter_ns() - started_at
+        self._stats[0] += len(readings)
+        return transmissions
+
+    def get_state(self):
+        return self._runner.get_state()
+
+    def set_state(self, state):
+        self._runner.set_state(state)
@@ -1,9 +1,27 @@
-from .core import Reader, AssemblyContext
-from numpy.random import random
+from .core import Reader, ReaderRunner, AssemblyContext
+from .utils import RandomStream, _default_random_stream
+import numpy as np
 
-def add_noise(x, noise, noise_type='relative'):
+def add_noise(x, noise, noise_type='relative', random_stream=None):
+    if random_stream is None:
+        random_stream = _default_random_stream
     factor = x if noise_type=='relative' else 1
-    return x + noise * factor * 2 * (random() - 0.5)
+    return x + noise * factor * 2 * (random_stream.random() - 0.5)
+
+def add_noise_array(x, noise, noise_type='relative', random_stream=None):
+    if random_stream is None:
+        random_stream = _default_random_stream
+    factor = x if noise_type=='relative' else 1
+    return x + noise * factor * 2 * (random_stream.random_array(len(x)) - 0.5)
+
+
+class _PassthroughRunner(ReaderRunner):
+
+    def __call__(self, true_value):
+        return true_value
+
+    def apply_batch(self, truths):
+        return np.array(truths, dtype=float)
 
 
 class PassthroughReader(Reader):
@@ -11,8 +29,47 @@ class PassthroughReader(Reader):
     def __init__(self, name=None):
         super().__init__(name)
 
-    def activate(self, assembly_context=None):
-        return lambda x: x
+    def activate(self, assembly_context=None, random_stream=None):
+        return _PassthroughRunner()
+
+
+class _EveryNthRunner(ReaderRunner):
+
+    def __init__(self, reader, random_stream):
+        self._parameters = reader._parameters
+        self._noise_type = reader._noise_type
+        self._random_stream = random_stream
+        self.counter = 0
+
+    def __call__(self, true_value):
+        if self.counter == 0:
+            result =  add_noise(true_value, self._parameters['noise'],
+                                self._noise_type, self._random_stream)
+        else:
+            result = None
+
+        self.counter += 1
+        if self.counter >= self._parameters['step']:
+               self.counter = 0
+
+        return result
+
+    def apply_batch(self, truths):
+        n = len(truths)
+        step = self._parameters['step']
+        readings = np.full(n, np.nan)
+        # readings are done when the counter is zero
+        read_at = np.arange((-self.counter) % step, n, step)
+        readings[read_at] = add_noise_array(truths[read_at], self._parameters['noise'],
+                                            self._noise_type, self._random_stream)
+        self.counter = (self.counter + n) % step
+        return readings
+
+    def get_state(self):
+        return self.counter
+
+    def set_state(self, state):
+        self.counter = state
 
 
 class EveryNthReader(Reader):
@@ -22,29 +79,75 @@ class EveryNthReader(Reader):
         self._noise_type = noise_type
         super().__init__(name, step=step, noise=noise)
 
-    def activate(self, assembly_context: AssemblyContext=None):
+    def activate(self, assembly_context: AssemblyContext=None, random_stream=None):
         self.update_parameters(assembly_context=assembly_context)
         self._parameters['step'] = int(self._parameters['step'])
         if self._parameters['step'] <= 0:
             raise ValueError("Step of {} must be positive. Got {}.".format(
                               self.name, self._parameters['step']))
-        counter=0
-
-        def reader_runner(true_value):
-            nonlocal counter
-            if counter == 0:
-                result =  add_noise(true_value,
-                                    self._parameters['noise'], self._noise_type)
-            else:
-                result = None
+        if random_stream is None:
+            random_stream = RandomStream()
+        return _EveryNthRunner(self, random_stream)
+
+
+class _OnChangeRunner(ReaderRunner):
+
+    def __init__(self, reader, random_stream):
+        self._parameters = reader._parameters
+        self._noise_type = reader._noise_type
+        self._random_stream = random_stream
+        self.counter = 0
+        self.prev_value = None
+
+    def __call__(self, true_value):
+        if (self.prev_value is None
+            or abs(true_value - self.prev_value) > self._parameters['accuracy']
+            or self._parameters['step'] > 0 and self.counter == 0
+        ):
+            result =  add_noise(true_value, self._parameters['noise'],
+                                self._noise_type, self._random_stream)
+            self.counter = 0
+        else:
+            result = None
+
+        self.prev_value = true_value
+        if self._parameters['step'] > 0:
+            self.counter += 1
+            if self.counter == self._parameters['step']:
+                self.counter = 0
+
+        return result
+
+    def apply_batch(self, truths):
+        n = len(truths)
+        if n == 0:
+            return np.empty(0)
+        step = self._parameters['step']
+        changed = np.empty(n, dtype=bool)
+        changed[0] = (self.prev_value is None
+                      or abs(truths[0] - self.prev_value) > self._parameters['accuracy'])
+        changed[1:] = np.abs(np.diff(truths)) > self._parameters['accuracy']
+        read = changed
+        if step > 0:
+            # a reading is also done every `step` ticks after the last change
+            ticks = np.arange(n)
+            last_change = np.maximum.accumulate(np.where(changed, ticks, -1))
+            since_reset = np.where(last_change >= 0, ticks - last_change,
+                                   self.counter + ticks)
+            read = changed | (since_reset % step == 0)
+            self.counter = int(since_reset[-1] + 1) % step
+        readings = np.full(n, np.nan)
+        readings[read] = add_noise_array(truths[read], self._parameters['noise'],
+                                         self._noise_type, self._random_stream)
+        self.prev_value = truths[-1].item()
+        return readings
+
+    def get_state(self):
+        return self.counter, self.prev_value
+
+    def set_state(self, state):
+        self.counter, self.prev_value = state
 
-            counter += 1
-            if counter >= self._parameters['step']:
-                   counter = 0
-
-            return result
-
-        return reader_runner
 
 class OnChangeReader(Reader):
 
@@ -53,36 +156,12 @@ class OnChangeReader(Reader):
         self._noise_type = noise_type
         super().__init__(name, accuracy=accuracy, step=step, noise=noise)
 
-    def activate(self, assembly_context: AssemblyContext = None):
+    def activate(self, assembly_context: AssemblyContext = None, random_stream=None):
         self.update_parameters(assembly_context=assembly_context)
         self._parameters['step'] = int(self._parameters['step'])
         if self._parameters['step'] < 0:
             raise ValueError("Step of {} must be non-negative. Got {}.".format(
                               self.name, self._parameters['step']))
-        counter=0
-        prev_value = None
-
-        def reader_runner(true_value):
-            nonlocal counter, prev_value
-
-            if (prev_value is None
-                or abs(true_value - prev_value) > self._parameters['accuracy']
-                or self._parameters['step'] > 0 and counter == 0
-            ):
-                result =  add_noise(true_value,
-                                    self._parameters['noise'], self._noise_type)
-                counter = 0
-            else:
-                result = None
-
-            prev_value = true_value
-            if self._parameters['step'] > 0:
-                counter += 1
-                if counter == self._parameters['step']:
-                    counter = 0
-
-            return result
-
-        return reader_runner
-
-
+        if random_stream is None:
+            random_stream = RandomStream()
+        return _OnChangeRunner(self, random_stream)
@@ -0,0 +1,56 @@
+"""
+This module keeps the time of an assembly run as integer nanoseconds.
+
+Time stamps are nanoseconds since the epoch, the same as `pd.Timestamp.value`.
+They are converted to text with `IsoFormatter`, which produces the same
+strings as `str(pd.Timestamp)` without creating a Timestamp per message.
+"""
+
+import datetime
+
+NS_PER_SECOND = 10 ** 9
+NS_PER_MICROSECOND = 10 ** 3
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def seconds_to_ns(seconds):
+    return int(round(seconds * NS_PER_SECOND))
+
+
+class IsoFormatter:
+    """Formats nanoseconds since the epoch as 'YYYY-MM-DD HH:MM:SS[.fraction]'.
+
+       The date and time part is cached for the latest second, so for times
+       that go mostly forward, a call costs an integer division and
+       a string concatenation.
+       The fraction has 6 digits, 9 digits if there are nanoseconds,
+       and is omitted if the time falls on a whole second.
+       If `utc_offset` (a `datetime.timedelta`) is given, times are local
+       to this offset and end with it, e.g. '+02:00', as the times
+       of a `pd.Timestamp` with a time zone.
+    """
+
+    def __init__(self, utc_offset=None):
+        self._second = None
+        self._prefix = None
+        if utc_offset is None:
+            self._offset = datetime.timedelta(0)
+            self._suffix = ''
+        else:
+            self._offset = utc_offset
+            self._suffix = datetime.datetime(
+                2000, 1, 1, tzinfo=datetime.timezone(utc_offset)).isoformat()[19:]
+
+    def __call__(self, ns):
+        second, fraction = divmod(ns, NS_PER_SECOND)
+        if second != self._second:
+            self._prefix = (_EPOCH + datetime.timedelta(seconds=second)
+                            + self._offset).isoformat(' ')
+            self._second = second
+        if fraction == 0:
+            return self._prefix + self._suffix
+        microseconds, nanoseconds = divmod(fraction, NS_PER_MICROSECOND)
+        if nanoseconds == 0:
+            return '{}.{:06d}{}'.format(self._prefix, microseconds, self._suffix)
+        return '{}.{:09d}{}'.format(self._prefix, fraction, self._suffix)
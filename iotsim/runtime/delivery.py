@@ -0,0 +1,155 @@
+"""
+This module orders the messages of an assembly by the time they arrive
+at their destinations.
+"""
+
+import asyncio
+import heapq
+import time
+from itertools import count
+
+
+class ArrivalQueue:
+    """Priority queue of messages keyed by arrival time.
+
+       Messages with equal arrival times come out in the order they were pushed.
+       Arrival times may be of any type that supports ordering, e.g. pandas
+       Timestamps or integer nanoseconds.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._order = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, arrival_time, message):
+        heapq.heappush(self._heap, (arrival_time, next(self._order), message))
+
+    def next_arrival_time(self):
+        """Arrival time of the first message, or None if the queue is empty."""
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, until):
+        """Remove and yield tuples (arrival_time, message) with arrival time <= `until`."""
+        heap = self._heap
+        while heap and heap[0][0] <= until:
+            arrival_time, _, message = heapq.heappop(heap)
+            yield arrival_time, message
+
+    def pending(self):
+        """Return a list of tuples (arrival_time, message) in the order of arrival
+           without removing them."""
+        return [(arrival_time, message)
+                for arrival_time, _, message in sorted(self._heap, key=lambda item: item[:2])]
+
+    def drain(self):
+        """Remove and yield all tuples (arrival_time, message) in the order of arrival."""
+        heap = self._heap
+        while heap:
+            arrival_time, _, message = heapq.heappop(heap)
+            yield arrival_time, message
+
+
+class DeliveryScheduler:
+    """Delivers messages at their delivery times in the real time.
+
+       `deliver(messages)` is called with the list of all messages that are due,
+       at most once per time slot of `slot` seconds, instead of a task per message.
+       Delivery times are in the units of the `now()` clock, `clock_rate` units
+       per second, e.g. ``now=time.monotonic_ns, clock_rate=10**9``.
+       Messages are delivered at the end of the slot of their delivery time;
+       a message delivered later than the end of the next slot is counted
+       in `late_counter`.
+       While `backpressure()` returns True, due messages are held back
+       and tried again in the next slot. `poll()`, if given, is called at least
+       every `poll_interval` seconds, e.g. to flush buffered destinations.
+       `observe_lag(seconds)`, if given, is called at every delivery with
+       how late the earliest of the delivered messages is.
+    """
+
+    def __init__(self, deliver, slot=0.01, now=time.monotonic, clock_rate=1,
+                 backpressure=None, poll=None, poll_interval=0.1, observe_lag=None):
+        if slot <= 0:
+            raise ValueError("Time slot must be positive. Got {}".format(slot))
+        self._deliver = deliver
+        self._clock_rate = clock_rate
+        self._slot = slot * clock_rate
+        if isinstance(clock_rate, int):
+            self._slot = max(int(round(self._slot)), 1)
+        self._now = now
+        self._backpressure = backpressure
+        self._poll = poll
+        self._poll_interval = poll_interval
+        self._observe_lag = observe_lag
+        self._queue = ArrivalQueue()
+        self._wake_at = None
+        self._wakeup = None
+        self._closed = False
+        self.delivered_counter = 0
+        self.late_counter = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def schedule(self, delivery_time, message):
+        self._queue.push(delivery_time, message)
+        if (self._wakeup is not None
+                and (self._wake_at is None or delivery_time < self._wake_at)):
+            self._wakeup.set()
+
+    def flush_due(self):
+        """Deliver all the messages that are due and return their number."""
+        if self._backpressure is not None and self._backpressure():
+            return 0
+        now = self._now()
+        due = list(self._queue.pop_due(now))
+        if due:
+            late_before = now - 2 * self._slot
+            self.late_counter += sum(1 for delivery_time, _ in due
+                                     if delivery_time < late_before)
+            if self._observe_lag is not None:
+                self._observe_lag(max(now - due[0][0], 0) / self._clock_rate)
+            self._deliver([message for _, message in due])
+            self.delivered_counter += len(due)
+        return len(due)
+
+    def close(self):
+        """Stop `run` after all scheduled messages are delivered."""
+        self._closed = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _time_to_wait(self):
+        next_time = self._queue.next_arrival_time()
+        if next_time is None:
+            self._wake_at = None
+            return None if self._poll is None else self._poll_interval
+        # wake up at the end of the slot of the next delivery time
+        self._wake_at = -(-next_time // self._slot) * self._slot
+        now = self._now()
+        if self._wake_at <= now and self._backpressure is not None:
+            # due messages are held back: wait for the next slot
+            self._wake_at = now + self._slot
+        wait = max(self._wake_at - now, 0) / self._clock_rate
+        if self._poll is not None:
+            wait = min(wait, self._poll_interval)
+        return wait
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self.flush_due()
+                if self._poll is not None:
+                    self._poll()
+                if self._closed and len(self._queue) == 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._time_to_wait())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._wakeup = None
@@ -4,6 +4,26 @@ This module defines where your  assembly can send its data.
 Write a destination class to implement your destination.
 The class must define three methods:
 `__init__(**kwargs)`, `send(message)`, `shutdown()`
+It may also define `send_batch(messages)` to send many messages at once
+(see `Destination`). `send_batch` returns the list of messages that
+the destination could not accept at the moment (e.g. throttled by a service),
+or None if all of them were accepted.
+
+The script wraps every destination into `BufferedDestination`, which collects
+messages and passes them to `send_batch` in batches.
+
+A destination that spreads the messages over partitions (shards) of
+a service sets the class attribute `partitioned = True`. It then gets
+tuples (partition_key, message) instead of messages, both in `send`
+and `send_batch`; the script derives the keys from the signal or
+assembly names (option `partition_key` in destination's config).
+
+A destination that does I/O should not block the event loop that paces
+the assembly. Such a destination is either a subclass of `AsyncDestination`
+with coroutines `send_batch(messages)` and `shutdown()`, or a synchronous
+destination that the script runs in a thread pool (option `threads`
+in its config). Either way, the script sends its batches concurrently
+through `ConcurrentDestination`.
 
 Then add your destination to `known_destinations` dictionary.
 
@@ -16,10 +36,258 @@ The destination will be instantiated as
 
 """
 
+import asyncio
 import sys
+from abc import ABC, abstractmethod
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+class Destination(ABC):
+    """Base class of destinations that sends batches one message at a time."""
+
+    partitioned = False
+
+    @abstractmethod
+    def send(self, message):
+        pass
+
+    def send_batch(self, messages):
+        for message in messages:
+            self.send(message)
+
+    def shutdown(self):
+        pass
+
+
+def send_batch(destination, messages):
+    """Send `messages` to any destination and return the messages not accepted."""
+    try:
+        method = destination.send_batch
+    except AttributeError:
+        for message in messages:
+            destination.send(message)
+        return None
+    return method(messages)
+
+
+def _join(messages):
+    if isinstance(messages[0], bytes):
+        return b''.join(messages)
+    return ('\n'.join(messages) + '\n').encode('utf-8')
+
+
+def _message_size(message):
+    if isinstance(message, tuple):
+        # (partition_key, message)
+        message = message[1]
+    return len(message)
+
+
+class BufferedDestination(Destination):
+    """Collects messages and sends them to `destination` in batches.
+
+       A batch is sent when it has `max_count` messages or `max_bytes` bytes,
+       or when its oldest message has waited for `max_latency` seconds
+       (checked by `poll`). Messages that the destination does not accept
+       are kept and sent again with the next batch. When more than
+       `max_pending` messages are kept, the destination is `saturated`,
+       and the sender should hold off new messages.
+    """
+
+    def __init__(self, destination, max_count=500, max_bytes=1000000,
+                 max_latency=0.1, max_pending=100000, now=time.monotonic):
+        self.destination = destination
+        self.max_count = int(max_count)
+        self.max_bytes = int(max_bytes)
+        self.max_latency = max_latency
+        self.max_pending = int(max_pending)
+        self._now = now
+        self._messages = []
+        self._bytes = 0
+        self._first_at = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def partitioned(self):
+        return getattr(self.destination, 'partitioned', False)
+
+    @property
+    def saturated(self):
+        return len(self._messages) > self.max_pending
+
+    def send(self, message):
+        self.send_batch([message])
+
+    def send_batch(self, messages):
+        if not messages:
+            return None
+        if self._first_at is None:
+            self._first_at = self._now()
+        self._messages.extend(messages)
+        self._bytes += sum(_message_size(message) for message in messages)
+        if len(self._messages) >= self.max_count or self._bytes >= self.max_bytes:
+            self.flush()
+        return None
+
+    def poll(self):
+        """Send the messages if the oldest of them waited too long."""
+        if (self._first_at is not None
+                and self._now() - self._first_at >= self.max_latency):
+            self.flush()
+
+    def flush(self):
+        messages = self._messages
+        self._messages = []
+        self._bytes = 0
+        self._first_at = None
+        for start in range(0, len(messages), self.max_count):
+            rejected = send_batch(self.destination, messages[start:start + self.max_count])
+            if rejected:
+                self._messages.extend(rejected)
+        if self._messages:
+            self._bytes = sum(_message_size(message) for message in self._messages)
+            self._first_at = self._now()
+
+    def shutdown(self):
+        self.flush()
+        self.destination.shutdown()
+
+    async def async_shutdown(self):
+        """Shut down a buffered `ConcurrentDestination` once all messages are sent."""
+        destination = self.destination
+        while True:
+            self.flush()
+            self._messages.extend(await destination.drain())
+            if not self._messages:
+                break
+            await asyncio.sleep(self.max_latency)
+        await destination.destination.shutdown()
+
+
+class AsyncDestination(ABC):
+    """Base class of destinations that send batches in coroutines."""
+
+    partitioned = False
+
+    @abstractmethod
+    async def send_batch(self, messages):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class ThreadPoolDestination(AsyncDestination):
+    """Runs a synchronous destination in a pool of `threads` threads."""
+
+    def __init__(self, destination, threads=4):
+        self.destination = destination
+        self._executor = ThreadPoolExecutor(max_workers=int(threads))
+
+    @property
+    def partitioned(self):
+        return getattr(self.destination, 'partitioned', False)
+
+    async def send_batch(self, messages):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, send_batch, self.destination, messages)
+
+    async def shutdown(self):
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.destination.shutdown)
+        self._executor.shutdown()
+
+
+class ConcurrentDestination(Destination):
+    """Synchronous front of an `AsyncDestination`.
+
+       `send_batch` starts sending a batch in a task and returns at once.
+       Up to `max_in_flight` batches are sent concurrently; beyond that
+       the batch is not accepted (and is returned to the sender).
+       Messages rejected by the destination are returned by the next call.
+       An error raised while sending a batch is raised again by the next
+       call or by `drain`.
+       Must be used while an event loop is running.
+    """
+
+    def __init__(self, destination, max_in_flight=8):
+        self.destination = destination
+        self.max_in_flight = int(max_in_flight)
+        self._tasks = set()
+        self._rejected = []
+        self._error = None
+
+    @property
+    def partitioned(self):
+        return self.destination.partitioned
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    def send(self, message):
+        return self.send_batch([message])
+
+    def send_batch(self, messages):
+        self._raise_error()
+        rejected, self._rejected = self._rejected, []
+        if messages:
+            if len(self._tasks) >= self.max_in_flight:
+                rejected.extend(messages)
+            else:
+                task = asyncio.ensure_future(self.destination.send_batch(messages))
+                self._tasks.add(task)
+                task.add_done_callback(self._done)
+        return rejected or None
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            # the first error is raised, the batches that fail after it are lost
+            if self._error is None:
+                self._error = error
+        elif task.result():
+            self._rejected.extend(task.result())
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    async def drain(self):
+        """Wait until all batches in flight are sent; return rejected messages."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._raise_error()
+        rejected, self._rejected = self._rejected, []
+        return rejected
+
+    def shutdown(self):
+        raise RuntimeError("Use `await drain()` and `await destination.shutdown()` "
+                           "to shut down {}".format(type(self).__name__))
 
 
-class StandardDestination:
+class NullDestination(Destination):
+    """Discards the messages; counts them in `messages`."""
+
+    def __init__(self):
+        self.messages = 0
+
+    def send(self, message):
+        self.messages += 1
+
+    def send_batch(self, messages):
+        self.messages += len(messages)
+
+
+class StandardDestination(Destination):
 
     def __init__(self, output):
         output = output.lower()
@@ -31,35 +299,81 @@ class StandardDestination:
             raise ValueError("Unrecognized output {!r}".format(output))
 
     def send(self, message):
-        print(message, file=self.file)
+        self.send_batch([message])
 
-    def shutdown(self):
-        pass
+    def send_batch(self, messages):
+        if not messages:
+            return
+        if isinstance(messages[0], bytes):
+            # binary messages are written as they are, without separators
+            self.file.flush()
+            self.file.buffer.write(b''.join(messages))
+            self.file.buffer.flush()
+        else:
+            self.file.write('\n'.join(messages) + '\n')
+
+
+class KinesisDestination(Destination):
+    """Sends messages to a Kinesis data stream.
 
+       Batches are sent with `put_records`, up to 500 records per call.
+       Records go to the shards by their partition keys; `partition_key`
+       is used for the messages without one.
+       `client` replaces the boto3 Kinesis client, e.g. with a stub in tests.
+    """
 
-class KinesisDestination:
+    max_records = 500
+    partitioned = True
 
-    def __init__(self, stream):
-        from boto3 import client as boto3_client
-        self.kinesis_client = boto3_client('kinesis')
+    def __init__(self, stream, partition_key='dummy', client=None):
+        if client is None:
+            from boto3 import client as boto3_client
+            client = boto3_client('kinesis')
+        self.kinesis_client = client
         self.stream = str(stream)
-        self.partitiion_key = 'dummy'
+        self.partition_key = str(partition_key)
+
+    def _keyed(self, message):
+        if isinstance(message, tuple):
+            key, message = message
+            if key is not None:
+                return str(key), message
+        return self.partition_key, message
 
     def send(self, message):
+        key, message = self._keyed(message)
         response = self.kinesis_client.put_record(
             StreamName=self.stream,
             Data=message,
-            PartitionKey=self.partitiion_key)
+            PartitionKey=key)
 
-    def shutdown(self):
-        pass
+    def send_batch(self, messages):
+        rejected = []
+        for start in range(0, len(messages), self.max_records):
+            records = messages[start:start + self.max_records]
+            response = self.kinesis_client.put_records(
+                StreamName=self.stream,
+                Records=[{'Data': message, 'PartitionKey': key}
+                         for key, message in map(self._keyed, records)])
+            if response.get('FailedRecordCount', 0):
+                # throttled records are returned to be sent again
+                rejected.extend(message for message, result
+                                in zip(records, response['Records'])
+                                if 'ErrorCode' in result)
+        return rejected or None
 
 
-class PubSubDestination:
+class PubSubDestination(Destination):
+    """Publishes messages to a Google Cloud Pub/Sub topic.
 
-    def __init__(self, project_id, topic_name):
-        from google.cloud import pubsub_v1
-        self.publisher = pubsub_v1.PublisherClient()
+       `publisher` replaces `pubsub_v1.PublisherClient`, e.g. with a stub in tests.
+    """
+
+    def __init__(self, project_id, topic_name, publisher=None):
+        if publisher is None:
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient()
+        self.publisher = publisher
         self.topic_path = self.publisher.topic_path(project_id, topic_name)
         self._sent_counter = 0
         self._published_counter = 0
@@ -69,7 +383,8 @@ class PubSubDestination:
         def callback(future):
             self._published_counter += 1
 
-        message = message.encode('utf-8')
+        if isinstance(message, str):
+            message = message.encode('utf-8')
         self._sent_counter += 1
         message_future = self.publisher.publish(self.topic_path, data=message)
         message_future.add_done_callback(callback)
@@ -82,9 +397,225 @@ class PubSubDestination:
             file=sys.stderr
         )
 
+class HttpDestination(AsyncDestination):
+    """POSTs batches of messages to an HTTP server, one message per line.
+
+       Keeps a pool of up to `max_connections` persistent HTTP/1.1 connections.
+       Batches answered with status 429 or 503 are returned to be sent again.
+    """
+
+    def __init__(self, url, max_connections=4, timeout=10):
+        parts = urlsplit(url)
+        if parts.scheme != 'http':
+            raise ValueError("Only http URLs are supported. Got {!r}".format(url))
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        self.timeout = timeout
+        self.max_connections = int(max_connections)
+        # asyncio primitives are made in the running event loop (see `send_batch`)
+        self._connections = None
+        self._semaphore = None
+
+    async def _request(self, connection, body):
+        reader, writer = connection
+        writer.write('POST {} HTTP/1.1\r\nHost: {}:{}\r\n'
+                     'Content-Type: application/octet-stream\r\n'
+                     'Content-Length: {}\r\n\r\n'.
+                     format(self.path, self.host, self.port, len(body)).encode('ascii'))
+        writer.write(body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        content_length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                content_length = int(value)
+        if content_length:
+            await reader.readexactly(content_length)
+        return status
+
+    async def send_batch(self, messages):
+        if not messages:
+            return None
+        body = _join(messages)
+        if self._semaphore is None:
+            self._connections = asyncio.LifoQueue()
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            try:
+                connection = self._connections.get_nowait()
+            except asyncio.QueueEmpty:
+                connection = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            try:
+                status = await asyncio.wait_for(self._request(connection, body),
+                                                self.timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+            self._connections.put_nowait(connection)
+        if status in (429, 503):
+            return messages
+        if not 200 <= status < 300:
+            raise RuntimeError("HTTP destination {}:{} answered with status {}".
+                               format(self.host, self.port, status))
+        return None
+
+    async def shutdown(self):
+        if self._connections is None:
+            return
+        while not self._connections.empty():
+            _, writer = self._connections.get_nowait()
+            writer.close()
+
+
+class TcpDestination(AsyncDestination):
+    """Sends messages to a TCP server, one message per line
+       (binary messages are sent as they are).
+
+       The connection is opened on the first batch and again after it breaks;
+       a batch that could not be sent is returned to be sent again.
+    """
+
+    def __init__(self, host, port, timeout=10):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self._writer = None
+        # made in the running event loop
+        self._connecting = None
+
+    async def _connect(self):
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._writer is None:
+                _, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+        return self._writer
+
+    async def send_batch(self, messages):
+        if not messages:
+            return None
+        try:
+            writer = await self._connect()
+            writer.write(_join(messages))
+            await asyncio.wait_for(writer.drain(), self.timeout)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            return messages
+        return None
+
+    async def shutdown(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+
+class UdpDestination(AsyncDestination):
+    """Sends messages to a UDP endpoint.
+
+       Messages are packed into datagrams of at most `max_datagram` bytes,
+       one message per line (binary messages are packed as they are);
+       a longer message is sent in a datagram of its own.
+       Delivery is not confirmed.
+    """
+
+    def __init__(self, host, port, max_datagram=1400):
+        self.host = host
+        self.port = int(port)
+        self.max_datagram = int(max_datagram)
+        self._transport = None
+
+    def _datagrams(self, messages):
+        datagram = []
+        size = 0
+        for message in messages:
+            if isinstance(message, str):
+                message = (message + '\n').encode('utf-8')
+            if datagram and size + len(message) > self.max_datagram:
+                yield b''.join(datagram)
+                datagram = []
+                size = 0
+            datagram.append(message)
+            size += len(message)
+        if datagram:
+            yield b''.join(datagram)
+
+    async def send_batch(self, messages):
+        if self._transport is None:
+            self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=(self.host, self.port))
+        for datagram in self._datagrams(messages):
+            self._transport.sendto(datagram)
+        return None
+
+    async def shutdown(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+
+class KafkaDestination(Destination):
+    """Sends messages to a Kafka topic.
+
+       Messages with the same partition key go to the same partition of the topic.
+       `producer` replaces `kafka.KafkaProducer`, e.g. with
+       `iotsim.runtime.sinks.KafkaBrokerStandIn` in tests.
+       The producer blocks while it flushes a batch: use option `threads`
+       to run this destination in a thread pool.
+    """
+
+    partitioned = True
+
+    def __init__(self, topic, bootstrap_servers='localhost:9092', producer=None,
+                 **producer_config):
+        if producer is None:
+            from kafka import KafkaProducer
+            producer = KafkaProducer(bootstrap_servers=bootstrap_servers,
+                                     **producer_config)
+        self.producer = producer
+        self.topic = str(topic)
+
+    def _send(self, message):
+        key = None
+        if isinstance(message, tuple):
+            key, message = message
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if key is not None:
+            key = str(key).encode('utf-8')
+        self.producer.send(self.topic, value=message, key=key)
+
+    def send(self, message):
+        self._send(message)
+        self.producer.flush()
+
+    def send_batch(self, messages):
+        for message in messages:
+            self._send(message)
+        self.producer.flush()
+
+    def shutdown(self):
+        self.producer.flush()
+        self.producer.close()
+
+
 known_destinations = {
+    'null': (NullDestination, {}),
     'stdout': (StandardDestination, {'output': 'stdout'}),
     'stderr': (StandardDestination, {'output': 'stderr'}),
     'kinesis': (KinesisDestination, {}),
     'pubsub': (PubSubDestination, {}),
+    'http': (HttpDestination, {}),
+    'tcp': (TcpDestination, {}),
+    'udp': (UdpDestination, {}),
+    'kafka': (KafkaDestination, {}),
 }
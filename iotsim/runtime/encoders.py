@@ -0,0 +1,130 @@
+"""
+This module defines how the messages of an assembly are encoded.
+
+An encoder is created as
+``encoder_class(assembly_name, signal_names, utc_offset=None)``,
+where `utc_offset` is the offset of the run's start time from UTC
+for the encoders that write times as text, and must define two methods:
+- `header()` returns a list of messages to send to every destination once,
+  before any data (may be empty);
+- `encode(dataview, signal_name, value, event_ns, arrival_ns=None)` returns
+  the message for a truth (`dataview` is 'truth') or a reading ('reading').
+  Times are nanoseconds since the epoch; `arrival_ns` is given for readings only.
+
+`known_encoders` maps the values of the runner's `message_format` option
+to encoder classes.
+"""
+
+import json
+import math
+import struct
+
+from .clock import IsoFormatter
+
+
+class JsonEncoder:
+    """JSON objects with keys meta, signal, value, event_time and arrival_time.
+
+       The output is the same as of `json.dumps` of a dictionary, but the part
+       of the message before the value is prepared once per signal.
+       Times are formatted by `IsoFormatter` with `utc_offset`.
+    """
+
+    def __init__(self, assembly_name, signal_names=None, utc_offset=None):
+        self.assembly_name = assembly_name
+        self._format_time = IsoFormatter(utc_offset)
+        self._prefixes = dict()
+
+    def header(self):
+        return []
+
+    def _prefix(self, dataview, signal_name):
+        prefix = '{{"meta": {}, "signal": {}, "value": '.format(
+            json.dumps("{}:{}".format(self.assembly_name, dataview)),
+            json.dumps(signal_name))
+        self._prefixes[dataview, signal_name] = prefix
+        return prefix
+
+    def encode(self, dataview, signal_name, value, event_ns, arrival_ns=None):
+        try:
+            prefix = self._prefixes[dataview, signal_name]
+        except KeyError:
+            prefix = self._prefix(dataview, signal_name)
+        if type(value) is float and math.isfinite(value):
+            value = float.__repr__(value)
+        elif type(value) is int:
+            value = int.__repr__(value)
+        else:
+            value = json.dumps(value)
+        if arrival_ns is None:
+            return '{}{}, "event_time": "{}"}}'.format(
+                prefix, value, self._format_time(event_ns))
+        return '{}{}, "event_time": "{}", "arrival_time": "{}"}}'.format(
+            prefix, value, self._format_time(event_ns), self._format_time(arrival_ns))
+
+
+class MsgPackEncoder:
+    """MessagePack maps with the same keys as of JSON messages;
+       times are integer nanoseconds since the epoch.
+
+       Requires `msgpack`.
+    """
+
+    def __init__(self, assembly_name, signal_names=None, utc_offset=None):
+        import msgpack
+        self._packer = msgpack.Packer()
+        self.assembly_name = assembly_name
+        self._meta = dict()
+
+    def header(self):
+        return []
+
+    def encode(self, dataview, signal_name, value, event_ns, arrival_ns=None):
+        try:
+            meta = self._meta[dataview]
+        except KeyError:
+            meta = self._meta[dataview] = "{}:{}".format(self.assembly_name, dataview)
+        message_data = {'meta': meta, 'signal': signal_name, 'value': value,
+                        'event_time': event_ns}
+        if arrival_ns is not None:
+            message_data['arrival_time'] = arrival_ns
+        return self._packer.pack(message_data)
+
+
+class StructEncoder:
+    """Packed little-endian binary records.
+
+       The header is a dictionary message: b'D' followed by JSON
+       ``{"assembly": name, "signals": [names]}``; signals are referred to
+       by their index in this list.
+       A truth is b'T', signal index (uint16), value (float64), event time (int64);
+       a reading is b'R', the same fields and arrival time (int64).
+       Times are nanoseconds since the epoch.
+    """
+
+    truth_record = struct.Struct('<cHdq')
+    reading_record = struct.Struct('<cHdqq')
+
+    def __init__(self, assembly_name, signal_names, utc_offset=None):
+        self.assembly_name = assembly_name
+        self.signal_names = list(signal_names)
+        if len(self.signal_names) > 0xFFFF:
+            raise ValueError("Too many signals to encode: {}".format(len(self.signal_names)))
+        self._signal_codes = {name: code for code, name in enumerate(self.signal_names)}
+
+    def header(self):
+        dictionary = {'assembly': self.assembly_name, 'signals': self.signal_names}
+        return [b'D' + json.dumps(dictionary).encode('utf-8')]
+
+    def encode(self, dataview, signal_name, value, event_ns, arrival_ns=None):
+        signal_code = self._signal_codes[signal_name]
+        if arrival_ns is None:
+            return self.truth_record.pack(b'T', signal_code, value, event_ns)
+        return self.reading_record.pack(b'R', signal_code, value, event_ns, arrival_ns)
+
+
+known_encoders = {
+    'json': JsonEncoder,
+    'msgpack': MsgPackEncoder,
+    'struct': StructEncoder,
+}
@@ -0,0 +1,174 @@
+"""
+This module writes the data of an assembly run to columnar files.
+
+The run is stepped in batches (see `Assembly.launch(batch=...)`) and every
+batch is appended to the files as it is produced, so the memory used does not
+depend on the length of the run.
+
+There are two tables:
+- truths: `signal`, `event_tick`, `event_time`, `value`
+- readings: `signal`, `event_tick`, `event_time`, `value`, `arrived`,
+  `arrival_delay`; only the ticks where a reading was done are included.
+
+`event_time` is `event_tick` times the tick of the assembly in seconds,
+or a timestamp if `start_time` (the time of tick 0) is given.
+
+A run split into parts (see `iotsim.backfill`) writes every part to its own
+files `truths-<part>.<ext>` and `readings-<part>.<ext>`; read in the order
+of their names, the files make one table ordered by tick.
+
+Writing the files requires `pyarrow`.
+"""
+
+import os
+
+import numpy as np
+
+
+TABLES = ('truths', 'readings')
+
+
+def batch_columns(batch, tick, start_time=None):
+    """Return dict {table_name: dict {column_name: numpy array}} for an `AssemblyBatch`.
+
+       Rows are ordered by tick, then by signal.
+    """
+    n_signals = len(batch.signals)
+    signal_codes = np.tile(np.arange(n_signals, dtype=np.int32), batch.n_ticks)
+    event_tick = np.repeat(np.arange(batch.first_tick, batch.first_tick + batch.n_ticks,
+                                     dtype=np.int64), n_signals)
+    event_time = event_tick * float(tick)
+    if start_time is not None:
+        event_time = (np.datetime64(start_time, 'ns')
+                      + np.round(event_time * 1e9).astype('timedelta64[ns]'))
+
+    truths = dict(signal=signal_codes, event_tick=event_tick, event_time=event_time,
+                  value=batch.truths.ravel())
+    readings = batch.readings.ravel()
+    done = ~np.isnan(readings)
+    readings = dict(signal=signal_codes[done], event_tick=event_tick[done],
+                    event_time=event_time[done], value=readings[done],
+                    arrived=batch.arrived.ravel()[done],
+                    arrival_delay=batch.arrival_delays.ravel()[done])
+    return dict(truths=truths, readings=readings)
+
+
+class _TableWriter:
+    """Appends batches of columns to a Parquet or Arrow IPC file."""
+
+    def __init__(self, filename, file_format, signal_names, compression):
+        import pyarrow as pa
+        self._pa = pa
+        self._signal_names = pa.array(signal_names, type=pa.string())
+        self._filename = filename
+        self._file_format = file_format
+        self._compression = compression
+        self._writer = None
+
+    def _table(self, columns):
+        pa = self._pa
+        arrays = dict(columns)
+        arrays['signal'] = pa.DictionaryArray.from_arrays(
+            pa.array(columns['signal'], type=pa.int32()), self._signal_names)
+        return pa.table(arrays)
+
+    def write(self, columns):
+        table = self._table(columns)
+        if self._writer is None:
+            if self._file_format == 'parquet':
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self._filename, table.schema,
+                                                compression=self._compression)
+            else:
+                import pyarrow.ipc as ipc
+                options = ipc.IpcWriteOptions(compression=self._compression)
+                self._writer = ipc.new_file(self._filename, table.schema,
+                                            options=options)
+        # every batch is a row group of Parquet file or a record batch of Arrow file
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class ColumnarExporter:
+    """Writes the run of an assembly to files `truths.<ext>` and `readings.<ext>`
+       in `directory`.
+
+       `file_format` is 'parquet' (a row group per batch) or 'arrow'
+       (Arrow IPC file, a record batch per batch).
+       `compression` is passed to pyarrow; None means no compression.
+    """
+
+    extensions = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+    def __init__(self, directory, file_format='parquet', compression='zstd',
+                 batch=100000, start_time=None):
+        if file_format not in self.extensions:
+            raise ValueError("Unrecognized file format {!r}. Use one of {}".
+                             format(file_format, list(self.extensions)))
+        batch = int(batch)
+        if batch <= 0:
+            raise ValueError("Batch size must be positive. Got {}".format(batch))
+        self.directory = str(directory)
+        self.file_format = file_format
+        self.compression = compression
+        self.batch = batch
+        self.start_time = start_time
+
+    def filename(self, table_name, part=None):
+        if part is None:
+            return os.path.join(self.directory, '{}.{}'.format(
+                table_name, self.extensions[self.file_format]))
+        return os.path.join(self.directory, '{}-{:05d}.{}'.format(
+            table_name, part, self.extensions[self.file_format]))
+
+    def columns(self, assembly, ticks, first_tick=0):
+        """Run `assembly` for `ticks` ticks and yield the columns of every batch
+           (see `batch_columns`); the ticks are numbered from `first_tick`."""
+        ticks = int(ticks)
+        if ticks <= 0:
+            raise ValueError("Number of ticks must be positive. Got {}".format(ticks))
+        return self._columns(assembly, ticks, first_tick)
+
+    def _columns(self, assembly, ticks, first_tick):
+        runner = assembly.launch(batch=min(self.batch, ticks))
+        try:
+            batch = next(runner)
+            while True:
+                if first_tick:
+                    batch = batch._replace(first_tick=batch.first_tick + first_tick)
+                yield batch_columns(batch, assembly.tick, self.start_time)
+                ticks -= batch.n_ticks
+                if ticks == 0:
+                    break
+                batch = runner.send(min(self.batch, ticks))
+        finally:
+            runner.close()
+
+    def export(self, assembly, ticks, first_tick=0, part=None):
+        """Run `assembly` for `ticks` ticks and write its data.
+
+           The ticks are numbered from `first_tick`. If `part` is given,
+           the data goes to the files of this part of the run.
+           Returns dict {table_name: number of rows written}.
+        """
+        batches = self.columns(assembly, ticks, first_tick=first_tick)
+        os.makedirs(self.directory, exist_ok=True)
+        signal_names = [signal.name for signal in assembly.signals]
+        writers = {table_name: _TableWriter(self.filename(table_name, part),
+                                            self.file_format, signal_names,
+                                            self.compression)
+                   for table_name in TABLES}
+        rows = dict.fromkeys(TABLES, 0)
+        try:
+            for columns in batches:
+                for table_name in TABLES:
+                    writers[table_name].write(columns[table_name])
+                    rows[table_name] += len(columns[table_name]['value'])
+        finally:
+            batches.close()
+            for writer in writers.values():
+                writer.close()
+        return rows
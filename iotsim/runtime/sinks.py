@@ -0,0 +1,217 @@
+"""
+This module defines local servers that receive the messages of an assembly.
+
+They stand in for the ingest services in tests and benchmarks of destinations,
+so that no cloud account is needed. Every sink counts the messages and bytes
+it received and runs in the current event loop:
+
+    sink = HttpSink()
+    await sink.start()
+    ... send to sink.url ...
+    await sink.close()
+
+`KafkaBrokerStandIn` replaces the Kafka producer of `KafkaDestination`
+and partitions the records the same way as Kafka does.
+"""
+
+import asyncio
+
+
+class HttpSink:
+    """HTTP/1.1 server that accepts POSTed batches of newline-separated messages.
+
+       Answers every request with `status` (204 by default).
+       Keeps the bodies of the requests in `bodies` if `keep` is True.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, status=204, keep=False):
+        self.host = host
+        self.port = port
+        self.status = status
+        self.keep = keep
+        self.bodies = []
+        self.requests = 0
+        self.messages = 0
+        self.bytes = 0
+        self.connections = 0
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                content_length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'content-length':
+                        content_length = int(value)
+                body = await reader.readexactly(content_length)
+                self.requests += 1
+                if 200 <= self.status < 300:
+                    self.messages += body.count(b'\n')
+                    self.bytes += len(body)
+                    if self.keep:
+                        self.bodies.append(body)
+                writer.write('HTTP/1.1 {} Status\r\nContent-Length: 0\r\n\r\n'.
+                             format(self.status).encode('ascii'))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class TcpSink:
+    """TCP server that receives newline-separated messages."""
+
+    def __init__(self, host='127.0.0.1', port=0, keep=False):
+        self.host = host
+        self.port = port
+        self.keep = keep
+        self.data = []
+        self.messages = 0
+        self.bytes = 0
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.messages += data.count(b'\n')
+                self.bytes += len(data)
+                if self.keep:
+                    self.data.append(data)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class UdpSink(asyncio.DatagramProtocol):
+    """UDP endpoint that receives datagrams of newline-separated messages."""
+
+    def __init__(self, host='127.0.0.1', port=0, keep=False):
+        self.host = host
+        self.port = port
+        self.keep = keep
+        self.datagrams = []
+        self.messages = 0
+        self.bytes = 0
+        self._transport = None
+
+    async def start(self):
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: self, local_addr=(self.host, self.port))
+        self.port = self._transport.get_extra_info('sockname')[1]
+        return self
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def datagram_received(self, data, addr):
+        self.messages += data.count(b'\n')
+        self.bytes += len(data)
+        if self.keep:
+            self.datagrams.append(data)
+
+
+def murmur2(data):
+    """32-bit murmur2 hash of bytes, as computed by Kafka's default partitioner."""
+    length = len(data)
+    m = 0x5bd1e995
+    h = (0x9747b28c ^ length) & 0xffffffff
+    for i in range(0, length - length % 4, 4):
+        k = int.from_bytes(data[i:i + 4], 'little')
+        k = (k * m) & 0xffffffff
+        k ^= k >> 24
+        k = (k * m) & 0xffffffff
+        h = (h * m) & 0xffffffff
+        h ^= k
+    tail = length - length % 4
+    extra = length % 4
+    if extra >= 3:
+        h ^= data[tail + 2] << 16
+    if extra >= 2:
+        h ^= data[tail + 1] << 8
+    if extra >= 1:
+        h ^= data[tail]
+        h = (h * m) & 0xffffffff
+    h ^= h >> 13
+    h = (h * m) & 0xffffffff
+    h ^= h >> 15
+    return h
+
+
+class KafkaBrokerStandIn:
+    """In-process stand-in for a Kafka cluster with the producer's interface
+       (`send`, `flush`, `close`) used by `KafkaDestination`.
+
+       Every topic has `partitions` partitions; a record with a key goes
+       to the partition chosen by Kafka's default partitioner, a record
+       without a key - to the partitions in turn.
+       Records are kept in `topics[topic][partition]` as tuples (key, value).
+    """
+
+    def __init__(self, partitions=4):
+        self.partitions = int(partitions)
+        self.topics = dict()
+        self.flushes = 0
+        self.closed = False
+        self._next_partition = 0
+
+    def partition(self, key):
+        if key is None:
+            partition = self._next_partition
+            self._next_partition = (partition + 1) % self.partitions
+            return partition
+        return (murmur2(key) & 0x7fffffff) % self.partitions
+
+    def send(self, topic, value=None, key=None):
+        if self.closed:
+            raise RuntimeError("Producer is closed")
+        partitions = self.topics.setdefault(topic, [[] for _ in range(self.partitions)])
+        partitions[self.partition(key)].append((key, value))
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,494 @@
+import pytest
+import numpy as np
+from iotsim.constructors import Flatline, Seesaw, Pulser, SimpleActuator
+from iotsim.core import Assembly, AssemblyContext
+from iotsim.behaviors import FlatlineBehavior
+from iotsim.readers import EveryNthReader, OnChangeReader, PassthroughReader
+from iotsim.networks import NormalNetwork, IdealNetwork
+from iotsim.utils import equal_arrays
+
+
+def snapshot_truths(assembly, n):
+    runner = assembly.launch()
+    return np.array([[snapshot.signal(name).truth.value
+                      for name in [signal.name for signal in assembly.signals]]
+                     for _, snapshot in zip(range(n), runner)])
+
+
+class TestAssemblyBatch:
+
+    def test_batch_matches_snapshots_seesaw(self):
+        n = 50
+        expected = snapshot_truths(Seesaw()(), n)
+        batch = Seesaw()().run_batch(n)
+        assert batch.signals == ('seesaw',)
+        assert batch.truths.shape == (n, 1)
+        assert equal_arrays(batch.truths, expected)
+        assert equal_arrays(batch.readings, expected)
+        assert batch.arrived.all()
+        assert (batch.arrival_delays == 0).all()
+
+    def test_batch_matches_snapshots_actuator(self):
+        n = 60
+        constructor = SimpleActuator(control_off_duration=3, control_on_duration=2,
+                                     sensor_reaction_delay=1)
+        expected = snapshot_truths(constructor(), n)
+        batch = constructor().run_batch(n)
+        assert batch.signals == ('control', 'sensor')
+        assert equal_arrays(batch.truths, expected)
+
+    def test_batches_continue(self):
+        n = 7
+        expected = snapshot_truths(Seesaw()(), 3 * n)
+        runner = Seesaw()().launch(batch=n)
+        batches = [next(runner) for _ in range(3)]
+        assert [b.first_tick for b in batches] == [0, n, 2 * n]
+        assert equal_arrays(np.vstack([b.truths for b in batches]), expected)
+
+    def test_batch_readings(self):
+        constructor = Seesaw()
+        constructor.attach_reader(EveryNthReader(step=3))
+        batch = constructor().run_batch(10)
+        sig = batch.signal('seesaw')
+        assert batch.n_ticks == 10
+        assert equal_arrays(np.isnan(sig.readings),
+                            [i % 3 != 0 for i in range(10)])
+        with pytest.raises(ValueError):
+            batch.signal('nosuchsignal')
+
+    def test_batch_chunks_without_controls(self):
+        constructor = Flatline(level=4)
+        constructor.attach_reader(EveryNthReader(step=4))
+        assembly = constructor()
+        runner = assembly.launch(batch=10)
+        batch = next(runner)
+        batch = next(runner)
+        assert (batch.truths == 4).all()
+        assert equal_arrays(np.isnan(batch.readings[:, 0]),
+                            [(10 + i) % 4 != 0 for i in range(10)])
+        assert assembly.assembly_context.query('f', 0) == 4
+
+    def test_batch_size(self):
+        assembly = Seesaw()()
+        for size in [0, -1]:
+            with pytest.raises(ValueError):
+                assembly.run_batch(size)
+
+
+class TestAssemblyContext:
+
+    def test_parameter_versions(self):
+        context = AssemblyContext(['a', 'b'])
+        assert context.version == 0
+        context.set_parameter('a', 'p', 1)
+        context.set_parameter('a', 'p', 2)
+        context.set_parameter('b', 'p', 1)
+        assert context.version == 3
+        assert context.parameters_version('a') == 2
+        assert context.parameters_version('b') == 1
+        with pytest.raises(KeyError):
+            context.parameters_version('c')
+
+    def test_resync_only_after_write(self):
+        context = AssemblyContext(['b', 'other'])
+        bhv = FlatlineBehavior('b', level=1)
+        bhv.update_parameters(context)
+        assert bhv._parameters['level'] == 1
+        bhv._parameters['level'] = 'stale'
+        context.set_parameter('other', 'level', 2)
+        bhv.update_parameters(context)
+        assert bhv._parameters['level'] == 'stale'
+        context.set_parameter('b', 'level', 3)
+        bhv.update_parameters(context)
+        assert bhv._parameters['level'] == 3
+        bhv.update_parameters(None)
+        assert bhv._parameters['level'] == 1
+
+    def test_history(self):
+        context = AssemblyContext(['f'], history_depth=3)
+        assert context.query('f', 0) is None
+        for value in range(5):
+            context.record('f', value)
+        assert [context.query('f', lag) for lag in range(4)] == [4, 3, 2, None]
+        window = context.history_window('f', 2)
+        assert window.tolist() == [4, 3]
+        with pytest.raises(ValueError):
+            window[0] = 0
+        context.record_many('f', np.arange(10, 14))
+        assert context.history_window('f').tolist() == [13, 12, 11]
+        context.record_many('f', [20])
+        assert [context.query('f', lag) for lag in range(3)] == [20, 13, 12]
+
+    def test_history_non_numeric(self):
+        context = AssemblyContext(['f'], history_depth=2)
+        context.record('f', 1)
+        context.record('f', 'text')
+        assert context.query('f', 0) == 'text'
+        assert context.query('f', 1) == 1
+        context.record_many('f', ['a', 'b'])
+        assert [context.query('f', lag) for lag in range(2)] == ['b', 'a']
+        context = AssemblyContext(['f'], history_depth=3)
+        context.record_many('f', [True, 2])
+        assert context.query('f', 1) is True
+
+    def test_history_types(self):
+        context = AssemblyContext(['f'], history_depth=3)
+        context.record('f', 1)
+        context.record_many('f', np.arange(2, 4))
+        assert [type(context.query('f', lag)) for lag in range(3)] == [int] * 3
+        context.record('f', 0.5)
+        assert [context.query('f', lag) for lag in range(3)] == [0.5, 3, 2]
+        assert type(context.query('f', 1)) is float
+        context.record_many('f', [4, 2 ** 70])
+        assert context.query('f', 0) == 2 ** 70
+
+    def test_history_handle(self):
+        context = AssemblyContext(['f'], history_depth=1000)
+        history = context.history_handle('f')
+        for value in range(2500):
+            history.record(value)
+        assert len(history) == 1000
+        assert context.query('f', 999) == 1500
+        assert history.window(5).tolist() == [2499, 2498, 2497, 2496, 2495]
+
+    def test_handles(self):
+        context = AssemblyContext(['a', 'b', 123])
+        assert context.names == ('a', 'b', '123')
+        assert [context.slot(name) for name in ['a', 'b', 123]] == [0, 1, 2]
+        handle = context.handle('b')
+        assert context.slot_handle(1) is handle
+        handle.set_parameter('p', 1)
+        assert context.get_parameter('b', 'p') == 1
+        assert context.version == 1
+        handle.reset_counter('n')
+        context.increment_counter('b', 'n', 2)
+        assert handle.read_counter('n') == 2
+        handle.record(5)
+        assert context.query('b', 0) == 5
+        with pytest.raises(KeyError):
+            context.handle('c')
+
+    def test_random_streams(self):
+        context = AssemblyContext(['a'], seed=1)
+        stream = context.random_stream('x')
+        assert context.random_stream('x') is stream
+        values = [stream.random() for _ in range(3)]
+        other = AssemblyContext(['a'], seed=1)
+        assert [other.random_stream('x').random() for _ in range(3)] == values
+        assert [other.random_stream('y').random() for _ in range(3)] != values
+
+
+class TestAssemblySeed:
+
+    def make_assembly(self, seed):
+        constructor = SimpleActuator(control_off_duration=[2, 4, 6], seed=seed)
+        constructor.attach_reader(EveryNthReader(step=2, noise=0.3))
+        constructor.attach_network(NormalNetwork(delay=2, jitter=0.5, drop_rate=0.2))
+        return constructor()
+
+    def test_reproducible_runs(self):
+        batch1 = self.make_assembly(seed=5).run_batch(200)
+        batch2 = self.make_assembly(seed=5).run_batch(200)
+        batch3 = self.make_assembly(seed=6).run_batch(200)
+        for field in ['truths', 'readings', 'arrived', 'arrival_delays']:
+            assert equal_arrays(getattr(batch1, field), getattr(batch2, field))
+        assert not equal_arrays(batch1.arrival_delays, batch3.arrival_delays)
+
+
+class TestAssemblySnapshot:
+
+    def make_snapshot(self):
+        constructor = SimpleActuator(sensor_reaction_delay=1, seed=3)
+        constructor.attach_reader(EveryNthReader(step=2))
+        constructor.attach_network(NormalNetwork(delay=2, jitter=0.5, drop_rate=0.5))
+        runner = constructor().launch()
+        next(runner)
+        return next(runner)
+
+    def test_views(self):
+        snapshot = self.make_snapshot()
+        assert [truth.signal_name for truth in snapshot.truths] == ['control', 'sensor']
+        assert [reading.signal_name for reading in snapshot.all_readings] == \
+            ['control', 'sensor']
+        assert snapshot.readings == [reading for reading in snapshot.all_readings
+                                     if reading.arrived]
+        assert snapshot.truths is snapshot.truths
+        sensor = snapshot.signal('sensor')
+        assert sensor.truth == snapshot.truths[1]
+        assert sensor.reading == snapshot.all_readings[1]
+        with pytest.raises(ValueError):
+            snapshot.signal('nosuchsignal')
+        with pytest.raises(AttributeError):
+            snapshot.extra = 1
+
+    def test_repr(self):
+        lines = repr(self.make_snapshot()).splitlines()
+        assert len(lines) == 4
+        assert [line.split()[0] for line in lines[2:]] == ['control', 'sensor']
+
+
+class TestNextEvent:
+
+    @pytest.mark.parametrize('make_constructor', [
+        lambda: Seesaw(),
+        lambda: Pulser(duration1=7, duration2=30),
+        lambda: SimpleActuator(),
+        lambda: SimpleActuator(control_off_duration=20, control_on_duration=9,
+                               sensor_reaction_delay=3),
+    ])
+    def test_same_truths(self, make_constructor):
+        for n in [1, 5, 300]:
+            expected = make_constructor()().run_batch(n)
+            batch = make_constructor()().run_batch(n, next_event=True)
+            assert equal_arrays(batch.truths, expected.truths)
+        runner = make_constructor()().launch(batch=13)
+        next_event_runner = make_constructor()().launch(batch=13, next_event=True)
+        for _ in range(10):
+            assert equal_arrays(next(next_event_runner).truths, next(runner).truths)
+
+    @pytest.mark.parametrize('durations', [[2, 4, 6], [1, 4, 7]])
+    def test_duration_choice(self, durations):
+        # with the shortest duration of 1, the counter is reset to the count
+        # at which the threshold was drawn
+        batch = Pulser(duration1=durations, duration2=1, seed=1)().run_batch(
+            30000, next_event=True)
+        values = batch.truths[:, 0]
+        starts = np.flatnonzero(np.diff(values) != 0) + 1
+        durations_run = np.diff(starts)[values[starts[:-1]] == 0]
+        choices, counts = np.unique(durations_run, return_counts=True)
+        assert list(choices) == durations
+        # the k-th duration is chosen with the probability k/3 if it is reached
+        assert np.allclose(counts / counts.sum(), [1 / 3, 4 / 9, 2 / 9], atol=0.03)
+
+    def test_batches_only(self):
+        with pytest.raises(ValueError):
+            Pulser()().launch(next_event=True)
+
+
+class TestAdvance:
+
+    @pytest.mark.parametrize('make_constructor', [
+        lambda: Seesaw(),
+        lambda: SimpleActuator(sensor_reaction_delay=2),
+        lambda: SimpleActuator(control_off_duration=200, control_on_duration=50,
+                               sensor_rise_rate=0.1, sensor_fall_rate=0.1),
+    ])
+    @pytest.mark.parametrize('n', [0, 1, 7, 1000])
+    def test_go_on_after_advance(self, make_constructor, n):
+        expected = make_constructor()().run_batch(n + 20).truths[n:]
+        assembly = make_constructor()()
+        assembly.advance(n)
+        assert equal_arrays(snapshot_truths(assembly, 20), expected)
+        assembly = make_constructor()()
+        assembly.advance(n // 2)
+        assembly.advance(n - n // 2)
+        assert equal_arrays(assembly.run_batch(20).truths, expected)
+
+    def test_history(self):
+        constructor = Seesaw(history_depth=3)
+        assembly = constructor()
+        assembly.advance(1000)
+        expected = Seesaw(history_depth=3)().run_batch(1000).truths[-3:, 0]
+        history = assembly.assembly_context.handle('f').history
+        assert equal_arrays(history.window()[::-1], expected)
+
+    def test_negative(self):
+        with pytest.raises(ValueError):
+            Seesaw()().advance(-1)
+
+
+def noisy_actuator(reader=EveryNthReader, **parameters):
+    constructor = SimpleActuator(seed=2, history_depth=4, **parameters)
+    constructor.attach_reader(reader(step=3, noise=0.3))
+    constructor.attach_network(NormalNetwork(delay=2, jitter=0.5, drop_rate=0.2))
+    return constructor()
+
+
+def snapshot_values(runner, n):
+    return [[(s.truth.value, s.reading.value, s.reading.arrived, s.reading.arrival_delay)
+             for s in (snapshot.signal('control'), snapshot.signal('sensor'))]
+            for _, snapshot in zip(range(n), runner)]
+
+
+class TestCheckpoint:
+
+    @pytest.mark.parametrize('reader', [EveryNthReader, OnChangeReader])
+    @pytest.mark.parametrize('n', [0, 1, 37])
+    def test_resume_snapshots(self, reader, n):
+        expected = snapshot_values(noisy_actuator(reader).launch(), n + 50)
+        assembly = noisy_actuator(reader)
+        first = snapshot_values(assembly.launch(), n)
+        blob = assembly.checkpoint(info=dict(tick=n))
+        restored = noisy_actuator(reader)
+        assert restored.restore(blob) == dict(tick=n)
+        assert first + snapshot_values(restored.launch(), 50) == expected
+
+    def test_resume_batches(self):
+        expected = noisy_actuator(control_off_duration=[2, 6]).run_batch(100)
+        assembly = noisy_actuator(control_off_duration=[2, 6])
+        next(assembly.launch(batch=30))
+        restored = noisy_actuator(control_off_duration=[2, 6])
+        restored.restore(assembly.checkpoint())
+        batch = restored.run_batch(70)
+        for field in ['truths', 'readings', 'arrived', 'arrival_delays']:
+            assert equal_arrays(getattr(batch, field), getattr(expected, field)[30:])
+
+    def test_resume_advance(self):
+        expected = snapshot_truths(Seesaw(history_depth=3)(), 120)[100:]
+        assembly = Seesaw(history_depth=3)()
+        assembly.advance(60)
+        restored = Seesaw(history_depth=3)()
+        restored.restore(assembly.checkpoint())
+        restored.advance(40)
+        assert equal_arrays(snapshot_truths(restored, 20), expected)
+
+    @pytest.mark.parametrize('n', [1, 4, 9, 23, 50])
+    def test_resume_advance_random_thresholds(self, n):
+        # the thresholds drawn by the next-event engine are saved
+        constructor = SimpleActuator(control_off_duration=[3, 6, 10],
+                                     control_on_duration=[2, 5], seed=11)
+        assembly = constructor()
+        assembly.advance(n)
+        blob = assembly.checkpoint()
+        expected = assembly.run_batch(60).truths
+        restored = constructor()
+        restored.restore(blob)
+        assert equal_arrays(restored.run_batch(60).truths, expected)
+        restored = constructor()
+        restored.restore(blob)
+        assert equal_arrays(restored.run_batch(60, next_event=True).truths, expected)
+
+    def test_context(self):
+        assembly = noisy_actuator()
+        snapshot_values(assembly.launch(), 25)
+        restored = noisy_actuator()
+        restored.restore(assembly.checkpoint())
+        for name in assembly.assembly_context.names:
+            handle = assembly.assembly_context.handle(name)
+            restored_handle = restored.assembly_context.handle(name)
+            assert restored_handle.parameters == handle.parameters
+            assert restored_handle.counters == handle.counters
+            assert equal_arrays(restored_handle.history.window(), handle.history.window())
+
+    def test_compact(self):
+        assembly = noisy_actuator()
+        snapshot_values(assembly.launch(), 25)
+        assert len(assembly.checkpoint()) < 4096
+
+    def test_errors(self):
+        blob = Seesaw()().checkpoint()
+        with pytest.raises(ValueError):
+            Flatline()().restore(blob)
+        with pytest.raises(ValueError):
+            Seesaw()().restore(b'not a checkpoint')
+
+
+def follower(name, leader, reader=None):
+    """Signal that copies the level of feature `leader` when it goes above 5."""
+    from iotsim import core, behaviors, controls, triggers
+    feature = core.Feature('f.' + name, [behaviors.LinearBehavior('b.' + name, bias=0,
+                                                                  increment=1)],
+                           controls=[controls.UpdateParametersControl(
+                               '', 'b.' + name, 'on_yield',
+                               triggers.HistoryOutOfRangeTrigger('', leader, 0, 0, 5),
+                               update_choices=[[('b.' + name, 'bias',
+                                                 controls.CopyFromHistory(leader, 0))]])])
+    return core.Signal(name, feature, reader or PassthroughReader(''), IdealNetwork(''))
+
+
+def switcher(name, leader, low, high, first, second):
+    """Signal that switches from behavior `first` to `second` when the level
+       of feature `leader` reaches `high`, and back when it reaches `low`."""
+    from iotsim import core, controls, triggers
+
+    def control(behavior, condition, to):
+        return controls.UpdateParametersControl(
+            '', behavior.name, 'on_yield',
+            triggers.HistoryConditionTrigger('', leader, 0, condition),
+            update_choices=[[('f.' + name, 'running_behavior', to.name),
+                             (to.name, 'bias', controls.CopyFromHistory('f.' + name, 0))]])
+
+    feature = core.Feature('f.' + name, [first, second],
+                           controls=[control(first, lambda x: x >= high, second),
+                                     control(second, lambda x: x <= low, first)])
+    return core.Signal(name, feature, PassthroughReader(''), IdealNetwork(''))
+
+
+class TestDependencyGraph:
+
+    def test_simple_actuator(self):
+        graph = SimpleActuator()().dependency_graph
+        assert graph.order == ('control', 'sensor')
+        assert graph.sources('sensor') == {'control'}
+        assert graph.sources('control') == set()
+        assert graph.cycles == [] and graph.unknown == []
+        assert graph.groups == [['control', 'sensor']]
+        edge, = graph.edges
+        assert (edge.data.kind, edge.data.component, edge.same_tick) == \
+            ('history', 'f.control', True)
+        lagged, = SimpleActuator(sensor_reaction_delay=2)().dependency_graph.edges
+        assert not lagged.same_tick
+
+    def test_order_of_evaluation(self):
+        constructor = SimpleActuator(control_off_duration=3, control_on_duration=2)
+        expected = snapshot_truths(constructor(), 30)
+        signals = constructor().signals
+        assembly = Assembly(signals[::-1], name='reversed')
+        assert assembly.dependency_graph.order == ('control', 'sensor')
+        assert equal_arrays(snapshot_truths(assembly, 30), expected[:, ::-1])
+        assembly = Assembly(constructor().signals[::-1], name='reversed')
+        assert equal_arrays(assembly.run_batch(30).truths, expected[:, ::-1])
+
+    def test_next_event_in_order_of_evaluation(self):
+        from iotsim.behaviors import LinearBehavior
+
+        def ramps(name):
+            return (LinearBehavior('b.{}.up'.format(name), bias=0, increment=1),
+                    LinearBehavior('b.{}.down'.format(name), bias=0, increment=-1))
+
+        # `g` reads the value of `f0` in the same tick but comes first
+        signals = lambda: [switcher('g', 'f.f0', 2, 4, *ramps('g')),
+                           switcher('f0', 'f.f0', 0, 6, *ramps('f0'))]
+        assert Assembly(signals()).dependency_graph.order == ('f0', 'g')
+        expected = Assembly(signals()).run_batch(60).truths
+        batch = Assembly(signals()).run_batch(60, next_event=True)
+        assert equal_arrays(batch.truths, expected)
+
+    def test_cycles(self):
+        signals = [follower('a', 'f.b'), follower('b', 'f.a'), follower('c', 'f.b'),
+                   follower('d', 'f.d')]
+        graph = Assembly(signals).dependency_graph
+        assert graph.cycles == [['a', 'b']]
+        assert graph.order == ('a', 'b', 'c', 'd')
+        assert graph.groups == [['a', 'b', 'c'], ['d']]
+
+    def test_groups_and_subassemblies(self):
+        signals = [follower('a', 'f.c'), follower('b', 'f.b'), follower('c', 'f.b')]
+        assembly = Assembly(signals, seed=4)
+        graph = assembly.dependency_graph
+        assert graph.order == ('b', 'c', 'a')
+        assert graph.groups == [['b', 'c', 'a']]
+        signals = [follower(name, 'f.' + name, EveryNthReader('', step=2, noise=0.5))
+                   for name in ['a', 'b']]
+        assembly = Assembly(signals, seed=4)
+        assert assembly.dependency_graph.groups == [['a'], ['b']]
+        expected = assembly.run_batch(20)
+        batch = assembly.subassembly(['b']).run_batch(20)
+        assert batch.signals == ('b',)
+        assert equal_arrays(batch.truths[:, 0], expected.truths[:, 1])
+        assert equal_arrays(batch.readings[:, 0], expected.readings[:, 1])
+        with pytest.raises(ValueError):
+            assembly.subassembly(['x'])
+        with pytest.raises(ValueError):
+            Assembly([follower('a', 'f.b'), follower('b', 'f.b')]).subassembly(['a'])
+
+    def test_unknown(self):
+        from iotsim import core, behaviors, triggers
+        control = core.Control('', 'b.x', 'on_yield', triggers.Always(),
+                               action=lambda assembly_context: None, action_parameters={})
+        feature = core.Feature('f.x', [behaviors.FlatlineBehavior('b.x')], controls=[control])
+        signals = [core.Signal('x', feature, PassthroughReader(''), IdealNetwork('')),
+                   follower('y', 'f.y')]
+        graph = Assembly(signals).dependency_graph
+        assert graph.unknown == ['x']
+        assert graph.groups == [['x', 'y']]
@@ -0,0 +1,94 @@
+import copy
+import pytest
+import numpy as np
+from iotsim.assembler import from_config
+from iotsim.backfill import Backfill
+from iotsim.runtime.exporters import ColumnarExporter
+
+CONFIG = dict(
+    readers=[dict(type='EveryNth', label='noisy',
+                  parameters=dict(step=2, noise=0.3, noise_type='absolute'))],
+    networks=[dict(type='Normal', label='normal',
+                   parameters=dict(delay=2, jitter=0.3, drop_rate=0.1))],
+    assembly=dict(type='SimpleActuator',
+                  parameters=dict(control_off_duration=5, seed=3),
+                  readers=dict(default='noisy'),
+                  networks=dict(default='normal')),
+)
+
+# thresholds of the control switches drawn at random
+RANDOM_CONFIG = copy.deepcopy(CONFIG)
+RANDOM_CONFIG['assembly']['parameters'] = dict(control_off_duration=[3, 6, 10],
+                                               control_on_duration=[2, 5], seed=3)
+
+
+def equal_batches(batch1, batch2):
+    return all(np.array_equal(getattr(batch1, field), getattr(batch2, field),
+                              equal_nan=True)
+               for field in ['truths', 'readings', 'arrived', 'arrival_delays'])
+
+
+class TestBackfill:
+
+    def test_slice_ranges(self):
+        backfill = Backfill(CONFIG, slices=3, processes=0)
+        assert backfill.slice_ranges(10) == [(0, 3), (3, 4), (7, 3)]
+        assert backfill.slice_ranges(1) == [(0, 0), (0, 1), (1, 0)]
+        with pytest.raises(ValueError):
+            Backfill(CONFIG, slices=0)
+        with pytest.raises(ValueError):
+            Backfill(CONFIG, processes=-1)
+
+    def test_continuous(self):
+        n = 200
+        expected = from_config(copy.deepcopy(CONFIG)).run_batch(n)
+        batches = list(Backfill(CONFIG, slices=3, processes=0).launch(n, batch=30))
+        assert [batch.first_tick for batch in batches] == [0, 67, 133]
+        batch = Backfill(CONFIG, slices=3, processes=0).run(n)
+        assert batch.signals == ('control', 'sensor')
+        assert np.array_equal(batch.truths, expected.truths)
+        # every slice draws its own readings
+        assert not np.array_equal(batch.readings, expected.readings, equal_nan=True)
+
+    @pytest.mark.parametrize('slices', [2, 3, 7])
+    @pytest.mark.parametrize('warmup', [0, 13])
+    def test_continuous_random_thresholds(self, slices, warmup):
+        n = 300
+        expected = Backfill(RANDOM_CONFIG, slices=1, processes=0, warmup=warmup).run(n)
+        batch = Backfill(RANDOM_CONFIG, slices=slices, processes=0, warmup=warmup).run(n)
+        assert np.array_equal(batch.truths, expected.truths)
+
+    def test_deterministic_across_processes(self):
+        local = Backfill(CONFIG, slices=3, processes=0).run(100)
+        assert equal_batches(Backfill(CONFIG, slices=3, processes=2).run(100), local)
+        assert not equal_batches(Backfill(CONFIG, slices=3, processes=0, seed=4).run(100),
+                                 local)
+
+    def test_independent(self):
+        backfill = Backfill(CONFIG, slices=2, processes=0, continuous=False, warmup=3)
+        batch = backfill.run(50)
+        assert batch.truths.shape == (50, 2)
+        # the features are not random, so every slice starts from the same state
+        first, second = batch.truths[:25], batch.truths[25:]
+        assert np.array_equal(first, second)
+        with pytest.raises(ValueError):
+            Backfill(CONFIG, continuous=False, start=b'')
+
+    def test_start(self):
+        assembly = from_config(copy.deepcopy(CONFIG))
+        assembly.advance(42)
+        expected = assembly.run_batch(60).truths
+        assembly = from_config(copy.deepcopy(CONFIG))
+        assembly.advance(42)
+        batch = Backfill(CONFIG, slices=2, processes=0, start=assembly.checkpoint()).run(60)
+        assert np.array_equal(batch.truths, expected)
+
+    def test_export(self, tmp_path):
+        pytest.importorskip('pyarrow')
+        import pyarrow.parquet as pq
+        exporter = ColumnarExporter(tmp_path, batch=7)
+        rows = Backfill(CONFIG, slices=2, processes=0).export(exporter, 20)
+        assert rows['truths'] == 40
+        ticks = [tick for part in [0, 1] for tick in pq.read_table(
+            exporter.filename('truths', part)).column('event_tick').to_pylist()]
+        assert ticks == sorted(ticks) and ticks[-1] == 19
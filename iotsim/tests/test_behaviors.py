@@ -117,3 +117,27 @@ class TestLinearBehavior:
         context.set_parameter('b', 'bias', 1)
         with pytest.raises(RuntimeError):
             runner = bhv.activate(assembly_context=context)
+
+
+class TestBehaviorChunks:
+
+    def test_flatline_bhv_chunk(self):
+        bhv = FlatlineBehavior('b', level=3)
+        runner = bhv.activate()
+        assert next(runner) == 3
+        chunk = runner.next_chunk(4)
+        assert chunk.tolist() == [3] * 4
+        assert next(runner) == 3
+        assert runner.position == 6
+
+    def test_linear_bhv_chunk(self):
+        bias = 10
+        increment = 1.5
+        bhv = LinearBehavior('b', bias=bias, increment=increment)
+        per_value = bhv.activate()
+        expected = [v for _, v in zip(range(7), per_value)]
+        runner = bhv.activate()
+        values = [next(runner)] + runner.next_chunk(5).tolist() + [next(runner)]
+        assert values == expected
+        assert runner.position == 7
+        assert runner.next_chunk(0).tolist() == []
@@ -0,0 +1,28 @@
+import pytest
+import pandas as pd
+from iotsim.runtime.clock import IsoFormatter, seconds_to_ns
+
+
+class TestIsoFormatter:
+
+    @pytest.mark.parametrize('timestamp', [
+        '2020-02-29 23:59:59.999999', '2020-03-01 00:00:00',
+        '2021-06-01 12:00:00.5', '2021-06-01 12:00:00.000000001', '1969-12-31 23:59:59.25'])
+    def test_same_as_pandas(self, timestamp):
+        timestamp = pd.Timestamp(timestamp)
+        assert IsoFormatter()(timestamp.value) == str(timestamp)
+
+    def test_cache(self):
+        format_time = IsoFormatter()
+        start = pd.Timestamp('2021-01-01 00:00:59').value
+        for step in [0, 250, 500, 1000, 1250, 2000]:
+            ns = start + seconds_to_ns(step / 1000)
+            assert format_time(ns) == str(pd.Timestamp(ns))
+
+    @pytest.mark.parametrize('timestamp', [
+        '2020-01-01 00:00:00+02:00', '2020-01-01 00:00:00.5-05:30',
+        '2021-06-01 12:00:00.000000001+00:00'])
+    def test_utc_offset(self, timestamp):
+        timestamp = pd.Timestamp(timestamp)
+        format_time = IsoFormatter(timestamp.utcoffset())
+        assert format_time(timestamp.value) == str(timestamp)
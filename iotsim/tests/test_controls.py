@@ -0,0 +1,55 @@
+import pytest
+from iotsim.core import AssemblyContext
+from iotsim.controls import (CopyFromParameter, CopyFromHistory, CopyFromCounter,
+                             UpdateParametersControl, IncrementCounterControl,
+                             ResetCounterControl)
+from iotsim.triggers import Always, CounterTrigger
+
+
+@pytest.fixture
+def context():
+    context = AssemblyContext(['a', 'b'], history_depth=2)
+    context.set_parameter('a', 'p', 1)
+    context.reset_counter('a', 'n')
+    context.record('a', 10)
+    context.record('a', 20)
+    return context
+
+
+class TestRetrievers:
+
+    def test_bound_retrievers(self, context):
+        retrievers = [CopyFromParameter('a', 'p'),
+                      CopyFromHistory('a', 1),
+                      CopyFromCounter('a', 'n', apply=lambda x: x + 1)]
+        for retriever in retrievers:
+            assert retriever.bind(context)() == retriever(context)
+        assert [r.bind(context)() for r in retrievers] == [1, 10, 1]
+
+
+class TestBoundControls:
+
+    def test_update_parameters(self, context):
+        ctrl = UpdateParametersControl(
+            '', 'bhv', 'on_yield', Always(),
+            update_choices=[[('b', 'p', 5), ('b', 'q', CopyFromHistory('a', 0))]])
+        ctrl.bind(context)()
+        assert context.get_parameter('b', 'p') == 5
+        assert context.get_parameter('b', 'q') == 20
+        assert type(context.get_parameter('b', 'q')) is int
+        assert context.parameters_version('b') == 2
+
+    def test_counters(self, context):
+        increment = IncrementCounterControl('', 'bhv', 'on_yield', Always(),
+                                            component='a', counter='n', increment=2)
+        reset = ResetCounterControl('', 'bhv', 'on_yield',
+                                    CounterTrigger('', 'a', 'n', 4),
+                                    component='a', counter='n')
+        fire_increment = increment.bind(context)
+        fire_reset = reset.bind(context)
+        counts = []
+        for _ in range(3):
+            fire_increment()
+            fire_reset()
+            counts.append(context.read_counter('a', 'n'))
+        assert counts == [2, 0, 2]
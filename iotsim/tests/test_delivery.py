@@ -0,0 +1,82 @@
+import asyncio
+import time
+import pytest
+from iotsim.runtime.delivery import ArrivalQueue, DeliveryScheduler
+
+
+class TestArrivalQueue:
+
+    def test_order_of_arrival(self):
+        queue = ArrivalQueue()
+        for arrival_time, message in [(3, 'a'), (1, 'b'), (3, 'c'), (2, 'd')]:
+            queue.push(arrival_time, message)
+        assert len(queue) == 4
+        assert queue.next_arrival_time() == 1
+        assert list(queue.pop_due(2)) == [(1, 'b'), (2, 'd')]
+        assert list(queue.pop_due(2)) == []
+        queue.push(0, 'e')
+        assert [message for _, message in queue.drain()] == ['e', 'a', 'c']
+        assert len(queue) == 0
+        assert queue.next_arrival_time() is None
+
+    def test_pending(self):
+        queue = ArrivalQueue()
+        for arrival_time, message in [(3, 'a'), (1, 'b'), (3, 'c')]:
+            queue.push(arrival_time, message)
+        assert queue.pending() == [(1, 'b'), (3, 'a'), (3, 'c')]
+        assert len(queue) == 3
+
+
+class TestDeliveryScheduler:
+
+    def test_flush_due(self):
+        clock = [0]
+        batches = []
+        scheduler = DeliveryScheduler(batches.append, slot=1, now=lambda: clock[0])
+        for delivery_time, message in [(2, 'a'), (0.5, 'b'), (1, 'c'), (5, 'd')]:
+            scheduler.schedule(delivery_time, message)
+        assert scheduler.flush_due() == 0
+        clock[0] = 1
+        assert scheduler.flush_due() == 2
+        clock[0] = 4.5
+        assert scheduler.flush_due() == 1
+        assert batches == [['b', 'c'], ['a']]
+        assert scheduler.delivered_counter == 3
+        assert scheduler.late_counter == 1
+        assert len(scheduler) == 1
+
+    def test_integer_clock(self):
+        clock = [0]
+        batches = []
+        scheduler = DeliveryScheduler(batches.append, slot=0.01, now=lambda: clock[0],
+                                      clock_rate=10**9)
+        scheduler.schedule(15 * 10**6, 'a')
+        assert scheduler._time_to_wait() == pytest.approx(0.02)
+        clock[0] = 20 * 10**6
+        scheduler.flush_due()
+        assert batches == [['a']]
+
+    def test_run(self):
+        delivered = []
+
+        def deliver(messages):
+            delivered.extend((time.monotonic(), message) for message in messages)
+
+        async def feed(scheduler):
+            start = time.monotonic()
+            scheduler.schedule(start + 0.03, 'late')
+            scheduler.schedule(start + 0.01, 'early')
+            await asyncio.sleep(0.005)
+            scheduler.schedule(start + 0.02, 'middle')
+            scheduler.close()
+
+        async def main():
+            scheduler = DeliveryScheduler(deliver, slot=0.001)
+            await asyncio.gather(scheduler.run(), feed(scheduler))
+            return scheduler
+
+        scheduler = asyncio.run(main())
+        assert [message for _, message in delivered] == ['early', 'middle', 'late']
+        assert scheduler.delivered_counter == 3
+        with pytest.raises(ValueError):
+            DeliveryScheduler(deliver, slot=0)
@@ -0,0 +1,298 @@
+import asyncio
+import pytest
+from iotsim.runtime.destinations import (AsyncDestination, BufferedDestination,
+                                         Destination, KinesisDestination,
+                                         StandardDestination,
+                                         ConcurrentDestination, HttpDestination,
+                                         ThreadPoolDestination, TcpDestination,
+                                         UdpDestination, KafkaDestination,
+                                         NullDestination, PubSubDestination)
+from iotsim.runtime.encoders import StructEncoder
+from iotsim.runtime.sinks import HttpSink, TcpSink, UdpSink, KafkaBrokerStandIn
+
+
+class StubKinesisClient:
+
+    def __init__(self, throttle=0):
+        self.calls = []
+        self.throttle = throttle
+
+    def put_records(self, StreamName, Records):
+        self.calls.append((StreamName, [record['Data'] for record in Records]))
+        self.keys = [record['PartitionKey'] for record in Records]
+        results = [{'SequenceNumber': '1'}] * len(Records)
+        throttled = min(self.throttle, len(Records))
+        self.throttle -= throttled
+        for i in range(throttled):
+            results[i] = {'ErrorCode': 'ProvisionedThroughputExceededException'}
+        return {'FailedRecordCount': throttled, 'Records': results}
+
+
+class StubPublisher:
+
+    class Future:
+
+        def add_done_callback(self, callback):
+            callback(self)
+
+    def __init__(self):
+        self.published = []
+
+    def topic_path(self, project_id, topic_name):
+        return 'projects/{}/topics/{}'.format(project_id, topic_name)
+
+    def publish(self, topic_path, data):
+        self.published.append((topic_path, data))
+        return self.Future()
+
+
+class ListDestination(Destination):
+
+    def __init__(self):
+        self.messages = []
+        self.shut_down = False
+
+    def send(self, message):
+        self.messages.append(message)
+
+    def shutdown(self):
+        self.shut_down = True
+
+
+class TestDestinations:
+
+    def test_stdout_batch(self, capsys):
+        StandardDestination('stdout').send_batch(['a', 'b'])
+        assert capsys.readouterr().out == 'a\nb\n'
+
+    def test_abstract(self):
+        with pytest.raises(TypeError):
+            Destination()
+        with pytest.raises(TypeError):
+            AsyncDestination()
+
+    def test_null(self):
+        destination = NullDestination()
+        destination.send('a')
+        destination.send_batch(['b', 'c'])
+        assert destination.messages == 3
+
+    def test_kinesis_batch(self):
+        client = StubKinesisClient()
+        destination = KinesisDestination('s', client=client)
+        assert destination.send_batch([str(i) for i in range(1200)]) is None
+        assert [len(data) for _, data in client.calls] == [500, 500, 200]
+        assert client.calls[0][0] == 's'
+
+    def test_kinesis_partition_keys(self):
+        client = StubKinesisClient()
+        destination = KinesisDestination('s', partition_key='k', client=client)
+        assert destination.partitioned
+        destination.send_batch([('a/x', 'm1'), 'm2', (None, 'm3')])
+        assert client.keys == ['a/x', 'k', 'k']
+        assert BufferedDestination(destination).partitioned
+
+    def test_kafka_partitions_by_key(self):
+        broker = KafkaBrokerStandIn(partitions=8)
+        destination = KafkaDestination('t', producer=broker)
+        messages = [('signal{}'.format(i % 5), 'm{}'.format(i)) for i in range(100)]
+        destination.send_batch(messages)
+        partitions = broker.topics['t']
+        assert sum(len(records) for records in partitions) == 100
+        for records in partitions:
+            assert len({key for key, _ in records}) <= 5
+        key_partitions = {key: i for i, records in enumerate(partitions)
+                          for key, _ in records}
+        assert len(key_partitions) == 5
+        assert len(set(key_partitions.values())) > 1
+        assert partitions[key_partitions[b'signal0']][0] == (b'signal0', b'm0')
+        destination.shutdown()
+        assert broker.closed
+
+    def test_pubsub_text_and_binary(self):
+        publisher = StubPublisher()
+        destination = PubSubDestination('p', 't', publisher=publisher)
+        binary = StructEncoder('a', ['x']).encode('truth', 'x', 1.5, 0)
+        destination.send_batch(['m', binary])
+        assert publisher.published == [('projects/p/topics/t', b'm'),
+                                       ('projects/p/topics/t', binary)]
+        assert destination._published_counter == 2
+
+    def test_kinesis_throttled(self):
+        client = StubKinesisClient(throttle=2)
+        destination = KinesisDestination('s', client=client)
+        assert destination.send_batch(['a', 'b', 'c']) == ['a', 'b']
+
+
+class TestBufferedDestination:
+
+    def test_flush_by_count_and_bytes(self):
+        inner = ListDestination()
+        buffered = BufferedDestination(inner, max_count=3, max_bytes=10)
+        buffered.send_batch(['a', 'b'])
+        assert inner.messages == []
+        buffered.send('c')
+        assert inner.messages == ['a', 'b', 'c']
+        buffered.send('x' * 10)
+        assert len(inner.messages) == 4
+        buffered.send('d')
+        buffered.shutdown()
+        assert inner.messages[-1] == 'd'
+        assert inner.shut_down
+
+    def test_flush_by_latency(self):
+        clock = [0]
+        inner = ListDestination()
+        buffered = BufferedDestination(inner, max_latency=1, now=lambda: clock[0])
+        buffered.send('a')
+        buffered.poll()
+        assert inner.messages == []
+        clock[0] = 1
+        buffered.poll()
+        assert inner.messages == ['a']
+
+    def test_backpressure(self):
+        client = StubKinesisClient(throttle=600)
+        buffered = BufferedDestination(KinesisDestination('s', client=client),
+                                       max_count=500, max_pending=100)
+        buffered.send_batch([str(i) for i in range(500)])
+        assert len(buffered) == 500
+        assert buffered.saturated
+        buffered.flush()
+        assert len(buffered) == 100
+        assert not buffered.saturated
+        buffered.flush()
+        assert len(buffered) == 0
+        assert [len(data) for _, data in client.calls] == [500, 500, 100]
+        assert sorted(client.calls[-1][1], key=int) == [str(i) for i in range(100)]
+
+
+class TestConcurrentDestinations:
+
+    def test_http_destination(self):
+
+        async def main():
+            sink = await HttpSink(keep=True).start()
+            http = HttpDestination(sink.url, max_connections=2)
+            buffered = BufferedDestination(ConcurrentDestination(http, max_in_flight=4),
+                                           max_count=10)
+            for i in range(95):
+                buffered.send('m{}'.format(i))
+            await buffered.async_shutdown()
+            await sink.close()
+            return sink
+
+        sink = asyncio.run(main())
+        assert sink.messages == 95
+        assert sink.requests == 10
+        assert sink.connections <= 2
+        lines = b''.join(sink.bodies).decode('utf-8').split()
+        assert sorted(lines) == sorted('m{}'.format(i) for i in range(95))
+
+    def test_rejected_batches_come_back(self):
+
+        async def main():
+            sink = await HttpSink(status=503).start()
+            concurrent = ConcurrentDestination(HttpDestination(sink.url))
+            assert concurrent.send_batch(['a', 'b']) is None
+            assert concurrent.in_flight == 1
+            assert await concurrent.drain() == ['a', 'b']
+            await concurrent.destination.shutdown()
+            await sink.close()
+
+        asyncio.run(main())
+
+    def test_failed_batches_raise(self):
+
+        async def main():
+            sink = await HttpSink(status=500).start()
+            concurrent = ConcurrentDestination(HttpDestination(sink.url))
+            assert concurrent.send_batch(['a']) is None
+            with pytest.raises(RuntimeError, match='status 500'):
+                await concurrent.drain()
+            assert await concurrent.drain() == []
+            assert concurrent.send_batch(['b']) is None
+            while concurrent.in_flight:
+                await asyncio.sleep(0.01)
+            with pytest.raises(RuntimeError, match='status 500'):
+                concurrent.send_batch(['c'])
+            await concurrent.destination.shutdown()
+            await sink.close()
+
+        asyncio.run(main())
+
+    def test_in_flight_limit_and_threads(self):
+
+        async def main():
+            inner = ListDestination()
+            concurrent = ConcurrentDestination(ThreadPoolDestination(inner, threads=2),
+                                               max_in_flight=1)
+            assert concurrent.send_batch(['a']) is None
+            assert concurrent.send_batch(['b']) == ['b']
+            await concurrent.drain()
+            await concurrent.destination.shutdown()
+            return inner
+
+        inner = asyncio.run(main())
+        assert inner.messages == ['a']
+        assert inner.shut_down
+
+    def test_socket_destinations(self):
+
+        async def main():
+            tcp_sink = await TcpSink(keep=True).start()
+            udp_sink = await UdpSink(keep=True).start()
+            tcp = TcpDestination('127.0.0.1', tcp_sink.port)
+            udp = UdpDestination('127.0.0.1', udp_sink.port, max_datagram=20)
+            messages = ['message{}'.format(i) for i in range(10)]
+            assert await tcp.send_batch(messages[:5]) is None
+            assert await tcp.send_batch(messages[5:]) is None
+            assert await udp.send_batch(messages) is None
+            await tcp.shutdown()
+            for _ in range(100):
+                if tcp_sink.messages == 10 and udp_sink.messages == 10:
+                    break
+                await asyncio.sleep(0.01)
+            await udp.shutdown()
+            await tcp_sink.close()
+            await udp_sink.close()
+            return tcp_sink, udp_sink
+
+        tcp_sink, udp_sink = asyncio.run(main())
+        expected = ''.join('message{}\n'.format(i) for i in range(10)).encode('utf-8')
+        assert b''.join(tcp_sink.data) == expected
+        assert tcp_sink.connections == 1
+        assert b''.join(udp_sink.datagrams) == expected
+        assert all(len(datagram) <= 20 for datagram in udp_sink.datagrams)
+
+    def test_created_before_event_loop(self):
+        # as by run_assembly.py, which sets up destinations before the loop runs
+        http = HttpDestination('http://127.0.0.1:1/', max_connections=1)
+        tcp = TcpDestination('127.0.0.1', 1)
+
+        async def main():
+            sink = await HttpSink().start()
+            tcp_sink = await TcpSink(keep=True).start()
+            http.port, tcp.port = sink.port, tcp_sink.port
+            results = await asyncio.gather(
+                *[http.send_batch(['a']) for _ in range(3)],
+                *[tcp.send_batch(['b']) for _ in range(3)])
+            await http.shutdown()
+            await tcp.shutdown()
+            await sink.close()
+            await tcp_sink.close()
+            return results, sink
+
+        results, sink = asyncio.run(main())
+        assert results == [None] * 6
+        assert sink.requests == 3
+
+    def test_tcp_returns_batch_without_server(self):
+
+        async def main():
+            sink = await TcpSink().start()
+            port = sink.port
+            await sink.close()
+            return await TcpDestination('127.0.0.1', port).send_batch(['a'])
+
+        assert asyncio.run(main()) == ['a']
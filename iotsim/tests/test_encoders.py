@@ -0,0 +1,44 @@
+import json
+import pytest
+import pandas as pd
+from iotsim.runtime.encoders import JsonEncoder, MsgPackEncoder, StructEncoder
+
+EVENT_NS = pd.Timestamp('2021-01-01 00:00:01.5').value
+ARRIVAL_NS = EVENT_NS + 1234567
+
+
+class TestEncoders:
+
+    @pytest.mark.parametrize('value', [0, 1.5, -2e-10, 1e300, float('nan'), True])
+    def test_json_same_as_dumps(self, value):
+        encoder = JsonEncoder('a"b', ['s'])
+        assert encoder.header() == []
+        expected = {'meta': 'a"b:truth', 'signal': 's', 'value': value,
+                    'event_time': str(pd.Timestamp(EVENT_NS))}
+        assert encoder.encode('truth', 's', value, EVENT_NS) == json.dumps(expected)
+        expected['meta'] = 'a"b:reading'
+        expected['arrival_time'] = str(pd.Timestamp(ARRIVAL_NS))
+        assert encoder.encode('reading', 's', value, EVENT_NS, ARRIVAL_NS) == \
+            json.dumps(expected)
+
+    def test_struct(self):
+        encoder = StructEncoder('a', ['x', 'y'])
+        header, = encoder.header()
+        assert header[:1] == b'D'
+        assert json.loads(header[1:].decode('utf-8')) == {'assembly': 'a',
+                                                          'signals': ['x', 'y']}
+        truth = encoder.encode('truth', 'y', 1.5, EVENT_NS)
+        assert encoder.truth_record.unpack(truth) == (b'T', 1, 1.5, EVENT_NS)
+        reading = encoder.encode('reading', 'x', 2.5, EVENT_NS, ARRIVAL_NS)
+        assert encoder.reading_record.unpack(reading) == \
+            (b'R', 0, 2.5, EVENT_NS, ARRIVAL_NS)
+        assert len(reading) < len(JsonEncoder('a').encode(
+            'reading', 'x', 2.5, EVENT_NS, ARRIVAL_NS))
+
+    def test_msgpack(self):
+        msgpack = pytest.importorskip('msgpack')
+        encoder = MsgPackEncoder('a', ['x'])
+        message = encoder.encode('reading', 'x', 2.5, EVENT_NS, ARRIVAL_NS)
+        assert msgpack.unpackb(message) == {'meta': 'a:reading', 'signal': 'x',
+                                            'value': 2.5, 'event_time': EVENT_NS,
+                                            'arrival_time': ARRIVAL_NS}
@@ -0,0 +1,80 @@
+import os
+import pytest
+import numpy as np
+from iotsim.constructors import Seesaw, SimpleActuator
+from iotsim.readers import EveryNthReader
+from iotsim.runtime.exporters import batch_columns, ColumnarExporter
+from iotsim.utils import equal_arrays
+
+
+class TestBatchColumns:
+
+    def test_columns(self):
+        constructor = Seesaw()
+        constructor.attach_reader(EveryNthReader(step=2))
+        batch = constructor().launch(batch=5)
+        next(batch)
+        batch = next(batch)
+        columns = batch_columns(batch, tick=0.5)
+        truths = columns['truths']
+        assert equal_arrays(truths['event_tick'], np.arange(5, 10))
+        assert equal_arrays(truths['event_time'], np.arange(5, 10) * 0.5)
+        assert equal_arrays(truths['value'], batch.truths[:, 0])
+        readings = columns['readings']
+        assert equal_arrays(readings['event_tick'], [6, 8])
+        assert equal_arrays(readings['value'], batch.truths[[1, 3], 0])
+        assert readings['arrived'].all()
+
+    def test_rows_ordered_by_tick_and_signal(self):
+        batch = SimpleActuator()().run_batch(3)
+        columns = batch_columns(batch, tick=1,
+                                start_time=np.datetime64('2020-01-01T00:00:00'))
+        truths = columns['truths']
+        assert equal_arrays(truths['signal'], [0, 1, 0, 1, 0, 1])
+        assert equal_arrays(truths['event_tick'], [0, 0, 1, 1, 2, 2])
+        assert truths['event_time'][2] == np.datetime64('2020-01-01T00:00:01')
+        assert equal_arrays(truths['value'], batch.truths.ravel())
+
+
+class TestColumnarExporter:
+
+    def test_arguments(self):
+        with pytest.raises(ValueError):
+            ColumnarExporter('.', file_format='csv')
+        with pytest.raises(ValueError):
+            ColumnarExporter('.', batch=0)
+
+    def test_part_filenames(self):
+        exporter = ColumnarExporter('data', file_format='arrow')
+        assert exporter.filename('truths') == os.path.join('data', 'truths.arrow')
+        assert exporter.filename('readings', 3) == os.path.join('data', 'readings-00003.arrow')
+
+    def test_first_tick(self):
+        exporter = ColumnarExporter('.', batch=3,
+                                    start_time=np.datetime64('2020-01-01T00:00:00'))
+        assembly = SimpleActuator()()
+        assembly.advance(10)
+        batches = list(exporter.columns(assembly, 5, first_tick=11))
+        assert [len(columns['truths']['value']) for columns in batches] == [6, 4]
+        truths = batches[0]['truths']
+        assert equal_arrays(truths['event_tick'], [11, 11, 12, 12, 13, 13])
+        assert truths['event_time'][0] == np.datetime64('2020-01-01T00:00:11')
+        with pytest.raises(ValueError):
+            exporter.columns(assembly, 0)
+
+    @pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+    def test_export(self, tmp_path, file_format):
+        pa = pytest.importorskip('pyarrow')
+        exporter = ColumnarExporter(tmp_path, file_format=file_format, batch=7)
+        rows = exporter.export(SimpleActuator()(), 20)
+        assert rows['truths'] == 40
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(exporter.filename('truths'))
+            assert pq.ParquetFile(exporter.filename('truths')).num_row_groups == 3
+        else:
+            import pyarrow.ipc as ipc
+            table = ipc.open_file(exporter.filename('truths')).read_all()
+        assert table.num_rows == 40
+        assert table.column('event_tick').to_pylist()[-2:] == [19, 19]
+        assert set(table.column('signal').to_pylist()) == {'control', 'sensor'}
@@ -0,0 +1,60 @@
+import copy
+import pytest
+import numpy as np
+from iotsim.fleet import Fleet
+
+CONFIG = dict(
+    readers=[dict(type='EveryNth', label='noisy',
+                  parameters=dict(step=2, noise=0.3, noise_type='absolute'))],
+    networks=[dict(type='Normal', label='normal',
+                   parameters=dict(delay=2, jitter=0.3, drop_rate=0.1))],
+    assembly=dict(type='SimpleActuator',
+                  parameters=dict(control_off_duration=[2, 6]),
+                  readers=dict(default='noisy'),
+                  networks=dict(default='normal')),
+)
+
+
+def equal_chunks(chunk1, chunk2):
+    return all(np.array_equal(a, b, equal_nan=True) for a, b in zip(chunk1, chunk2))
+
+
+class TestFleet:
+
+    def test_from_template(self):
+        fleet = Fleet.from_template(CONFIG, dict(sensor_rise_rate=[1, 2],
+                                                 tick=[1, 0.5, 2]))
+        assert len(fleet) == 6
+        fleet = Fleet.from_template(CONFIG, [dict(name='a'), dict(name='b')])
+        assert len(fleet) == 2
+        with pytest.raises(ValueError):
+            Fleet([])
+
+    def test_run(self):
+        fleet = Fleet.from_template(CONFIG, dict(tick=[1, 0.5, 2]),
+                                    seed=1, processes=0)
+        chunk = fleet.run(10)
+        assert fleet.devices == ['Actuator-0', 'Actuator-1', 'Actuator-2']
+        assert fleet.signals == ['control', 'sensor']
+        assert (np.diff(chunk.event_time) >= 0).all()
+        assert (chunk.event_time < 10).all()
+        ticks_per_device = np.bincount(chunk.device) // 2
+        assert ticks_per_device.tolist() == [10, 20, 5]
+
+    def test_deterministic_across_processes(self):
+        sweep = dict(sensor_rise_rate=[1, 2, 3])
+        local = Fleet.from_template(CONFIG, sweep, seed=7, processes=0).run(20)
+        runner = Fleet.from_template(CONFIG, sweep, seed=7, processes=2).launch(10)
+        chunks = [next(runner), next(runner)]
+        runner.close()
+        merged = [np.concatenate(column) for column in zip(*chunks)]
+        assert equal_chunks(local, merged)
+        other_seed = Fleet.from_template(CONFIG, sweep, seed=8, processes=0).run(20)
+        assert not equal_chunks(local, other_seed)
+
+    @pytest.mark.parametrize('processes', [0, 2])
+    def test_worker_errors(self, processes):
+        config = copy.deepcopy(CONFIG)
+        config['assembly']['type'] = 'NoSuchAssembly'
+        with pytest.raises(ValueError, match='NoSuchAssembly'):
+            Fleet([CONFIG, config], processes=processes).run(5)
@@ -1,5 +1,7 @@
 import pytest
+import numpy as np
 from iotsim.networks import IdealNetwork, NormalNetwork
+from iotsim.utils import RandomStream, equal_floats
 
 
 class TestIdealNetwork:
@@ -62,3 +64,20 @@ class TestLinearBehavior:
         assert n * (1 - drop_rate * 1.5) <= arrived_counter <= n * (1 - drop_rate * 0.5)
 
 
+
+
+class TestNetworkBatch:
+
+    def test_ideal_network_batch(self):
+        arrived, arrival_delays = IdealNetwork().activate().apply_batch(np.zeros(5))
+        assert arrived.all()
+        assert (arrival_delays == 0).all()
+
+    def test_normal_network_batch_matches_runner(self):
+        nw = NormalNetwork('n', delay=10, jitter=2, drop_rate=0.3)
+        runner = nw.activate(random_stream=RandomStream(seed=1))
+        expected = [next(runner) for _ in range(50)]
+        runner = nw.activate(random_stream=RandomStream(seed=1))
+        arrived, arrival_delays = runner.apply_batch(np.zeros(50))
+        assert arrived.tolist() == [a for a, _ in expected]
+        assert equal_floats(arrival_delays.tolist(), [d for _, d in expected])
@@ -0,0 +1,122 @@
+import numpy as np
+from iotsim.constructors import SimpleActuator
+from iotsim.readers import EveryNthReader
+from iotsim.networks import NormalNetwork
+from iotsim.profiling import Profiler
+from iotsim.utils import equal_arrays
+
+
+def make_assembly():
+    constructor = SimpleActuator(control_off_duration=3, control_on_duration=2,
+                                 sensor_reaction_delay=1, seed=2)
+    constructor.attach_reader(EveryNthReader(step=2, noise=0.3))
+    constructor.attach_network(NormalNetwork(delay=2, jitter=0.5, drop_rate=0.2))
+    return constructor()
+
+
+def snapshot_values(runner, n):
+    return [[(s.truth.value, None if s.reading is None else s.reading.value)
+             for s in (snapshot.signal('control'), snapshot.signal('sensor'))]
+            for _, snapshot in zip(range(n), runner)]
+
+
+class TestProfiler:
+
+    def test_same_results(self):
+        n = 100
+        expected = snapshot_values(make_assembly().launch(), n)
+        profiler = Profiler()
+        assert snapshot_values(make_assembly().launch(profiler=profiler), n) == expected
+        expected_batch = make_assembly().run_batch(n)
+        batch = next(make_assembly().launch(batch=n, profiler=Profiler()))
+        for field in ['truths', 'readings', 'arrived', 'arrival_delays']:
+            assert equal_arrays(getattr(batch, field), getattr(expected_batch, field))
+
+    def test_component_counts(self):
+        n = 100
+        profiler = Profiler()
+        snapshot_values(make_assembly().launch(profiler=profiler), n)
+        calls = {key: stats[0] for key, stats in profiler.components.items()}
+        for signal_name in ['control', 'sensor']:
+            assert calls['reader', signal_name] == n
+            assert calls['network', signal_name] == n
+        behavior_calls = sum(calls[key] for key in calls if key[0] == 'behavior')
+        assert behavior_calls == 2 * n
+        assert all(stats[1] >= 0 for stats in profiler.components.values())
+
+    def test_batch_counts(self):
+        profiler = Profiler()
+        runner = make_assembly().launch(batch=30, profiler=profiler)
+        next(runner)
+        runner.send(20)
+        assert profiler.components['reader', 'sensor'][0] == 50
+        assert profiler.components['network', 'control'][0] == 50
+
+    def test_control_hits(self):
+        n = 100
+        profiler = Profiler()
+        snapshot_values(make_assembly().launch(profiler=profiler), n)
+        assert profiler.controls
+        for evaluations, hits, _, action_ns in profiler.controls.values():
+            assert 0 <= hits <= evaluations
+            if hits == 0:
+                assert action_ns == 0
+        # switching the control signal on and off fires 40 times in 100 ticks
+        hits = sorted(stats[1] for label, stats in profiler.controls.items()
+                      if label.startswith('f.control/') and '/on_yield[1]' in label)
+        assert sum(hits) == 40
+
+    def test_after_advance(self):
+        n = 50
+        assembly = make_assembly()
+        assembly.advance(17)
+        expected = snapshot_values(assembly.launch(), n)
+        assembly = make_assembly()
+        assembly.advance(17)
+        profiler = Profiler()
+        assert snapshot_values(assembly.launch(profiler=profiler), n) == expected
+        behavior_calls = sum(stats[0] for key, stats in profiler.components.items()
+                             if key[0] == 'behavior')
+        assert behavior_calls == 2 * n
+        evaluations = [stats[0] for label, stats in profiler.controls.items()
+                       if label.startswith('f.control/')]
+        assert evaluations and sum(evaluations) >= n
+
+    def test_wrap_control(self):
+        profiler = Profiler()
+        fired = []
+        values = iter([True, False, True, False])
+        fire = profiler.wrap_control('c', lambda: next(values), lambda: fired.append(1))
+        for _ in range(4):
+            fire()
+        evaluations, hits, _, _ = profiler.controls['c']
+        assert (evaluations, hits, len(fired)) == (4, 2, 2)
+
+    def test_observe(self):
+        profiler = Profiler()
+        for value in [0.5, 2, 1]:
+            profiler.observe('lag', value)
+        assert profiler.observations['lag'] == [3, 3.5, 2, 1]
+
+    def test_exports(self):
+        profiler = Profiler(prefix='sim')
+        profiler.wrap_function('runtime', 'de"livery', lambda: None)()
+        profiler.wrap_control('c', lambda: True, lambda: None)()
+        profiler.observe('lag_seconds', 0.25)
+        text = profiler.prometheus()
+        assert '# TYPE sim_component_calls_total counter' in text
+        assert 'sim_component_calls_total{kind="runtime",component="de\\"livery"} 1' in text
+        assert 'sim_control_hits_total{control="c"} 1' in text
+        assert 'sim_lag_seconds 0.25' in text
+        assert 'sim_lag_seconds_count 1' in text
+        table = profiler.table()
+        assert 'de"livery' in table
+        assert '100.00%' in table
+        assert 'lag_seconds' in table
+
+    def test_disabled(self):
+        assembly = make_assembly()
+        runner = assembly.launch()
+        next(runner)
+        assert assembly.assembly_context.profiler is None
+        assert not np.isnan(assembly.run_batch(5).truths).any()
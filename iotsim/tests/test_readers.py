@@ -0,0 +1,51 @@
+import pytest
+import numpy as np
+from iotsim.readers import PassthroughReader, EveryNthReader, OnChangeReader
+from iotsim.utils import RandomStream, equal_arrays, equal_floats
+
+
+def read_one_by_one(runner, truths):
+    return [np.nan if reading is None else reading
+            for reading in map(runner, truths)]
+
+
+class TestReaderBatch:
+
+    def check_batches(self, reader, truths, sizes):
+        expected = read_one_by_one(reader.activate(random_stream=RandomStream(seed=1)),
+                                   truths)
+        runner = reader.activate(random_stream=RandomStream(seed=1))
+        start = 0
+        readings = []
+        for size in sizes:
+            readings.extend(runner.apply_batch(np.array(truths[start:start + size])))
+            start += size
+        assert equal_arrays(np.isnan(readings), np.isnan(expected))
+        assert equal_floats([x for x in readings if not np.isnan(x)],
+                            [x for x in expected if not np.isnan(x)])
+
+    def test_passthrough(self):
+        self.check_batches(PassthroughReader(), [1., 2., 3.], [2, 1])
+
+    @pytest.mark.parametrize('step', [1, 3, 4])
+    def test_every_nth(self, step):
+        truths = list(np.linspace(1, 2, 23))
+        self.check_batches(EveryNthReader(step=step, noise=0.1), truths, [5, 0, 7, 11])
+
+    @pytest.mark.parametrize('step', [0, 1, 3])
+    def test_on_change(self, step):
+        truths = [1, 1, 1.05, 1.3, 1.3, 1.3, 1.3, 1.3, 2, 2, 2, 2, 2, 2, 2, 1.9, 1.9]
+        reader = OnChangeReader(accuracy=0.1, step=step, noise=0.1)
+        self.check_batches(reader, truths, [len(truths)])
+        self.check_batches(reader, truths, [3, 1, 6, 7])
+
+
+class TestNoise:
+
+    def test_default_random_stream(self, monkeypatch):
+        from iotsim import readers
+        monkeypatch.setattr(readers, '_default_random_stream', RandomStream(seed=1))
+        noisy = [readers.add_noise(10., 0.1) for _ in range(3)]
+        noisy_array = readers.add_noise_array(np.full(3, 10.), 0.1)
+        expected = 10. + 2 * (RandomStream(seed=1).random_array(6) - 0.5)
+        assert equal_floats(noisy + noisy_array.tolist(), expected)
@@ -0,0 +1,60 @@
+import pytest
+from iotsim.core import AssemblyContext, Dependency
+from iotsim.triggers import (CounterTrigger, HistoryConditionTrigger,
+                             HistoryOutOfRangeTrigger, ParameterInRangeTrigger,
+                             Always)
+
+
+class TestBoundTriggers:
+
+    def test_history_triggers(self):
+        context = AssemblyContext(['f'])
+        trg_cond = HistoryConditionTrigger('', 'f', 0, lambda x: x > 1)
+        trg_range = HistoryOutOfRangeTrigger('', 'f', 0, 3, 0)
+        assert trg_cond.dependencies == [Dependency('history', 'f', 0)]
+        cond = trg_cond.bind(context)
+        out_of_range = trg_range.bind(context)
+        assert cond() is None
+        assert out_of_range() is None
+        for value in [0, 2, 5]:
+            context.record('f', value)
+            assert cond() == trg_cond.check(context)
+            assert out_of_range() == trg_range.check(context)
+
+    def test_parameter_trigger(self):
+        context = AssemblyContext(['c'])
+        trg = ParameterInRangeTrigger('', 'c', 'p', 0, 1)
+        assert trg.dependencies == [Dependency('parameter', 'c', 'p')]
+        in_range = trg.bind(context)
+        assert in_range() is None
+        context.set_parameter('c', 'p', 0.5)
+        assert in_range()
+        context.set_parameter('c', 'p', 2)
+        assert not in_range()
+
+    def test_counter_trigger(self):
+        context = AssemblyContext(['c'])
+        trg = CounterTrigger('', 'c', 'n', threshold=3)
+        assert trg.dependencies == [Dependency('counter', 'c', 'n')]
+        reached = trg.bind(context)
+        assert reached() is None
+        context.reset_counter('c', 'n')
+        results = []
+        for _ in range(5):
+            results.append(reached())
+            context.increment_counter('c', 'n')
+        assert results == [False, False, False, True, False]
+
+    def test_named_trigger_follows_context(self):
+        context = AssemblyContext(['c', 't'])
+        trg = ParameterInRangeTrigger('t', 'c', 'p', 0, 1)
+        in_range = trg.bind(context)
+        context.set_parameter('c', 'p', 0.5)
+        assert in_range()
+        context.set_parameter('t', 'active', False)
+        assert in_range() is None
+
+    def test_always(self):
+        trg = Always()
+        assert trg.dependencies == []
+        assert trg.bind()()
@@ -1,5 +1,5 @@
 import pytest
-from iotsim.utils import to_name, RangeChoice
+from iotsim.utils import to_name, RangeChoice, RandomStream, equal_floats
 
 class TestToName:
 
@@ -103,4 +103,60 @@ class TestRangeChoice:
             count3 += int(rc == 3)
         assert 60 <= count1 <= 80
         assert count2 == 0
-        assert count3 == 100
\ No newline at end of file
+        assert count3 == 100
+
+class TestRandomStream:
+
+    def test_reproducible(self):
+        s1 = RandomStream(seed=1, block_size=10)
+        s2 = RandomStream(seed=1, block_size=10)
+        values1 = [(s1.random(), s1.normal(10, 2), s1.choice(3, p=[0.2, 0.3, 0.5]))
+                   for _ in range(25)]
+        values2 = [(s2.random(), s2.normal(10, 2), s2.choice(3, p=[0.2, 0.3, 0.5]))
+                   for _ in range(25)]
+        assert values1 == values2
+
+    def test_distributions(self):
+        stream = RandomStream(seed=2)
+        n = 10000
+        uniform = [stream.random() for _ in range(n)]
+        assert 0 <= min(uniform) and max(uniform) < 1
+        normal = [stream.normal(10, 2) for _ in range(n)]
+        assert equal_floats(sum(normal) / n, 10, accuracy=0.1)
+        p = [0.2, 0.3, 0.5]
+        counts = [0, 0, 0]
+        for _ in range(n):
+            counts[stream.choice(3, p=p)] += 1
+        assert equal_floats([c / n for c in counts], p, accuracy=0.02)
+
+    def test_range_choice_with_stream(self):
+        results1 = [RangeChoice([1, 2], random_stream=RandomStream(seed=3)) == 1
+                    for _ in range(10)]
+        stream = RandomStream(seed=3)
+        results2 = [RangeChoice([1, 2], random_stream=stream) == 1 for _ in range(10)]
+        assert len(set(results1)) == 1
+        assert results1[0] == results2[0]
+
+    def test_arrays_follow_scalars(self):
+        s1 = RandomStream(seed=4, block_size=8)
+        s2 = RandomStream(seed=4, block_size=8)
+        uniform = [s1.random() for _ in range(30)]
+        normal = [s1.normal(1, 2) for _ in range(30)]
+        assert equal_floats(list(s2.random_array(3)) + list(s2.random_array(20))
+                            + [s2.random()] + list(s2.random_array(6)), uniform)
+        assert equal_floats([s2.normal(1, 2)] + list(s2.normal_array(1, 2, 29)),
+                            normal)
+        assert len(s2.random_array(0)) == 0
+
+    def test_state(self):
+        s1 = RandomStream(seed=5, block_size=8)
+        s1.random_array(13)
+        s1.normal(0, 1)
+        state = s1.get_state()
+        expected = [(s1.random(), s1.normal(0, 1)) for _ in range(20)]
+        s2 = RandomStream(seed=6, block_size=8)
+        s2.set_state(state)
+        assert [(s2.random(), s2.normal(0, 1)) for _ in range(20)] == expected
+        fresh = RandomStream(seed=7)
+        fresh.set_state(RandomStream(seed=5).get_state())
+        assert fresh.random() == RandomStream(seed=5).random()
@@ -1,5 +1,17 @@
-from .core import Trigger, AssemblyContext
-from .utils import RangeChoice
+import numpy as np
+
+from .core import Trigger, AssemblyContext, Dependency, _first_hit
+from .utils import RangeChoice, to_iterable
+
+
+def _history_horizon(assembly_context: AssemblyContext, component, lag, check):
+    """Return `horizon` of a condition `check(x)` of the history value `x`."""
+    handle = assembly_context.handle(component)
+
+    def horizon(forecast, reader, k):
+        return _first_hit(check, *forecast.history(handle, lag, reader, k))
+
+    return horizon
 
 
 class HistoryConditionTrigger(Trigger):
@@ -8,6 +20,11 @@ class HistoryConditionTrigger(Trigger):
         super().__init__(name, active=True, component=component,
                          lag=lag, condition=condition)
 
+    @property
+    def dependencies(self):
+        return [Dependency('history', self._default_parameters['component'],
+                           self._default_parameters['lag'])]
+
     def _evaluate_condition(self, assembly_context: AssemblyContext, **kwargs):
 
         component, lag, condition = (kwargs['component'],
@@ -15,6 +32,20 @@ class HistoryConditionTrigger(Trigger):
         x = assembly_context.query(component, lag)
         return None if x is None else condition(x)
 
+    def _bind_condition(self, assembly_context: AssemblyContext,
+                        component, lag, condition):
+        query = assembly_context.handle(component).history.query
+
+        def evaluate():
+            x = query(lag)
+            return None if x is None else condition(x)
+
+        return evaluate
+
+    def _bind_horizon(self, assembly_context: AssemblyContext,
+                      component, lag, condition):
+        return _history_horizon(assembly_context, component, lag, condition)
+
 
 class HistoryInRangeTrigger(Trigger):
 
@@ -22,6 +53,11 @@ class HistoryInRangeTrigger(Trigger):
         super().__init__(name, active=True, component=component,
                          lag=lag, v0=v0, v1=v1)
 
+    @property
+    def dependencies(self):
+        return [Dependency('history', self._default_parameters['component'],
+                           self._default_parameters['lag'])]
+
     def _evaluate_condition(self, assembly_context: AssemblyContext, **kwargs):
 
         component, lag, v0, v1 = (kwargs['component'],
@@ -29,6 +65,23 @@ class HistoryInRangeTrigger(Trigger):
         x = assembly_context.query(component, lag)
         return None if x is None else min(v0, v1) <= x <= max(v0, v1)
 
+    def _bind_condition(self, assembly_context: AssemblyContext,
+                        component, lag, v0, v1):
+        query = assembly_context.handle(component).history.query
+        low, high = min(v0, v1), max(v0, v1)
+
+        def evaluate():
+            x = query(lag)
+            return None if x is None else low <= x <= high
+
+        return evaluate
+
+    def _bind_horizon(self, assembly_context: AssemblyContext,
+                      component, lag, v0, v1):
+        low, high = min(v0, v1), max(v0, v1)
+        return _history_horizon(assembly_context, component, lag,
+                                lambda x: low <= x <= high)
+
 
 class ParameterInRangeTrigger(Trigger):
 
@@ -36,6 +89,11 @@ class ParameterInRangeTrigger(Trigger):
         super().__init__(name, active=True, component=component,
                          parameter=parameter, v0=v0, v1=v1)
 
+    @property
+    def dependencies(self):
+        return [Dependency('parameter', self._default_parameters['component'],
+                           self._default_parameters['parameter'])]
+
     def _evaluate_condition(self, assembly_context: AssemblyContext, **kwargs):
 
         component, parameter, v0, v1 = (kwargs['component'], kwargs['parameter'],
@@ -43,6 +101,31 @@ class ParameterInRangeTrigger(Trigger):
         x = assembly_context.get_parameter(component, parameter)
         return None if x is None else min(v0, v1) <= x <= max(v0, v1)
 
+    def _bind_condition(self, assembly_context: AssemblyContext,
+                        component, parameter, v0, v1):
+        parameters = assembly_context.handle(component).parameters
+        low, high = min(v0, v1), max(v0, v1)
+
+        def evaluate():
+            x = parameters.get(parameter)
+            return None if x is None else low <= x <= high
+
+        return evaluate
+
+    def _bind_horizon(self, assembly_context: AssemblyContext, **kwargs):
+        # parameters do not change while no control fires
+        evaluate = self._bind_condition(assembly_context, **kwargs)
+        return lambda forecast, reader, k: 0 if evaluate() else k
+
+
+def _negated(evaluate):
+
+    def evaluate_negated():
+        result = evaluate()
+        return result if result is None else not result
+
+    return evaluate_negated
+
 
 class HistoryOutOfRangeTrigger(HistoryInRangeTrigger):
 
@@ -50,12 +133,39 @@ class HistoryOutOfRangeTrigger(HistoryInRangeTrigger):
         result = super()._evaluate_condition(assembly_context, **kwargs)
         return result if result is None else not result
 
+    def _bind_condition(self, assembly_context: AssemblyContext, **kwargs):
+        return _negated(super()._bind_condition(assembly_context, **kwargs))
+
+    def _bind_horizon(self, assembly_context: AssemblyContext,
+                      component, lag, v0, v1):
+        low, high = min(v0, v1), max(v0, v1)
+        return _history_horizon(assembly_context, component, lag,
+                                lambda x: not low <= x <= high)
+
+
 class ParameterOutOfRangeTrigger(ParameterInRangeTrigger):
 
     def _evaluate_condition(self, assembly_context: AssemblyContext, **kwargs):
         result = super()._evaluate_condition(assembly_context, **kwargs)
         return result if result is None else not result
 
+    def _bind_condition(self, assembly_context: AssemblyContext, **kwargs):
+        return _negated(super()._bind_condition(assembly_context, **kwargs))
+
+
+class _DrawnThreshold:
+    """State of `CounterTrigger` compiled for the next-event engine."""
+
+    def __init__(self):
+        # drawn count, the latest count seen and the number of resets at the draw
+        self.drawn = [None, None, None]
+
+    def get_state(self):
+        return list(self.drawn)
+
+    def set_state(self, state):
+        self.drawn[:] = state
+
 
 class CounterTrigger(Trigger):
 
@@ -63,13 +173,103 @@ class CounterTrigger(Trigger):
         super().__init__(name, active=True, component=component,
                          counter=counter, threshold=threshold)
 
+    @property
+    def dependencies(self):
+        return [Dependency('counter', self._default_parameters['component'],
+                           self._default_parameters['counter'])]
+
     def _evaluate_condition(self, assembly_context: AssemblyContext, **kwargs):
         component, counter, threshold = (kwargs['component'], kwargs['counter'],
                                      kwargs['threshold'])
         # `threshold` may be a single value or a list or values;
         # in the latter case one value will be selected from the list at random
         count = assembly_context.read_counter(component, counter)
-        return None if count is None else RangeChoice(threshold) == count
+        if count is None:
+            return None
+        random_stream = assembly_context.random_stream(
+            'counter:{}/{}'.format(component, counter))
+        return RangeChoice(threshold, random_stream=random_stream) == count
+
+    def _bind_condition(self, assembly_context: AssemblyContext,
+                        component, counter, threshold):
+        counters = assembly_context.handle(component).counters
+        random_stream = assembly_context.random_stream(
+            'counter:{}/{}'.format(component, counter))
+        threshold_choice = RangeChoice(threshold, random_stream=random_stream)
+        # the condition may hold only at these counts
+        # so the random choice is skipped at all other counts
+        candidates = set(to_iterable(threshold))
+
+        def evaluate():
+            count = counters.get(counter)
+            if count is None:
+                return None
+            if count not in candidates:
+                return False
+            return threshold_choice == count
+
+        return evaluate
+
+    def _bind_events(self, assembly_context: AssemblyContext,
+                     component, counter, threshold):
+        # Instead of a random choice at every candidate count, the count at which
+        # the condition holds is drawn once, with the same probabilities:
+        # at the k-th candidate, it holds with the probability that
+        # `RangeChoice` casts one of the first k candidates.
+        handle = assembly_context.handle(component)
+        counters = handle.counters
+        random_stream = assembly_context.random_stream(
+            'counter:{}/{}'.format(component, counter))
+        candidates = sorted(to_iterable(threshold))
+        n = len(candidates)
+        probabilities = [(i + 1) / n for i in range(n)]
+        resets = handle.resets
+        state = _DrawnThreshold()
+        drawn = state.drawn
+
+        def draw_threshold(count):
+            if n == 1:
+                drawn[0] = candidates[0]
+                return
+            for candidate, probability in zip(candidates, probabilities):
+                if candidate >= count and random_stream.random() < probability:
+                    drawn[0] = candidate
+                    return
+            drawn[0] = np.inf
+
+        def current_threshold(count):
+            # draw again after the counter was reset (even to the same count),
+            # went down or went past the threshold
+            reset_number = resets.get(counter, 0)
+            if (drawn[0] is None or reset_number != drawn[2] or count < drawn[1]
+                    or count > drawn[0]):
+                draw_threshold(count)
+                drawn[2] = reset_number
+            drawn[1] = count
+            return drawn[0]
+
+        def evaluate():
+            count = counters.get(counter)
+            if count is None:
+                return None
+            return count == current_threshold(count)
+
+        def horizon(forecast, reader, k):
+            line = forecast.counter(handle, counter, reader)
+            if line is None:
+                return 0
+            first, rate = line
+            if rate < 0:
+                return 0
+            threshold_count = current_threshold(counters[counter])
+            if first >= threshold_count:
+                return 0
+            if rate == 0 or threshold_count == np.inf:
+                return k
+            # the first tick with the count at the threshold or past it
+            return min(k, int(-(-(threshold_count - first) // rate)))
+
+        return evaluate, horizon, state
 
 
 class Always(Trigger):
@@ -77,6 +277,15 @@ class Always(Trigger):
     def __init__(self):
         super().__init__(name=None, active=True)
 
+    @property
+    def dependencies(self):
+        return []
+
     def _evaluate_condition(self, assembly_context: AssemblyContext, **kwargs):
         return True
 
+    def _bind_condition(self, assembly_context: AssemblyContext):
+        return lambda: True
+
+    def _bind_horizon(self, assembly_context: AssemblyContext):
+        return lambda forecast, reader, k: 0
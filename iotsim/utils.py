@@ -1,4 +1,6 @@
 from collections.abc import Iterable
+from bisect import bisect_right
+from itertools import accumulate
 import numpy as np
 
 
@@ -58,17 +60,148 @@ def to_name(obj):
         return str(obj)
 
 
+class RandomStream:
+    """Random numbers drawn from its own `numpy.random.Generator`.
+
+       Values are served from blocks of `block_size` numbers drawn at once,
+       which is much cheaper than a generator call per value. Uniform and
+       normal values come from separate blocks, and arrays take their values
+       from the same blocks as scalars, so the sequence of values of each kind
+       does not depend on how the draws are split between calls.
+    """
+
+    def __init__(self, seed=None, block_size=4096):
+        self._generator = np.random.default_rng(seed)
+        self._block_size = int(block_size)
+        self._uniform_block = np.empty(0)
+        self._uniform = []
+        self._uniform_pos = 0
+        self._normal_block = np.empty(0)
+        self._normal = []
+        self._normal_pos = 0
+        # (generator's state, number of values) of the draw of the current block,
+        # so that a saved state does not need to keep the block's values
+        self._uniform_source = None
+        self._normal_source = None
+        self._p = None
+        self._cumulative_p = None
+
+    @property
+    def generator(self):
+        return self._generator
+
+    def random(self):
+        """Return a float uniformly distributed in [0, 1)."""
+        if self._uniform_pos == len(self._uniform):
+            self._uniform_source = (self._generator.bit_generator.state, self._block_size)
+            self._uniform_block = self._generator.random(self._block_size)
+            self._uniform = self._uniform_block.tolist()
+            self._uniform_pos = 0
+        x = self._uniform[self._uniform_pos]
+        self._uniform_pos += 1
+        return x
+
+    def normal(self, loc=0, scale=1):
+        if self._normal_pos == len(self._normal):
+            self._normal_source = (self._generator.bit_generator.state, self._block_size)
+            self._normal_block = self._generator.standard_normal(self._block_size)
+            self._normal = self._normal_block.tolist()
+            self._normal_pos = 0
+        x = self._normal[self._normal_pos]
+        self._normal_pos += 1
+        return loc + scale * x
+
+    def random_array(self, size):
+        """Return an array of `size` floats uniformly distributed in [0, 1)."""
+        values, self._uniform_pos, block, source = self._take(
+            size, self._uniform_block, self._uniform_pos, self._generator.random)
+        if block is not self._uniform_block:
+            self._uniform_block = block
+            self._uniform = block.tolist()
+            self._uniform_source = source
+        return values
+
+    def normal_array(self, loc, scale, size):
+        values, self._normal_pos, block, source = self._take(
+            size, self._normal_block, self._normal_pos,
+            self._generator.standard_normal)
+        if block is not self._normal_block:
+            self._normal_block = block
+            self._normal = block.tolist()
+            self._normal_source = source
+        return loc + scale * values
+
+    def _take(self, size, block, pos, draw):
+        parts = [block[pos:pos + size]]
+        taken = len(parts[0])
+        pos += taken
+        source = None
+        if taken < size:
+            # whole blocks are drawn at once and the tail of the last one is kept
+            n_blocks = -(-(size - taken) // self._block_size)
+            source = (self._generator.bit_generator.state, n_blocks * self._block_size)
+            new_blocks = draw(n_blocks * self._block_size)
+            block = new_blocks[-self._block_size:]
+            pos = size - taken - (n_blocks - 1) * self._block_size
+            parts.append(new_blocks[:size - taken])
+        return np.concatenate(parts), pos, block, source
+
+    def get_state(self):
+        """Return the state of the stream as a tuple of plain values.
+
+           Instead of the values of the current blocks, the state keeps
+           how they were drawn, so it is small.
+        """
+        return (self._generator.bit_generator.state,
+                self._uniform_source, self._uniform_pos,
+                self._normal_source, self._normal_pos)
+
+    def set_state(self, state):
+        """Set the state returned by `get_state` of a stream with the same block size."""
+        (generator_state, self._uniform_source, self._uniform_pos,
+         self._normal_source, self._normal_pos) = state
+        self._uniform_block = self._redraw(self._uniform_source, self._generator.random)
+        self._uniform = self._uniform_block.tolist()
+        self._normal_block = self._redraw(self._normal_source,
+                                          self._generator.standard_normal)
+        self._normal = self._normal_block.tolist()
+        self._generator.bit_generator.state = generator_state
+
+    def _redraw(self, source, draw):
+        if source is None:
+            return np.empty(0)
+        generator_state, size = source
+        self._generator.bit_generator.state = generator_state
+        return draw(size)[-self._block_size:]
+
+    def choice(self, n, p=None):
+        """Return a random index in range(n) with probabilities `p`."""
+        if p is None:
+            return int(self.random() * n)
+        if p is not self._p:
+            self._p = p
+            self._cumulative_p = list(accumulate(p))
+        index = bisect_right(self._cumulative_p, self.random() * self._cumulative_p[-1])
+        return min(index, n - 1)
+
+
+_default_random_stream = RandomStream()
+
+
 class RangeChoice:
 
-    def __init__(self, v, p=None):
+    def __init__(self, v, p=None, random_stream=None):
         self._v = sorted(to_iterable(v))
         self._p = p
+        if random_stream is None:
+            random_stream = _default_random_stream
+        self._random_stream = random_stream
 
     def __eq__(self, other):
         try:
             other_index = self._v.index(other)
         except ValueError:
             return False
-        cast_index = np.random.choice(np.arange(len(self._v)), p=self._p)
+        cast_index = self._random_stream.choice(len(self._v), p=self._p)
         return cast_index <= other_index
 
@@ -1,11 +1,22 @@
-import argparse, sys, json, yaml
+import argparse, os, sys, yaml, time
+from functools import partial
+from itertools import islice
 
+import numpy as np
 import pandas as pd
 import asyncio
 
 from iotsim.utils import to_iterable
-from iotsim.runtime.destinations import known_destinations
+from iotsim.runtime.destinations import (known_destinations, BufferedDestination,
+                                         AsyncDestination, ConcurrentDestination,
+                                         ThreadPoolDestination)
+from iotsim.runtime.exporters import ColumnarExporter
+from iotsim.runtime.delivery import ArrivalQueue, DeliveryScheduler
+from iotsim.runtime.clock import seconds_to_ns, NS_PER_SECOND
+from iotsim.runtime.encoders import known_encoders
 from iotsim.assembler import from_config
+from iotsim.backfill import Backfill
+from iotsim.profiling import Profiler
 
 
 if __name__ != '__main__':
@@ -19,6 +30,9 @@ parser.add_argument('-c', '--config', metavar='runner_config_filename',
 parser.add_argument('-t', '--ticks', metavar='ticks', type=int,
                     help='Number of time ticks to go, int >=0. '
                          'Zero means infinite run.')
+parser.add_argument('-s', '--skip-ticks', metavar='skip_ticks', type=int,
+                    help="Number of ticks to run the assembly's features for "
+                         "before the first message, without sending anything.")
 parser.add_argument('-p', '--pace', metavar='pace', type=float,
                     help="Factor to speed up (>1) or slow down (<1) the assembly.")
 parser.add_argument('-b', '--start-time', metavar='start_time',
@@ -26,14 +40,54 @@ parser.add_argument('-b', '--start-time', metavar='start_time',
 parser.add_argument('-d', '--start-delta', metavar='start_delta',
                     help="Seconds added to the local machine's time to compensate "
                           "clock skew at destination. May be negative. The default is 0.")
+parser.add_argument('-m', '--message-format', metavar='message_format',
+                    choices=sorted(known_encoders),
+                    help="Encoding of the messages: 'json' (the default), "
+                         "'msgpack' or 'struct'.")
+parser.add_argument('-a', '--fast', action='store_true', default=None,
+                    help="Run on a simulated clock: event and arrival times are "
+                         "computed from the tick number and messages are sent "
+                         "as fast as the destinations accept them.")
+parser.add_argument('-x', '--export', metavar='export_directory',
+                    help="Run the assembly as fast as possible and write its truths "
+                         "and readings to columnar files in this directory "
+                         "instead of sending them to destinations.")
+parser.add_argument('-f', '--export-format', metavar='export_format',
+                    choices=['parquet', 'arrow'],
+                    help="Format of exported files: 'parquet' (the default) or 'arrow'.")
+parser.add_argument('-n', '--slices', metavar='slices', type=int,
+                    help="Export the run in this number of time slices simulated "
+                         "concurrently by a pool of 'processes' processes.")
+parser.add_argument('-P', '--profile', metavar='profile_filename',
+                    help="Profile the run and write the statistics of the components "
+                         "to this file at the end: Prometheus text format if the name "
+                         "ends with '.prom', a table otherwise; '-' is stderr.")
+parser.add_argument('-k', '--checkpoint', metavar='checkpoint_filename',
+                    help="Save the state of the run to this file every "
+                         "'checkpoint_every' ticks and at the end.")
+parser.add_argument('-r', '--resume', metavar='checkpoint_filename',
+                    help="Go on with a run from the state saved to this file "
+                         "with --checkpoint.")
 
 defaults=dict(
     ticks=0,
+    skip_ticks=0,
     message_format='json',
     start_time='now',
     start_delta=2,
     pace=1,
+    fast=False,
+    delivery_slot=0.01,
+    buffer=dict(max_count=500, max_bytes=1000000, max_latency=0.1, max_pending=100000),
+    max_in_flight=8,
     routing={'reading': ['stdout'], 'truth': ['stdout']},
+    export_format='parquet',
+    export_compression='zstd',
+    export_batch=100000,
+    checkpoint_every=10000,
+    slices=1,
+    processes=None,
+    continuous=True,
     destinations=dict(),
 )
 
@@ -70,24 +124,104 @@ start_time = get_param_value('start_time')
 start_delta = get_param_value('start_delta')
 start_time = pd.Timestamp(start_time) + pd.Timedelta(start_delta, unit='s')
 
-signal_label = 'signal'
-value_label = 'value'
-event_time_label = 'event_time'
-arrival_time_label = 'arrival_time'
-meta_label = 'meta'
-
 #### Create an assembly
 
 assembly = from_config(args.assembly_config_filename)
 if assembly_name is None:
     assembly_name = 'assembly' if assembly.name is None else assembly.name
-tick_duration = pd.Timedelta(assembly.tick, unit='s')
-assembly_runner = assembly.launch()
+tick_ns = seconds_to_ns(assembly.tick)
+# number of the tick before the first one of this run: the first message
+# is of the tick after the resumed and the skipped ones
+first_tick = 0
+# messages of the simulated clock that were not sent when the run was saved
+pending_messages = []
+# Pandas is only used to parse the start time: the runtime keeps time
+# as integer nanoseconds; the event time of tick `n` is `start_ns + n * tick_ns`
+start_ns = None
+resume_filename = get_param_value('resume')
+resume_blob = None
+export_directory = get_param_value('export')
+if resume_filename is not None:
+    with open(resume_filename, 'rb') as f:
+        resume_blob = f.read()
+    resumed = assembly.restore(resume_blob)
+    # the ticks are numbered on from the saved tick
+    first_tick = resumed['tick']
+    if get_param_value('fast') or export_directory is not None:
+        # the simulated clock goes on from the saved tick
+        start_ns, pending_messages = resumed['start_ns'], resumed['pending']
+sliced = export_directory is not None and get_param_value('slices') > 1
+skip_ticks = get_param_value('skip_ticks')
+# warm up (the slices of an export warm up on their own)
+if not sliced and skip_ticks > 0:
+    assembly.advance(skip_ticks)
+first_tick += skip_ticks
+if start_ns is None:
+    # the first tick of the run is one tick after the start time
+    start_ns = start_time.value - first_tick * tick_ns
+# text times keep the UTC offset of the start time, if it has one
+encoder = known_encoders[message_format](
+    assembly_name, [signal.name for signal in assembly.signals],
+    utc_offset=start_time.utcoffset())
+
+### Export mode: no destinations, no real time
+
+if export_directory is not None:
+    if ticks is None:
+        sys.exit("Number of ticks must be specified to export an assembly's data")
+    exporter = ColumnarExporter(export_directory,
+                                file_format=get_param_value('export_format'),
+                                compression=get_param_value('export_compression'),
+                                batch=get_param_value('export_batch'),
+                                start_time=np.datetime64(start_ns, 'ns'))
+    started_at = time.perf_counter()
+    if sliced:
+        # the slices are built from the config and start from the resumed state
+        backfill = Backfill(args.assembly_config_filename,
+                            slices=get_param_value('slices'),
+                            processes=get_param_value('processes'),
+                            warmup=skip_ticks,
+                            continuous=get_param_value('continuous'),
+                            start=resume_blob)
+        rows = backfill.export(exporter, ticks, first_tick=first_tick + 1)
+    else:
+        rows = exporter.export(assembly, ticks, first_tick=first_tick + 1)
+    elapsed = time.perf_counter() - started_at
+    print("Exported {} ticks ({} truths, {} readings) to {} in {:.2f} s".format(
+          ticks, rows['truths'], rows['readings'], export_directory, elapsed),
+          file=sys.stderr)
+    sys.exit()
+
+profile_filename = get_param_value('profile')
+profiler = None if profile_filename is None else Profiler()
+assembly_runner = assembly.launch(profiler=profiler)
+
+
+def write_profile():
+    if profiler is None:
+        return
+    if profile_filename.endswith('.prom'):
+        text = profiler.prometheus()
+    else:
+        text = profiler.table()
+    if profile_filename == '-':
+        sys.stderr.write(text)
+    else:
+        with open(profile_filename, 'w') as f:
+            f.write(text)
 
 ### Set up destinations
 
 active_destinations = dict()
 destination_routing = dict(reading=[], truth=[])
+destination_names = dict(reading=[], truth=[])
+# partition key of every signal for partitioned destinations, None for others
+destination_partition_keys = dict()
+partition_key_formats = {
+    'signal': '{signal}',
+    'assembly': '{assembly}',
+    'assembly/signal': '{assembly}/{signal}',
+}
 configured_routing = get_param_value('routing')
 configured_destinations = get_param_value('destinations')
 for dataview in destination_routing.keys():
@@ -99,17 +233,36 @@ for dataview in destination_routing.keys():
                     configured_destinations[destination]['type']]
             else:
                 cls, kwargs = known_destinations[destination]
+            destination_config = configured_destinations.get(destination, dict())
             try:
-                additional_params = configured_destinations[destination]['parameters']
+                additional_params = destination_config['parameters']
             except KeyError:
                 pass
             else:
                 kwargs.update(additional_params)
             handler = cls(**kwargs)
+            # destinations that do I/O send their batches concurrently
+            # without blocking the event loop
+            if 'threads' in destination_config:
+                handler = ThreadPoolDestination(handler, destination_config['threads'])
+            if isinstance(handler, AsyncDestination):
+                handler = ConcurrentDestination(handler, destination_config.get(
+                    'max_in_flight', get_param_value('max_in_flight')))
+            handler = BufferedDestination(handler, **get_param_value('buffer'))
             active_destinations[destination] = handler
+            if handler.partitioned:
+                key_format = partition_key_formats[
+                    destination_config.get('partition_key', 'signal')]
+                destination_partition_keys[destination] = {
+                    signal.name: key_format.format(assembly=assembly_name,
+                                                   signal=signal.name)
+                    for signal in assembly.signals}
+            else:
+                destination_partition_keys[destination] = None
         else:
             handler = active_destinations[destination]
         destination_routing[dataview].append(handler)
+        destination_names[dataview].append(destination)
 
 ### Define the real-time flow of the messages
 
@@ -128,74 +281,199 @@ for dataview in destination_routing.keys():
 # example:
 # assembly_snapshot.signal('control').reading.value
 
-async def deliver_datapoint(datapoint, dataview, delivery_time, event_time,
-                            arrival_time=None):
+def format_message(datapoint, dataview, event_ns, arrival_ns=None):
+    return encoder.encode(dataview, datapoint.signal_name, datapoint.value,
+                          event_ns, arrival_ns)
+
+
+checkpoint_filename = get_param_value('checkpoint')
+checkpoint_every = get_param_value('checkpoint_every')
+
+
+def write_checkpoint(tick_number, pending=()):
+    """Save the state of the assembly after `tick_number` ticks
+       with the messages not sent yet."""
+    blob = assembly.checkpoint(info=dict(tick=tick_number, start_ns=start_ns,
+                                         pending=list(pending)))
+    # the previous checkpoint is replaced only by a complete file
+    with open(checkpoint_filename + '.tmp', 'wb') as f:
+        f.write(blob)
+    os.replace(checkpoint_filename + '.tmp', checkpoint_filename)
+
+
+
+def deliver_messages(messages):
+    # every destination gets its messages in one batch, in the order of arrival
+    batches = {destination: [] for destination in active_destinations}
+    for dataview, signal_name, message in messages:
+        for destination in destination_names[dataview]:
+            partition_keys = destination_partition_keys[destination]
+            if partition_keys is None:
+                batches[destination].append(message)
+            else:
+                batches[destination].append((partition_keys[signal_name], message))
+    for destination, destination_messages in batches.items():
+        active_destinations[destination].send_batch(destination_messages)
+
 
-    message_data = {
-        meta_label: "{}:{}".format(assembly_name, dataview),
-        signal_label: datapoint.signal_name,
-        value_label: datapoint.value,
-        event_time_label: str(event_time),
-    }
-    if dataview == 'reading':
-        message_data[arrival_time_label] = str(arrival_time)
+if profiler is not None:
+    deliver_messages = profiler.wrap_function('runtime', 'delivery', deliver_messages)
 
-    message = json.dumps(message_data)
-    wait_until_delivery =  (delivery_time - pd.Timestamp('now')).total_seconds()
-    await asyncio.sleep(wait_until_delivery)
-    if wait_until_delivery < 0:
-        raise RuntimeError("System fell behind assembly's schedule")
 
-    for destination_handler in destination_routing[dataview]:
-        destination_handler.send(message)
+def destinations_saturated():
+    return any(handler.saturated for handler in active_destinations.values())
+
+
+def poll_destinations():
+    for handler in active_destinations.values():
+        handler.poll()
+
+
+def start_destinations():
+    header = encoder.header()
+    if header:
+        for handler in active_destinations.values():
+            handler.send_batch(header)
+
+
+async def shutdown_destinations():
+    for handler in active_destinations.values():
+        if isinstance(handler.destination, ConcurrentDestination):
+            await handler.async_shutdown()
+        else:
+            handler.shutdown()
 
 
 async def main():
 
     global tick_counter
-    latest_delivery_time = pd.Timestamp('now')
-    event_time=start_time
-    for asm_snapshot in assembly_runner:
-        next_tick_at = pd.Timestamp('now') + pd.Timedelta(tick_duration / pace, unit='s')
-        event_time = event_time + tick_duration
+    scheduler = DeliveryScheduler(deliver_messages,
+                                  slot=get_param_value('delivery_slot'),
+                                  now=time.monotonic_ns, clock_rate=NS_PER_SECOND,
+                                  backpressure=destinations_saturated,
+                                  poll=poll_destinations,
+                                  observe_lag=None if profiler is None else partial(
+                                      profiler.observe, 'delivery_lag_seconds'))
+    scheduler_task = asyncio.ensure_future(scheduler.run())
+    start_destinations()
+    # wall clock: monotonic ns; assembly's clock: ns since the epoch
+    started_at = time.monotonic_ns()
+    for tick_number, asm_snapshot in enumerate(assembly_runner, start=first_tick + 1):
+        next_tick_at = started_at + seconds_to_ns(
+            (tick_number - first_tick) * assembly.tick / pace)
+        event_ns = start_ns + tick_number * tick_ns
 
         for reading in asm_snapshot.readings:
             if reading.value is None or not reading.arrived:
                 continue
-            arrival_time = event_time + pd.Timedelta(reading.arrival_delay, unit='s')
-            delivery_time = next_tick_at + pd.Timedelta(reading.arrival_delay / pace, unit='s')
-            asyncio.ensure_future(deliver_datapoint(
-                reading, 'reading', delivery_time, event_time, arrival_time))
-            if delivery_time > latest_delivery_time:
-                latest_delivery_time = delivery_time
+            arrival_ns = event_ns + seconds_to_ns(reading.arrival_delay)
+            delivery_time = next_tick_at + seconds_to_ns(reading.arrival_delay / pace)
+            scheduler.schedule(delivery_time, ('reading', reading.signal_name,
+                format_message(reading, 'reading', event_ns, arrival_ns)))
 
         for truth in asm_snapshot.truths:
-            asyncio.ensure_future(deliver_datapoint(
-                truth, 'truth', next_tick_at, event_time))
-            if next_tick_at > latest_delivery_time:
-                latest_delivery_time = next_tick_at
+            scheduler.schedule(next_tick_at, ('truth', truth.signal_name,
+                format_message(truth, 'truth', event_ns)))
 
+        if checkpoint_filename is not None and tick_number % checkpoint_every == 0:
+            write_checkpoint(tick_number)
 
         if not tick_counter is None:
             if tick_counter == 0:
                 break
             tick_counter -= 1
 
-        wait_until_next_tick = (next_tick_at - pd.Timestamp('now')).total_seconds()
+        wait_until_next_tick = (next_tick_at - time.monotonic_ns()) / NS_PER_SECOND
+        if profiler is not None:
+            profiler.observe('tick_lag_seconds', max(-wait_until_next_tick, 0))
         await asyncio.sleep(wait_until_next_tick)
         if wait_until_next_tick < 0:
             raise RuntimeError("Pace is too fast. System fell behind.")
 
-    await asyncio.sleep(
-        (latest_delivery_time - pd.Timestamp('now')).total_seconds() + 1
-    )
+    scheduler.close()
+    await scheduler_task
+    await shutdown_destinations()
+    write_profile()
+    if checkpoint_filename is not None:
+        write_checkpoint(tick_number)
+    if scheduler.late_counter > 0:
+        print("{} of {} messages were delivered behind assembly's schedule".format(
+              scheduler.late_counter, scheduler.delivered_counter), file=sys.stderr)
 
     if not tick_counter is None and tick_counter > 0:
         sys.exit("Assembly ran out after {} ticks whish is less than required {}".
                  format(ticks - tick_counter, ticks))
 
+### Define the flow of the messages on the simulated clock
+
+async def run_fast():
+    """Run the assembly without waiting and return the number of messages sent.
+
+       A message is sent when the simulated clock reaches its arrival time,
+       so the messages go to destinations in the order of arrival.
+    """
+    queue = ArrivalQueue()
+    for arrival_ns, message in pending_messages:
+        queue.push(arrival_ns, message)
+    sent_counter = 0
+    start_destinations()
+
+    async def send_due(until):
+        nonlocal sent_counter
+        # let concurrent destinations make progress
+        await asyncio.sleep(0)
+        while destinations_saturated():
+            await asyncio.sleep(get_param_value('delivery_slot'))
+            for handler in active_destinations.values():
+                handler.flush()
+        messages = [message for _, message in queue.pop_due(until)]
+        deliver_messages(messages)
+        sent_counter += len(messages)
+
+    snapshots = enumerate(assembly_runner, start=first_tick + 1)
+    if ticks is not None:
+        snapshots = islice(snapshots, ticks)
+    processed_ticks = first_tick
+    for tick_number, asm_snapshot in snapshots:
+        event_ns = start_ns + tick_number * tick_ns
+        for reading in asm_snapshot.readings:
+            if reading.value is None or not reading.arrived:
+                continue
+            arrival_ns = event_ns + seconds_to_ns(reading.arrival_delay)
+            queue.push(arrival_ns, ('reading', reading.signal_name,
+                format_message(reading, 'reading', event_ns, arrival_ns)))
+        for truth in asm_snapshot.truths:
+            queue.push(event_ns, ('truth', truth.signal_name,
+                format_message(truth, 'truth', event_ns)))
+        await send_due(event_ns)
+        processed_ticks = tick_number
+        if checkpoint_filename is not None and tick_number % checkpoint_every == 0:
+            write_checkpoint(tick_number, queue.pending())
+
+    if checkpoint_filename is not None:
+        # the run may be resumed later, so the messages that have not arrived
+        # yet are saved instead of sent
+        write_checkpoint(processed_ticks, queue.pending())
+        queue = ArrivalQueue()
+    await send_due(float('inf'))
+    await shutdown_destinations()
+    write_profile()
+    if ticks is not None and processed_ticks - first_tick < ticks:
+        sys.exit("Assembly ran out after {} ticks whish is less than required {}".
+                 format(processed_ticks - first_tick, ticks))
+    return sent_counter
+
 ### Run
 
+if get_param_value('fast'):
+    started_at = time.perf_counter()
+    sent_counter = asyncio.run(run_fast())
+    elapsed = time.perf_counter() - started_at
+    print("Sent {} messages in {:.2f} s ({:.0f} messages/s)".format(
+          sent_counter, elapsed, sent_counter / elapsed if elapsed > 0 else 0),
+          file=sys.stderr)
+    sys.exit()
+
 loop = asyncio.get_event_loop()
 task = loop.create_task(main())
 loop.run_until_complete(task)